@@ -0,0 +1,279 @@
+"""
+Offline throughput benchmarks for the generator, TME filter and ranker.
+
+Sweeps sequence counts and length ranges and records sequences/sec and peak
+memory per case in a JSON baseline that later runs can be compared against.
+The ranker uses a small randomly initialized BERT built locally (same
+vocabulary as TCR-BERT), so no network access is needed; scores are
+meaningless but the compute per forward pass is representative of the
+chosen model size. Each case runs in a fresh process so its peak RSS is
+its own.
+
+Run from tcr-agent-with-graph/:
+    python benchmarks/run_benchmarks.py                   # full sweep
+    python benchmarks/run_benchmarks.py --quick           # smoke-sized sweep
+    python benchmarks/run_benchmarks.py --compare results/benchmarks/baseline-<commit>.json
+"""
+import os
+import sys
+import json
+import time
+import queue
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import traceback
+import subprocess
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+# Special tokens first, as in the TCR-BERT vocabulary
+VOCAB = ["[PAD]", "[MASK]", "[UNK]", "[SEP]", "[CLS]"] + list(AMINO_ACIDS)
+# tiny: smoke-test sized; base: TCR-BERT's architecture (BERT-base) with random weights
+MODEL_SIZES = {
+    "tiny": dict(hidden_size=64, num_hidden_layers=2, num_attention_heads=2, intermediate_size=128),
+    "base": dict(hidden_size=768, num_hidden_layers=12, num_attention_heads=12, intermediate_size=3072),
+}
+FULL_SWEEP = {
+    "generator": [10**2, 10**3, 10**4, 10**5, 10**6],
+    "filter": [10**2, 10**3, 10**4, 10**5, 10**6],
+    "ranker": [10**2, 10**3, 10**4],
+}
+QUICK_SWEEP = {"generator": [10**2, 10**3], "filter": [10**2, 10**3], "ranker": [10**2]}
+LENGTHS = ["8-12", "10-20", "20-40"]
+
+def build_model(directory, size="tiny", seed=0, max_length=62):
+    """
+    Saves a randomly initialized BertForMaskedLM and its tokenizer to
+    directory, with positions for sequences of up to max_length residues.
+    """
+    import torch
+    from transformers import BertConfig, BertForMaskedLM, BertTokenizer
+    vocab_file = os.path.join(directory, "vocab.txt")
+    with open(vocab_file, "w") as f:
+        f.write("\n".join(VOCAB) + "\n")
+    torch.manual_seed(seed)
+    # Two extra positions for CLS and SEP
+    config = BertConfig(vocab_size=len(VOCAB), max_position_embeddings=max_length + 2, **MODEL_SIZES[size])
+    BertForMaskedLM(config).save_pretrained(directory)
+    BertTokenizer(vocab_file, do_lower_case=False).save_pretrained(directory)
+    return directory
+
+def random_sequences(n, lengths, seed=0):
+    lo, hi = (int(x) for x in lengths.split("-"))
+    rng = random.Random(seed)
+    return ["".join(rng.choices(AMINO_ACIDS, k=rng.randint(lo, hi))) for _ in range(n)]
+
+def _current_rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+def _reset_peak_rss():
+    """
+    Resets the kernel's RSS high-water mark (VmHWM) so a case's peak isn't
+    hidden by import-time allocations. Returns False where unsupported.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _timed(fn, min_seconds, max_repeats):
+    # Repeat short cases until min_seconds have elapsed; the best run is reported
+    times = []
+    while True:
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+        if sum(times) >= min_seconds or len(times) >= max_repeats:
+            return min(times), len(times)
+
+def _run_case(case, model_dir, config_path, min_seconds, max_repeats, results):
+    """Worker process body: sends back the case's record, or its traceback as record["error"]."""
+    try:
+        results.put(_measure(case, model_dir, config_path, min_seconds, max_repeats))
+    except Exception:
+        results.put(dict(case, error=traceback.format_exc()))
+
+def _measure(case, model_dir, config_path, min_seconds, max_repeats):
+    """Builds the inputs, then times one component."""
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+    random.seed(0)
+    extra = {}
+    if case["component"] == "generator":
+        from src.generator import _mock_generate
+        fn = lambda: _mock_generate(case["count"])
+    elif case["component"] == "filter":
+        import yaml
+        from src.tme_filters import TMEFilter
+        with open(config_path) as f:
+            tme_filter = TMEFilter(yaml.safe_load(f))
+        sequences = random_sequences(case["count"], case["lengths"])
+        fn = lambda: tme_filter.apply_all(sequences)
+    else:
+        from src.ranker import TCRRanker
+        ranker = TCRRanker(model_dir, scoring_mode=case["scoring_mode"], precision=case["precision"])
+        sequences = random_sequences(case["count"], case["lengths"])
+        ranker.score_sequences(sequences[:8])  # warm-up: first-call allocations and kernel selection
+        fn = lambda: ranker.score_sequences(sequences)
+
+    rss_before = _current_rss_mb() if _reset_peak_rss() else _peak_rss_mb()
+    if case["component"] == "ranker":
+        start_stats = ranker.forward_stats()
+    seconds, repeats = _timed(fn, min_seconds, max_repeats)
+    peak_rss = _peak_rss_mb()
+    if case["component"] == "ranker":
+        stats = ranker.forward_stats()
+        passes = stats["forward_passes"] - start_stats["forward_passes"]
+        tokens = stats["tokens"] - start_stats["tokens"]
+        extra = {
+            "forward_passes": passes // repeats,
+            "tokens_per_sec": tokens / repeats / seconds,
+            "padding_overhead": stats["padding_overhead"],
+        }
+    return dict(case, seconds=seconds, repeats=repeats, seqs_per_sec=case["count"] / seconds,
+                peak_rss_mb=peak_rss, rss_delta_mb=peak_rss - rss_before, **extra)
+
+def run_case(case, model_dir, config_path, min_seconds=1.0, max_repeats=5):
+    """
+    Runs one case in a fresh (spawned) process and returns its record. A
+    case that raises, or whose process dies (e.g. killed for memory),
+    comes back with an "error" entry instead of throughput numbers.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    proc = ctx.Process(target=_run_case, args=(case, model_dir, config_path, min_seconds, max_repeats, results))
+    proc.start()
+    while True:
+        try:
+            record = results.get(timeout=1.0)
+            break
+        except queue.Empty:
+            if proc.is_alive():
+                continue
+        # The process has exited; a result it sent just before may still be in flight
+        try:
+            record = results.get(timeout=1.0)
+        except queue.Empty:
+            record = dict(case, error=f"benchmark process exited with code {proc.exitcode} before reporting")
+        break
+    proc.join()
+    return record
+
+def environment():
+    import torch
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+    }
+
+def case_key(record):
+    # Ranker cases only compare against runs with the same model and scoring settings
+    return (record["component"], record["count"], record.get("lengths"),
+            record.get("scoring_mode"), record.get("precision"), record.get("model_size"))
+
+def compare(current, baseline_path, tolerance=0.1):
+    """Prints throughput vs a saved baseline; returns the regressed cases."""
+    with open(baseline_path) as f:
+        baseline = {case_key(r): r for r in json.load(f)["results"]}
+    regressions = []
+    print(f"\nvs {baseline_path}:")
+    for record in current["results"]:
+        old = baseline.get(case_key(record))
+        if old is None or "error" in record or "error" in old:
+            continue
+        ratio = record["seqs_per_sec"] / old["seqs_per_sec"]
+        flag = ""
+        if ratio < 1 - tolerance:
+            flag = "  REGRESSION"
+            regressions.append(record)
+        print(f"  {record['component']:9s} n={record['count']:<8d} {record.get('lengths') or '':6s} "
+              f"{old['seqs_per_sec']:12.1f} -> {record['seqs_per_sec']:12.1f} seq/s ({ratio:.2f}x){flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline generator/filter/ranker throughput benchmarks")
+    parser.add_argument("--components", nargs="+", choices=list(FULL_SWEEP), default=list(FULL_SWEEP))
+    parser.add_argument("--quick", action="store_true", help="Small counts and one length range")
+    parser.add_argument("--counts", type=int, nargs="+", help="Override the sequence counts for every component")
+    parser.add_argument("--lengths", nargs="+", default=None, help="Length ranges, e.g. 10-20 20-40")
+    parser.add_argument("--model-size", choices=list(MODEL_SIZES), default="tiny")
+    parser.add_argument("--scoring-mode", default="exact")
+    parser.add_argument("--precision", default="fp32")
+    parser.add_argument("--config", default="configs/solid_tumor_job.yaml", help="Job config providing tme_constraints")
+    parser.add_argument("--min-seconds", type=float, default=1.0, help="Repeat each case until this much time has run")
+    parser.add_argument("--output", default=None, help="Baseline JSON path (default results/benchmarks/baseline-<commit>.json)")
+    parser.add_argument("--compare", default=None, metavar="BASELINE", help="Report throughput change vs this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Slowdown fraction counted as a regression")
+    args = parser.parse_args()
+
+    sweep = QUICK_SWEEP if args.quick else FULL_SWEEP
+    lengths = args.lengths or (["10-20"] if args.quick else LENGTHS)
+    cases = []
+    for component in args.components:
+        for count in args.counts or sweep[component]:
+            # _mock_generate picks its own lengths
+            for length in ([None] if component == "generator" else lengths):
+                case = {"component": component, "count": count, "lengths": length}
+                if component == "ranker":
+                    case.update(scoring_mode=args.scoring_mode, precision=args.precision, model_size=args.model_size)
+                cases.append(case)
+
+    report = {"environment": environment(), "results": []}
+    with tempfile.TemporaryDirectory() as model_dir:
+        if "ranker" in args.components:
+            longest = max(int(length.split("-")[1]) for length in lengths)
+            build_model(model_dir, args.model_size, max_length=longest)
+        for case in cases:
+            record = run_case(case, model_dir, args.config, min_seconds=args.min_seconds)
+            report["results"].append(record)
+            if "error" in record:
+                print(f"{record['component']:9s} n={record['count']:<8d} {record.get('lengths') or '':6s} "
+                      f"FAILED:\n{record['error']}", flush=True)
+                continue
+            print(f"{record['component']:9s} n={record['count']:<8d} {record.get('lengths') or '':6s} "
+                  f"{record['seqs_per_sec']:12.1f} seq/s  {record['seconds']:8.3f}s  "
+                  f"peak RSS {record['peak_rss_mb']:7.1f} MB (+{record['rss_delta_mb']:.1f})", flush=True)
+
+    output = args.output or os.path.join(
+        "results", "benchmarks", f"baseline-{(report['environment']['commit'] or 'local')[:8]}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved benchmark baseline to {output}")
+
+    failed = [r for r in report["results"] if "error" in r]
+    if failed:
+        print(f"{len(failed)} of {len(report['results'])} cases failed.")
+    if (args.compare and compare(report, args.compare, args.tolerance)) or failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,64 @@
+import time
+_STARTED = time.perf_counter()  # before the heavy imports, for cold-start reporting
+
 import os
+import logging
+import argparse
 from src.agent import ImmunotherapyAgent
 
 def main():
-    config_path = "configs/solid_tumor_job.yaml"
+    parser = argparse.ArgumentParser(description="TCR Agent Runner")
+    parser.add_argument("--config", type=str, default="configs/solid_tumor_job.yaml", help="Path to config yaml")
+    parser.add_argument("--calibrate", type=int, metavar="N", default=None,
+                        help="Report rank fidelity/speed of approximate scoring modes vs exact PLL on N candidates, then exit")
+    parser.add_argument("--precision-parity", type=int, metavar="N", default=None,
+                        help="Compare the configured ranker precision against fp32 on N candidates, then exit")
+    parser.add_argument("--resume", nargs="?", const="latest", default=None, metavar="RUN_DIR",
+                        help="Resume an interrupted run (default: the latest run with this config), skipping completed stages")
+    parser.add_argument("--dry-run", "--filter-only", action="store_true", dest="dry_run",
+                        help="Generate and TME-filter only; never loads the ranking model")
+    parser.add_argument("--mutational-scan", nargs="?", const="lead", default=None, metavar="CDR3",
+                        help="Score every single-point mutant of CDR3 (default: the top of results/candidates.csv), then exit")
+    parser.add_argument("--rescore-top", type=int, default=20, metavar="N",
+                        help="With --mutational-scan: re-score the N best mutants with exact PLL")
+    parser.add_argument("--dock", nargs="?", const="latest", default=None, metavar="JOB_CSV",
+                        help="Run a docking job file locally (default: this target's last job), retrying only failed candidates")
+    parser.add_argument("--batch", nargs="+", metavar="PATH", default=None,
+                        help="Run every job YAML in these files/directories in one process, sharing the ranker and caches")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="With --batch: spread jobs over N processes (each loads the model once)")
+    parser.add_argument("--share-pool", action="store_true",
+                        help="With --batch: screen one generated pool against every target instead of generating per target")
+    args = parser.parse_args()
     
     # Ensure results directory exists (handled in agent but good to have here too or just rely on agent)
     if not os.path.exists("results"):
         os.makedirs("results")
         
-    agent = ImmunotherapyAgent(config_path)
+    if args.batch:
+        from src.batch import run_batch
+        logging.basicConfig(level=logging.INFO, format='[AI-AGENT] %(message)s')
+        run_batch(args.batch, workers=args.workers, share_pool=args.share_pool)
+        return
+
+    agent = ImmunotherapyAgent(args.config, resume=args.resume, started=_STARTED)
+    if args.dry_run:
+        agent.run_filter_only()
+        return
+    if args.dock:
+        agent.dock_job(None if args.dock == "latest" else args.dock)
+        return
+    if args.mutational_scan:
+        lead = None if args.mutational_scan == "lead" else args.mutational_scan
+        agent.mutational_scan(lead, rescore_top=args.rescore_top)
+        return
+    if args.calibrate:
+        agent.calibrate_ranker(sample_size=args.calibrate)
+        return
+    if args.precision_parity:
+        agent.check_precision_parity(sample_size=args.precision_parity)
+        return
     agent.run_design_cycle()
 
 if __name__ == "__main__":
     main()
-
@@ -1,9 +1,27 @@
+import os
+import sys
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from Bio.SeqUtils.ProtParam import ProteinAnalysis
 import random
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+STORE_DIR = "results/candidates"
+
+def load_run_data(path=STORE_DIR):
+    """
+    GRAVY, score and status from the candidate store written by the agent
+    (only those columns are read, memory-mapped). None if no run is recorded.
+    """
+    if not os.path.isdir(path) or not os.listdir(path):
+        return None
+    from src.candidate_store import load_candidates
+    df = load_candidates(path, columns=['gravy', 'score', 'status']).to_pandas()
+    df = df[df['gravy'].notna()]
+    return df if len(df) else None
+
 # Mock data generation for visualization
 def generate_mock_data(n=200):
     data = []
@@ -27,7 +45,33 @@ def generate_mock_data(n=200):
     
     return pd.DataFrame(data)
 
+def plot_run(df, gravy_threshold=0.5):
+    # Real runs: only survivors are scored, so rejections are shown as ticks under the axis
+    ranked = df[df['status'] == 'ranked']
+    rejected = df[df['status'] == 'rejected']
+
+    plt.figure(figsize=(10, 6))
+    plt.scatter(ranked['gravy'], ranked['score'], c='green', alpha=0.6, label=f'Passed & Ranked ({len(ranked)})')
+    floor = ranked['score'].min() if len(ranked) else 0.0
+    plt.plot(rejected['gravy'], np.full(len(rejected), floor), '|', color='red', alpha=0.4, markersize=12,
+             label=f'Rejected by TME filter ({len(rejected)})')
+    plt.axvline(x=gravy_threshold, color='black', linestyle='--', label='Max Hydrophobicity Threshold')
+
+    plt.title('TCR Candidate Selection: TME Survival vs. TCR-BERT PLL')
+    plt.xlabel('Tonic Signaling Risk (Hydrophobicity / GRAVY)')
+    plt.ylabel('TCR-BERT PLL Score')
+    plt.legend()
+    plt.grid(True, alpha=0.3)
+
+    plt.savefig('results/selection_plot.png')
+    print("Plot saved to results/selection_plot.png")
+
 def plot_selection():
+    run_data = load_run_data()
+    if run_data is not None:
+        plot_run(run_data)
+        return
+
     df = generate_mock_data(300)
     
     # Thresholds
@@ -1,22 +1,202 @@
 import yaml
 import logging
 import os
-import pandas as pd
-from src.generator import generate_sequences_evo2
+import json
+import time
+import random
+import functools
+import threading
+import numpy as np
+from src.generator import stream_sequences_evo2
 from src.tme_filters import TMEFilter
-from src.ranker import TCRRanker
-from src.structure import prepare_docking_job
+from src.structure import prepare_docking_job, run_docking_job
+from src.score_cache import ScoreCache
+from src.pipeline import StreamingPipeline
+from src.dedup import DedupIndex
+from src.checkpoint import RunCheckpoint, CheckpointedRanker, STAGES, config_hash
+from src.candidate_store import CandidateStore
+from src.candidate_table import CandidateTable, PASSED, DUPLICATE, RANKED
+from src.oversampling import SurvivorSampler
+from src.instrumentation import RunMetrics, torch_profile
+
+class _LazyRanker:
+    """
+    Stands in for the agent's ranker so pipelines and wrappers can be built
+    before the model is; the first attribute access loads it.
+    """
+
+    def __init__(self, agent):
+        self._agent = agent
+
+    def __getattr__(self, name):
+        return getattr(self._agent.ranker, name)
 
 class ImmunotherapyAgent:
-    def __init__(self, config_path):
+    def __init__(self, config_path, resume=None, started=None, results_dir="results", shared=None):
+        # perf_counter() at process start (main.py), for cold-start reporting
+        self.started = started if started is not None else time.perf_counter()
+        init_start = time.perf_counter()
         with open(config_path) as f:
             self.config = yaml.safe_load(f)
         self.logger = self._setup_logger()
-        self.filter_module = TMEFilter(self.config)
+        # None = fresh run; "latest" or a run directory = resume from that checkpoint
+        self.resume = resume
+        self.checkpoint = None
+        self.store = None
+        # CandidateTable of a phased run with pipeline.candidate_table enabled
+        self.table = None
+        self.run_id = None
+        # CSV/JSON outputs of this job (batch runs give each target its own directory)
+        self.results_dir = results_dir
+        # Rankers, caches and generation pools reused across jobs (see src.batch.SharedResources)
+        self.shared = shared
+        # Per-stage timings; model loading is timed here, the rest per design cycle
+        self.metrics = RunMetrics()
+        self.filter_module = TMEFilter(self.config, property_cache=shared.property_cache if shared else None)
+        self.deduper = None  # fresh DedupIndex per design cycle
+        # {candidate: [nearest known binders]} from search_binders
+        self.binder_neighbors = {}
+        # {candidate: docking task result} when docking.execute is set
+        self.docking_results = {}
         
-        # Initialize Ranker
+        # The ranker (torch, transformers, BERT weights) is built on first use; see `ranker`
+        ranker_params = self.config.get('ranker_parameters', {})
+        cache_cfg = ranker_params.get('score_cache')
+        if cache_cfg:
+            self.score_cache = shared.score_cache(cache_cfg) if shared else ScoreCache(**cache_cfg)
+        else:
+            self.score_cache = None
+        self.scoring_mode = ranker_params.get('scoring_mode', 'exact')
+        self.precision = ranker_params.get('precision', 'fp32')
+        self._ranker = None
+        self._ranker_lock = threading.Lock()
+        # Counters of a shared ranker when this job got it, so metrics cover this job only
+        self._ranker_baseline = None
+        self.cold_start = {
+            'imports_seconds': init_start - self.started,
+            'init_seconds': time.perf_counter() - init_start,
+        }
+
+    @property
+    def ranker(self):
+        """
+        TCR-BERT ranker, loaded on first access. A warm-up thread started by
+        run_design_cycle may already be loading it; callers wait for that.
+        """
+        if self._ranker is None:
+            with self._ranker_lock:
+                if self._ranker is None:
+                    if self.shared:
+                        # One ranker per model/settings serves every job of a batch
+                        ranker = self.shared.ranker(self._ranker_key(), self._build_ranker)
+                        self._ranker_baseline = ranker.forward_stats()
+                        self._ranker = ranker
+                    else:
+                        self._ranker = self._build_ranker()
+        return self._ranker
+
+    def _ranker_key(self):
+        """Everything that determines which ranker this job needs."""
+        ranker_params = self.config.get('ranker_parameters', {})
+        settings = {k: ranker_params.get(k) for k in (
+            'max_batch_size', 'model_revision', 'scoring_mode', 'mask_k', 'precision',
+            'num_workers', 'threads_per_worker', 'score_cache', 'server'
+        )}
+        return json.dumps([self.config.get('bert_model_path', 'wukevin/tcr-bert'), settings], sort_keys=True)
+
+    def _ranker_stats(self):
+        """The ranker's counters for this job (a shared ranker's minus those at hand-over)."""
+        stats = self._ranker.forward_stats()
+        if self._ranker_baseline:
+            for key, value in self._ranker_baseline.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and key in stats:
+                    stats[key] -= value
+            if 'tokens' in stats:
+                stats['tokens_per_sec'] = stats['tokens'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+        return stats
+
+    def _build_ranker(self, allow_remote=True):
+        """
+        Client for the resident ranking server when ranker_parameters.server is
+        set and a compatible server answers there; otherwise an in-process ranker.
+        """
         bert_path = self.config.get('bert_model_path', 'wukevin/tcr-bert')
-        self.ranker = TCRRanker(bert_path)
+        ranker_params = self.config.get('ranker_parameters', {})
+        with self.metrics.stage('model_load'):
+            start = time.perf_counter()
+            ranker = self._connect_server(bert_path, ranker_params) if allow_remote else None
+            if ranker is None:
+                # Deferred import: torch and transformers alone take seconds to import
+                from src.ranker import build_ranker
+                ranker = build_ranker(bert_path, ranker_params, cache=self.score_cache)
+                if self.config.get('binder_search', {}).get('enabled', False) and ranker.embedding_store is None:
+                    # Unmasked scoring passes leave embeddings behind for the binder search
+                    ranker.embedding_store = {}
+        self.cold_start['model_load_seconds'] = time.perf_counter() - start
+        return ranker
+
+    def _connect_server(self, bert_path, ranker_params):
+        address = ranker_params.get('server')
+        if not address:
+            return None
+        from src.ranking_server import RemoteRanker, RankingServerError
+        try:
+            remote = RemoteRanker(address, timeout=ranker_params.get('server_timeout', 600), fallback=self._server_fallback)
+        except (OSError, ValueError, RankingServerError) as e:
+            self.logger.warning(f"Ranking server {address} unavailable ({e}); scoring in-process.")
+            return None
+        # Scores must come from the model and settings this job asked for
+        expected = {
+            'model_path': bert_path,
+            'revision': ranker_params.get('model_revision'),
+            'scoring_mode': self.scoring_mode,
+            'precision': self.precision,
+            'mask_k': ranker_params.get('mask_k', 4),
+        }
+        mismatched = {k: remote.info.get(k) for k, v in expected.items() if remote.info.get(k) != v}
+        if mismatched:
+            self.logger.warning(f"Ranking server {address} serves {mismatched}, not this job's settings; scoring in-process.")
+            return None
+        self.logger.info(f"Scoring via ranking server {address} (pid {remote.info.get('pid')}).")
+        return remote
+
+    def _server_fallback(self):
+        """Takes over from a ranking server that failed mid-run: the in-process ranker, from then on."""
+        self._ranker_baseline = None
+        return self._local_ranker()
+
+    def _local_ranker(self):
+        """In-process ranker, for tools that need the model itself (calibration, parity)."""
+        if self._ranker is None or self._ranker.model is None:
+            with self._ranker_lock:
+                if self._ranker is None or self._ranker.model is None:
+                    self._ranker = self._build_ranker(allow_remote=False)
+        return self._ranker
+
+    def _start_warm_up(self):
+        """
+        Loads the ranker in a background thread (ranker_parameters.warm_start)
+        so it overlaps generation and filtering instead of preceding them.
+        """
+        if self._ranker is not None or not self.config.get('ranker_parameters', {}).get('warm_start', False):
+            return
+
+        def warm_up():
+            try:
+                self.ranker
+            except Exception as e:
+                # Surfaces again, in the main thread, when ranking needs the model
+                self.logger.warning(f"Background model warm-up failed: {e}")
+
+        threading.Thread(target=warm_up, name="ranker-warm-up", daemon=True).start()
+        self.logger.info("Warming up TCR-BERT in the background...")
+
+    def _watch_first_filtered(self):
+        """Records when the first filter batch completes (cold start to first result)."""
+        def listener(sequences, props, rejected_by, logs):
+            self.filter_module.listeners.remove(listener)
+            self.cold_start['first_filtered_seconds'] = time.perf_counter() - self.started
+        self.filter_module.listeners.append(listener)
 
     def _setup_logger(self):
         logging.basicConfig(level=logging.INFO, format='[AI-AGENT] %(message)s')
@@ -26,53 +206,834 @@ class ImmunotherapyAgent:
         target = self.config['target']['name']
         self.logger.info(f"--- INIT: Designing T-cells for Solid Tumor Target: {target} ---")
         
-        # 1. Generation (NVIDIA Evo2)
-        self.logger.info("Step 1: Generating candidates via NVIDIA Evo2...")
-        evo_params = self.config.get('evo2_parameters', {})
         n_seqs = self.config['design_parameters']['num_sequences']
-        
-        raw_seqs = generate_sequences_evo2(
-            num_tokens=20, # Default
-            top_k=evo_params.get('top_k', 4),
-            temperature=evo_params.get('temperature', 1.0),
-            n_sequences=n_seqs
-        )
-        self.logger.info(f"Generated {len(raw_seqs)} raw CDR3 sequences.")
+        pipeline_cfg = self.config.get('pipeline', {})
+        self.deduper = self._make_deduper()
+        # top_k: budgeted successive halving finds the docking candidates without exact-scoring everyone
+        top_k_mode = self.config.get('ranker_parameters', {}).get('selection', 'full') == 'top_k'
+        # Generate until this many candidates pass the filter, instead of num_sequences raw ones
+        target_survivors = self.config.get('oversampling', {}).get('target_survivors')
 
-        # 2. TME/Exhaustion Filtering (CRITICAL)
-        self.logger.info("Step 2: Filtering for TME Survival & Low Exhaustion Risk...")
-        clean_seqs, logs = self.filter_module.apply_all(raw_seqs)
-        
-        rejection_rate = (1 - len(clean_seqs)/len(raw_seqs)) * 100 if raw_seqs else 0
-        self.logger.info(f"TME Filter removed {rejection_rate:.1f}% of candidates (Risk of Tonic Signaling/Instability).")
-        self.logger.info(f"Candidates remaining: {len(clean_seqs)}")
+        self.checkpoint = self._open_checkpoint()
+        if self.checkpoint:
+            self.run_id = os.path.basename(self.checkpoint.run_dir)
+        else:
+            self.run_id = self._new_run_id()
+        self.store = self._open_store('exact' if top_k_mode else self.scoring_mode)
+        # Phased resumes skip the filter, which is what feeds the store; see _replay_filtering
+        replay_store = bool(self.store and self.checkpoint and self.checkpoint.is_done('filtering'))
+        self._watch_first_filtered()
+        self._start_warm_up()
+        ranker = _LazyRanker(self)
+        if self.checkpoint:
+            interval = self.config.get('checkpoint_parameters', {}).get('ranking_interval', 256)
+            ranker = CheckpointedRanker(ranker, self.checkpoint, interval)
 
-        if not clean_seqs:
-            self.logger.warning("No sequences survived TME filtering. Aborting.")
-            return
+        if pipeline_cfg.get('mode', 'phased') == 'streaming' and not target_survivors:
+            # 1-3. Generation, filtering and ranking overlap via bounded queues.
+            # On resume, checkpointed generations are replayed (filtering is cheap to
+            # redo) and checkpointed ranking scores are reused rather than recomputed.
+            self.logger.info("Steps 1-3: Streaming Evo2 generation -> TME filtering -> TCR-BERT ranking...")
+            pipeline = StreamingPipeline(
+                self.filter_module,
+                None if top_k_mode else ranker,
+                queue_size=pipeline_cfg.get('queue_size', 256),
+                filter_chunk=pipeline_cfg.get('filter_chunk', 32),
+                rank_batch_size=pipeline_cfg.get('rank_batch_size', 64),
+                deduper=self.deduper,
+                metrics=self.metrics
+            )
+            with self.metrics.stage('streaming') as span, self._profile_ranking(not top_k_mode):
+                n_raw, clean_seqs, logs, ranked_candidates = pipeline.run(self._resumable_stream(n_seqs))
+                span['items'] = n_raw
+            self.logger.info(f"Generated {n_raw} raw CDR3 sequences.")
+            if self.checkpoint:
+                if not self.checkpoint.is_done('generation'):
+                    self.checkpoint.save('generation', self.checkpoint.load_partial('generation'))
+                self.checkpoint.save('filtering', {'clean': clean_seqs, 'logs': logs})
+            n_clean = self.deduper.stats()['sequences'] if self.deduper else len(clean_seqs)
+            self._log_filter_summary(n_raw, n_clean)
+            if self.deduper:
+                self._log_dedup_summary()
+            if not clean_seqs:
+                self.logger.warning("No sequences survived TME filtering. Aborting.")
+                self._close_store()
+                self._write_metrics()
+                return []
+            if top_k_mode:
+                with self.metrics.stage('ranking', len(clean_seqs)), self._profile_ranking():
+                    ranked_candidates = self._run_stage('ranking', lambda: self._select_top_k(clean_seqs))
+            elif self.checkpoint:
+                self.checkpoint.save('ranking', ranked_candidates)
+        else:
+            if target_survivors:
+                # 1-2. Generation and filtering interleaved (dedup too), in rounds sized from the live rejection rate
+                self.logger.info(f"Steps 1-2: Generating until {target_survivors} candidates pass TME filtering...")
+                with self.metrics.stage('oversampling') as span:
+                    filtered = self._run_stage('filtering', lambda: self._oversample(target_survivors))
+                    span['items'] = len(filtered['clean'])
+                if replay_store:
+                    self._replay_filtering(self.checkpoint.load_partial('generation'), dedup=True)
+                clean_seqs = filtered['clean']
+            else:
+                # Candidates in a packed CandidateTable rather than lists of strings
+                table_cfg = pipeline_cfg.get('candidate_table', {})
+                if table_cfg.get('enabled', False):
+                    self.table = self._open_table(n_seqs, table_cfg)
+
+                # 1. Generation (NVIDIA Evo2)
+                self.logger.info("Step 1: Generating candidates via NVIDIA Evo2...")
+                with self.metrics.stage('generation') as span:
+                    if self.table is not None:
+                        # The table, memory-mapped in the run directory, is this stage's checkpoint
+                        # (a JSON copy of every sequence is what it avoids)
+                        if not self._table_stage_done('generation'):
+                            self.table.extend_stream(self._resumable_stream(n_seqs))
+                            self._save_table_stage('generation')
+                        n_raw = len(self.table)
+                    else:
+                        raw_seqs = self._run_stage('generation', lambda: list(self._resumable_stream(n_seqs)))
+                        n_raw = len(raw_seqs)
+                    span['items'] = n_raw
+                self.logger.info(f"Generated {n_raw} raw CDR3 sequences.")
+
+                # 2. TME/Exhaustion Filtering (CRITICAL)
+                self.logger.info("Step 2: Filtering for TME Survival & Low Exhaustion Risk...")
+                with self.metrics.stage('filtering', n_raw):
+                    if self.table is not None:
+                        # Only the survivors are decoded back to strings
+                        if self._table_stage_done('filtering'):
+                            # Passed, duplicate and ranked rows all survived the filter
+                            clean_idx = np.flatnonzero(self.table.column('status') >= PASSED)
+                        else:
+                            clean_idx = self.filter_module.filter_table(self.table)
+                            self._save_table_stage('filtering')
+                        survivor_seqs = clean_seqs = self.table.sequences(clean_idx)
+                        if replay_store:
+                            self._replay_filtering(self.table.view(np.arange(n_raw)))
+                    else:
+                        filtered = self._run_stage('filtering', lambda: dict(zip(('clean', 'logs'), self.filter_module.apply_all(raw_seqs))))
+                        clean_seqs = filtered['clean']
+                        if replay_store:
+                            self._replay_filtering(raw_seqs)
+                self._log_filter_summary(n_raw, len(clean_seqs))
+
+            if not clean_seqs:
+                self.logger.warning("No sequences survived TME filtering. Aborting.")
+                self._close_store()
+                self._close_table()
+                self._write_metrics()
+                return []
 
-        # 3. Ranking (TCR-BERT)
-        self.logger.info("Step 3: Ranking candidates with TCR-BERT (PLL Scoring)...")
-        ranked_candidates = self.ranker.score_sequences(clean_seqs)
+            # Near-duplicates would each pay the full PLL cost; score one per cluster
+            # (already done per round when oversampling)
+            if self.deduper and not target_survivors:
+                with self.metrics.stage('dedup', len(clean_seqs)):
+                    clean_seqs = self.deduper.add(clean_seqs)
+                self._log_dedup_summary()
+            if self.table is not None:
+                table_rows = self._table_rows(clean_idx, survivor_seqs, clean_seqs)
+
+            # 3. Ranking (TCR-BERT)
+            self.logger.info("Step 3: Ranking candidates with TCR-BERT (PLL Scoring)...")
+            with self.metrics.stage('ranking', len(clean_seqs)), self._profile_ranking():
+                if top_k_mode:
+                    ranked_candidates = self._run_stage('ranking', lambda: self._select_top_k(clean_seqs))
+                else:
+                    ranked_candidates = self._run_stage('ranking', lambda: ranker.score_sequences(clean_seqs))
+            if self.table is not None:
+                self._record_table_scores(table_rows, ranked_candidates)
+        # JSON checkpoints store (seq, score) pairs as lists
+        ranked_candidates = [tuple(item) for item in ranked_candidates]
+        if self.store:
+            self.store.record_scores(ranked_candidates, self.deduper)
+
+        if self.score_cache:
+            stats = self.score_cache.stats()
+            self.logger.info(
+                f"Score cache: {stats['hits']} hits ({stats['disk_hits']} from disk), "
+                f"{stats['misses']} misses, {stats['evictions']} evicted."
+            )
         
         # Log top 3
         self.logger.info("Top 3 Candidates by BERT Score:")
         for i, (seq, score) in enumerate(ranked_candidates[:3]):
             self.logger.info(f"  #{i+1}: {seq} (PLL: {score:.4f})")
 
-        # 4. Structure (TCRDock Prep)
-        self.logger.info("Step 4: Preparing Top 5 Candidates for TCRDock...")
-        top_5 = ranked_candidates[:5]
-        prepare_docking_job(top_5, target)
+        if self.config.get('binder_search', {}).get('enabled', False):
+            self.logger.info("Searching known binders for the nearest neighbours of each candidate...")
+            with self.metrics.stage('binder_search', len(ranked_candidates)):
+                try:
+                    self.binder_neighbors = self.search_binders([seq for seq, _ in ranked_candidates])
+                finally:
+                    # The captured embeddings only serve this search; a ranker shared by
+                    # batch jobs would otherwise keep every job's candidates
+                    if getattr(self.ranker, 'embedding_store', None):
+                        self.ranker.embedding_store.clear()
+
+        # 4. Structure (TCRDock Prep, and docking itself when docking.execute is set)
+        docking_cfg = self.config.get('docking', {})
+        top_n = docking_cfg.get('top_n', 5)
+        self.logger.info(f"Step 4: Preparing Top {top_n} Candidates for TCRDock...")
+        top = ranked_candidates[:top_n]
+        with self.metrics.stage('docking', len(top)):
+            docking = self._run_stage('docking', lambda: self._dock(top, target, docking_cfg))
+        self.docking_results = {r['cdr3_sequence']: r for r in docking.get('results') or []}
+        if self.table is not None and self.docking_results:
+            self._record_table_docking(table_rows)
 
         # Export all results
-        self.export_results(ranked_candidates)
+        with self.metrics.stage('export', len(ranked_candidates)):
+            self.export_results(ranked_candidates)
+            self.export_filter_stats()
+            self._close_store()
+            self._close_table()
+        self._write_metrics()
+        if self.checkpoint:
+            self.checkpoint.close_partial()
+            self.logger.info(f"Run artifacts saved in {self.checkpoint.run_dir}")
+        return ranked_candidates
+
+    def run_filter_only(self):
+        """
+        Dry run: generation, TME filtering and dedup only, without ever
+        loading the ranking model. Survivors are saved to
+        <results_dir>/filtered_candidates.csv alongside the usual filter stats,
+        candidate store and run metrics.
+        """
+        target = self.config['target']['name']
+        self.logger.info(f"--- DRY RUN: TME filtering for target {target} (no ranking model) ---")
+        n_seqs = self.config['design_parameters']['num_sequences']
+        pipeline_cfg = self.config.get('pipeline', {})
+        self.deduper = self._make_deduper()
+        self.run_id = self._new_run_id()
+        self.store = self._open_store(None)
+        self._watch_first_filtered()
+
+        # Streaming without a ranker: chunks are filtered as they are generated
+        pipeline = StreamingPipeline(
+            self.filter_module,
+            None,
+            queue_size=pipeline_cfg.get('queue_size', 256),
+            filter_chunk=pipeline_cfg.get('filter_chunk', 32),
+            deduper=self.deduper,
+            metrics=self.metrics
+        )
+        with self.metrics.stage('streaming') as span:
+            n_raw, clean_seqs, _, _ = pipeline.run(self._generate_stream(n_seqs))
+            span['items'] = n_raw
+        self.logger.info(f"Generated {n_raw} raw CDR3 sequences.")
+        n_clean = self.deduper.stats()['sequences'] if self.deduper else len(clean_seqs)
+        self._log_filter_summary(n_raw, n_clean)
+        if self.deduper:
+            self._log_dedup_summary()
+
+        with self.metrics.stage('export', len(clean_seqs)):
+            import pandas as pd
+            os.makedirs(self.results_dir, exist_ok=True)
+            path = os.path.join(self.results_dir, "filtered_candidates.csv")
+            pd.DataFrame({
+                'CDR3': clean_seqs,
+                'Cluster_Size': [self.deduper.cluster_size(seq) if self.deduper else 1 for seq in clean_seqs],
+            }).to_csv(path, index=False)
+            self.logger.info(f"Saved filtered candidates to {path}")
+            self.export_filter_stats()
+            self._close_store()
+        self._write_metrics()
+        return clean_seqs
+
+    def _new_run_id(self):
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{config_hash(self.config)[:8]}"
+
+    def _open_checkpoint(self):
+        ckpt_cfg = self.config.get('checkpoint_parameters', {})
+        if not ckpt_cfg.get('enabled', False) and not self.resume:
+            return None
+        root = ckpt_cfg.get('dir', 'results/runs')
+        if self.resume == 'latest':
+            checkpoint = RunCheckpoint.latest(root, self.config)
+            if checkpoint is None:
+                self.logger.warning(f"No run to resume under {root} for this config; starting a new run.")
+                return RunCheckpoint.create(root, self.config)
+        elif self.resume:
+            checkpoint = RunCheckpoint(self.resume, self.config)
+        else:
+            return RunCheckpoint.create(root, self.config)
+        done = [stage for stage in STAGES if checkpoint.is_done(stage)]
+        self.logger.info(f"Resuming run {checkpoint.run_dir} (completed stages: {', '.join(done) or 'none'})")
+        return checkpoint
+
+    def _open_store(self, scoring_mode):
+        """
+        Columnar candidate store for this run (result_store in the config);
+        it listens to the filter so rejections are recorded as they happen.
+        """
+        store_cfg = self.config.get('result_store', {})
+        if not store_cfg.get('enabled', False):
+            return None
+        store = CandidateStore(
+            self.run_id,
+            directory=store_cfg.get('dir', 'results/candidates'),
+            fmt=store_cfg.get('format', 'arrow'),
+            chunk_rows=store_cfg.get('chunk_rows', 10000),
+            scoring_mode=scoring_mode,
+            precision=self.precision if scoring_mode else None
+        )
+        store.listener = functools.partial(store.record_filtered, self.filter_module)
+        self.filter_module.listeners.append(store.listener)
+        return store
+
+    def _oversample(self, target):
+        """
+        Runs a SurvivorSampler (oversampling section of the config) and
+        saves its report to <results_dir>/oversampling.json. Returns the
+        'filtering' stage output: {'clean', 'logs'}. Generated sequences go
+        to the partial generation log, so a resumed run filters them again
+        rather than paying for them twice.
+        """
+        cfg = self.config.get('oversampling', {})
+        replay = self.checkpoint.load_partial('generation') if self.checkpoint else []
+        if replay:
+            self.logger.info(f"  generation: replaying {len(replay)} checkpointed sequences.")
+
+        def make_stream(n):
+            for seq in self._generate_stream(n, pooled=False):
+                if self.checkpoint:
+                    self.checkpoint.append_partial('generation', [seq])
+                yield seq
+
+        sampler = SurvivorSampler(
+            self.filter_module, make_stream, target,
+            deduper=self.deduper,
+            prior_rejection=cfg.get('prior_rejection', 0.15),
+            prior_weight=cfg.get('prior_weight', 10),
+            max_batch=cfg.get('max_batch', 1024),
+            max_generated=cfg.get('max_generated'),
+            metrics=self.metrics
+        )
+        clean_seqs, logs, report = sampler.run(replay)
+
+        self.logger.info(
+            f"Oversampling: generated {report['generated']}, accepted {report['accepted']} "
+            f"({report['acceptance_rate']:.1%}) in {len(report['rounds'])} rounds for a target of {target}"
+            + (f"; {report['surplus']} surplus survivors not ranked." if report['surplus'] else ".")
+        )
+        if not report['reached']:
+            self.logger.warning(
+                f"Oversampling stopped at {report['accepted']}/{target} survivors "
+                f"(generation budget of {sampler.max_generated} sequences or the generator ran out)."
+            )
+        if self.deduper:
+            self._log_dedup_summary()
+        os.makedirs(self.results_dir, exist_ok=True)
+        path = os.path.join(self.results_dir, "oversampling.json")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        return {'clean': clean_seqs, 'logs': logs}
+
+    def _replay_filtering(self, sequences, dedup=False, chunk_size=65536):
+        """
+        A resumed run loads filtering from its checkpoint, so the filter never
+        reports to the candidate store, which starts the run's file afresh.
+        The generated sequences are filtered again (it is cheap) only so
+        their rows are written; `dedup` also re-clusters the survivors, for
+        paths that deduplicated while filtering.
+        """
+        self.logger.info(f"  filtering: re-evaluating {len(sequences)} sequences for the candidate store.")
+        for start in range(0, len(sequences), chunk_size):
+            passed, _ = self.filter_module.apply_all(sequences[start:start + chunk_size])
+            if dedup and self.deduper:
+                self.deduper.add(passed)
+
+    def _open_table(self, n_seqs, table_cfg):
+        """
+        CandidateTable sized for n_seqs candidates. With a run checkpoint it
+        is memory-mapped in the run directory (and reopened there once its
+        generation stage is done); otherwise under candidate_table.mmap_dir/<run_id>
+        when that is set.
+        """
+        mmap_dir = table_cfg.get('mmap_dir')
+        if self.checkpoint:
+            directory = os.path.join(self.checkpoint.run_dir, 'table')
+            if self.checkpoint.is_done('generation'):
+                return CandidateTable.open(directory, mode='r+')
+        else:
+            directory = os.path.join(mmap_dir, self.run_id) if mmap_dir else None
+        return CandidateTable(
+            capacity=n_seqs,
+            residue_capacity=n_seqs * table_cfg.get('mean_length', 20),
+            directory=directory
+        )
+
+    def _table_stage_done(self, stage):
+        if self.checkpoint and self.checkpoint.is_done(stage):
+            self.logger.info(f"  {stage}: loaded from checkpoint (candidate table).")
+            return True
+        return False
+
+    def _save_table_stage(self, stage):
+        """Flushes the table and marks the stage complete; its output lives in the table's columns."""
+        if self.checkpoint:
+            self.table.flush()
+            self.checkpoint.save(stage, {'table': self.table.directory, 'rows': len(self.table)})
+
+    def _table_rows(self, clean_idx, survivors, representatives):
+        """
+        Table rows of the candidates going on to ranking, by sequence: every
+        survivor row without dedup, otherwise each representative's first
+        row, with the rows dedup dropped marked DUPLICATE.
+        """
+        rows = {}
+        for k, seq in zip(clean_idx.tolist(), survivors):
+            rows.setdefault(seq, []).append(k)
+        if not self.deduper:
+            return rows
+        rows = {seq: rows[seq][:1] for seq in representatives}
+        self.table.set('status', np.setdiff1d(clean_idx, [ks[0] for ks in rows.values()]), DUPLICATE)
+        return rows
+
+    def _record_table_scores(self, rows, ranked):
+        """Scores and final status (ranked / passed) of the rows from _table_rows."""
+        scores = dict(ranked)
+        pairs = [(k, seq) for seq, ks in rows.items() for k in ks]
+        idx = [k for k, _ in pairs]
+        self.table.set('score', idx, [scores.get(seq, float('nan')) for _, seq in pairs])
+        self.table.set('status', idx, [RANKED if seq in scores else PASSED for _, seq in pairs])
+
+    def _record_table_docking(self, rows):
+        """Docking scores of the docked candidates (NaN where the tool reported none)."""
+        pairs = [(k, result) for seq, result in self.docking_results.items() for k in rows.get(seq, [])]
+        self.table.set('docking_score', [k for k, _ in pairs], [r.get('score', float('nan')) for _, r in pairs])
+
+    def _close_table(self):
+        if self.table is not None:
+            stats = self.table.stats()
+            self.logger.info(
+                f"Candidate table: {stats['rows']} rows, {stats['mb']:.1f} MB"
+                f"{' (memory-mapped)' if stats['memory_mapped'] else ''}; "
+                + ", ".join(f"{n} {status}" for status, n in stats['status'].items() if n)
+            )
+            self.table.close()
+            self.table = None
+
+    def _close_store(self):
+        if self.store:
+            self.filter_module.listeners.remove(self.store.listener)
+            self.store.close(self.deduper)
+            self.store = None
+
+    def _metrics_dir(self):
+        return os.path.join(self.config.get('instrumentation', {}).get('dir', 'results/metrics'), self.run_id)
+
+    def _profile_ranking(self, enabled=True):
+        """torch.profiler around ranking when instrumentation.torch_profiler is set."""
+        profile = enabled and self.config.get('instrumentation', {}).get('torch_profiler', False) \
+            and self.ranker.model is not None
+        return torch_profile(self._metrics_dir(), enabled=profile)
+
+    def _write_metrics(self):
+        """
+        Logs per-stage timings and saves them, with the ranker's forward-pass
+        counters, as metrics.json plus a Chrome trace (trace.json) under
+        instrumentation.dir/<run_id>.
+        """
+        inst_cfg = self.config.get('instrumentation', {})
+        if not inst_cfg.get('enabled', True):
+            return
+        # Only report the ranker if this run loaded it (dry runs never do)
+        ranker_stats = self._ranker_stats() if self._ranker else {'forward_passes': 0}
+        ranker_stats.update(scoring_mode=self.scoring_mode, precision=self.precision, loaded=self._ranker is not None)
+        extra = {
+            'run_id': self.run_id,
+            'target': self.config['target']['name'],
+            'num_sequences': self.config['design_parameters']['num_sequences'],
+            'pipeline_mode': self.config.get('pipeline', {}).get('mode', 'phased'),
+            'ranker': ranker_stats,
+            'cold_start': self.cold_start,
+        }
+        if self.score_cache:
+            extra['score_cache'] = self.score_cache.stats()
+        metrics = self.metrics.write(self._metrics_dir(), extra)
+
+        self.logger.info("Stage timings:")
+        for name, stage in metrics['stages'].items():
+            self.logger.info(
+                f"  {name}: {stage['wall_seconds']:.3f}s wall, {stage['cpu_seconds']:.3f}s CPU, "
+                f"{stage['items']} items ({stage['items_per_sec']:.1f}/s), peak RSS {stage['peak_rss_mb']:.0f} MB"
+            )
+        self.logger.info(f"  process peak RSS: {metrics['peak_rss_mb']:.0f} MB")
+        self.logger.info(
+            "  cold start: " + ", ".join(f"{k.replace('_seconds', '')} {v:.2f}s" for k, v in self.cold_start.items())
+        )
+        if ranker_stats.get('remote'):
+            self.logger.info(
+                f"  ranker: {ranker_stats['requests']} requests ({ranker_stats['sequences']} sequences) "
+                f"to {ranker_stats['remote']}, {ranker_stats['seconds']:.2f}s"
+            )
+        elif ranker_stats['forward_passes']:
+            self.logger.info(
+                f"  ranker: {ranker_stats['forward_passes']} forward passes, {ranker_stats['forward_rows']} rows, "
+                f"{ranker_stats['tokens_per_sec']:.0f} tokens/s ({ranker_stats['padding_overhead']:.0%} padding)"
+            )
+
+    def _run_stage(self, stage, compute):
+        """
+        Returns a stage's checkpointed output when resuming a run that already
+        completed it; otherwise computes it and checkpoints the result.
+        """
+        if self.checkpoint and self.checkpoint.is_done(stage):
+            self.logger.info(f"  {stage}: loaded from checkpoint.")
+            return self.checkpoint.load(stage)
+        result = compute()
+        if self.checkpoint:
+            self.checkpoint.save(stage, result)
+        return result
+
+    def _resumable_stream(self, n_seqs):
+        """
+        Generation stream that logs every sequence to the run checkpoint as it
+        arrives, so paid-for Evo2 outputs survive a crash; on resume the
+        logged ones are replayed and only the rest are generated.
+        """
+        if not self.checkpoint:
+            yield from self._generate_stream(n_seqs)
+            return
+        done = self.checkpoint.load('generation')
+        if done is not None:
+            yield from done
+            return
+        replay = self.checkpoint.load_partial('generation')[:n_seqs]
+        if replay:
+            self.logger.info(f"  generation: replaying {len(replay)} checkpointed sequences.")
+        yield from replay
+        if n_seqs > len(replay):
+            for seq in self._generate_stream(n_seqs - len(replay)):
+                self.checkpoint.append_partial('generation', [seq])
+                yield seq
+
+    def _log_filter_summary(self, n_raw, n_clean):
+        rejection_rate = (1 - n_clean/n_raw) * 100 if n_raw else 0
+        self.logger.info(f"TME Filter removed {rejection_rate:.1f}% of candidates (Risk of Tonic Signaling/Instability).")
+        self.logger.info(f"Candidates remaining: {n_clean}")
+
+    def _select_top_k(self, candidates):
+        """
+        Budgeted top-K selection (ranker_parameters.top_k); only the returned
+        finalists carry exact PLL scores.
+        """
+        ranker_params = self.config.get('ranker_parameters', {})
+        top_k_cfg = ranker_params.get('top_k', {})
+        top, report = self.ranker.select_top_k(
+            candidates,
+            top_k=top_k_cfg.get('k', 5),
+            eta=top_k_cfg.get('eta', 2),
+            initial_positions=top_k_cfg.get('initial_positions', 2),
+            finalists=top_k_cfg.get('finalists'),
+            budget_rows=top_k_cfg.get('budget_rows')
+        )
+        if not report.get('mocked'):
+            self.logger.info(
+                f"Top-{report['top_k']} selection: {report['forward_rows']} forward rows vs "
+                f"{report['exhaustive_rows']} for exhaustive PLL ({report['compute_saved']:.0%} saved) "
+                f"over {len(report['rounds'])} rounds."
+            )
+            os.makedirs(self.results_dir, exist_ok=True)
+            with open(os.path.join(self.results_dir, "top_k_selection.json"), "w") as f:
+                json.dump(report, f, indent=2)
+        return top
+
+    def _make_deduper(self):
+        dedup_cfg = self.config.get('dedup_parameters', {})
+        if not dedup_cfg.get('enabled', False):
+            return None
+        return DedupIndex(
+            max_edits=dedup_cfg.get('max_edits', 1),
+            kmer=dedup_cfg.get('kmer', 3),
+            bands=dedup_cfg.get('bands', 32),
+            rows=dedup_cfg.get('rows', 3)
+        )
+
+    def _log_dedup_summary(self):
+        stats = self.deduper.stats()
+        self.logger.info(
+            f"Dedup: {stats['sequences']} survivors -> {stats['clusters']} clusters "
+            f"({stats['exact_duplicates']} exact, {stats['near_duplicates']} near duplicates "
+            f"within {self.deduper.max_edits} edits)."
+        )
+        for seq, size in stats['largest_clusters']:
+            self.logger.info(f"  cluster of {size}: {seq}")
+
+    def export_filter_stats(self):
+        """
+        Logs the per-constraint filter counters and saves them to
+        results/filter_stats.json.
+        """
+        stats = self.filter_module.stats()
+        if not stats['sequences']:
+            return  # filtering was loaded from a checkpoint; keep the saved stats
+        self.logger.info(f"TME filter checks ({stats['order']} order, {stats['sequences']} sequences):")
+        for c in stats['constraints']:
+            self.logger.info(
+                f"  {c['constraint']}: {c['rejected']}/{c['evaluated']} rejected "
+                f"({c['rejection_rate']:.1%}), {c['seconds']:.3f}s ({c['us_per_sequence']:.2f} us/seq)"
+            )
+
+        os.makedirs(self.results_dir, exist_ok=True)
+        path = os.path.join(self.results_dir, "filter_stats.json")
+        with open(path, "w") as f:
+            json.dump(stats, f, indent=2)
+        self.logger.info(f"Saved filter statistics to {path}")
+
+    def calibrate_ranker(self, sample_size=200, top_n=10):
+        """
+        Compares the approximate scoring modes against exact PLL on a sample of
+        filtered candidates and saves the fidelity report to results/.
+        """
+        ranker = self._local_ranker()
+        if not ranker.model:
+            self.logger.error("TCR-BERT model not loaded; cannot calibrate scoring modes.")
+            return None
+
+        sample = self._sample_candidates(sample_size)
+        self.logger.info(f"Calibrating scoring modes against exact PLL on {len(sample)} candidates...")
+        report = ranker.calibrate_modes(sample, top_n=top_n)
+
+        self.logger.info(f"  exact: {report['exact']['seconds']:.2f}s ({report['exact']['forward_rows']} masked rows)")
+        for mode, stats in report['modes'].items():
+            self.logger.info(
+                f"  {mode}: spearman={stats['spearman']:.3f} kendall={stats['kendall']:.3f} "
+                f"top-{top_n} overlap={stats['top_n_overlap']:.0%} speedup={stats['speedup']:.1f}x"
+            )
+
+        os.makedirs(self.results_dir, exist_ok=True)
+        path = os.path.join(self.results_dir, "ranker_calibration.json")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        self.logger.info(f"Saved calibration report to {path}")
+        return report
+
+    def check_precision_parity(self, sample_size=200, top_n=10):
+        """
+        Compares the configured inference precision against fp32 on a
+        reference sample of filtered candidates and saves the parity report.
+        """
+        ranker = self._local_ranker()
+        if not ranker.model:
+            self.logger.error("TCR-BERT model not loaded; cannot check precision parity.")
+            return None
+
+        sample = self._sample_candidates(sample_size)
+        self.logger.info(f"Checking {ranker.precision} vs fp32 parity on {len(sample)} candidates...")
+        report = ranker.compare_precision(sample, top_n=top_n)
+        self.logger.info(
+            f"  max |dPLL|={report['max_abs_delta']:.4f} mean |dPLL|={report['mean_abs_delta']:.4f} "
+            f"spearman={report['spearman']:.3f} top-{top_n} overlap={report['top_n_overlap']:.0%} "
+            f"same order={report['same_order']} speedup={report['speedup']:.1f}x"
+        )
+
+        os.makedirs(self.results_dir, exist_ok=True)
+        path = os.path.join(self.results_dir, "precision_parity.json")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        self.logger.info(f"Saved precision parity report to {path}")
+        return report
+
+    def mutational_scan(self, sequence=None, rescore_top=20):
+        """
+        Deep mutational scan of a lead CDR3 (default: the top candidate in
+        <results_dir>/candidates.csv). Saves the position x amino-acid
+        masked-marginal matrix and the ranked mutant list (top `rescore_top`
+        with exact PLL) under <results_dir>/dms/.
+        """
+        import pandas as pd
+        if sequence is None:
+            path = os.path.join(self.results_dir, "candidates.csv")
+            if not os.path.exists(path):
+                self.logger.error(f"No lead given and {path} does not exist; run a design cycle first.")
+                return None
+            sequence = pd.read_csv(path)['CDR3'].iloc[0]
+        ranker = self._local_ranker()
+        if not ranker.model:
+            self.logger.error("TCR-BERT model not loaded; cannot run a mutational scan.")
+            return None
+
+        self.logger.info(f"Mutational scan of {sequence}: {19 * len(sequence)} mutants from {len(sequence)} masked rows...")
+        scan = ranker.mutational_scan(sequence, rescore_top=rescore_top)
+        out_dir = os.path.join(self.results_dir, "dms")
+        os.makedirs(out_dir, exist_ok=True)
+        matrix = pd.DataFrame(
+            scan['matrix'], columns=list(scan['amino_acids']),
+            index=[f"{i + 1}{aa}" for i, aa in enumerate(sequence)]
+        )
+        matrix.index.name = 'Position'
+        matrix.to_csv(os.path.join(out_dir, f"{sequence}_matrix.csv"))
+        pd.DataFrame(scan['mutants']).to_csv(os.path.join(out_dir, f"{sequence}_mutants.csv"), index=False)
+
+        if scan['wild_type_pll'] is not None:
+            self.logger.info(f"  wild type PLL: {scan['wild_type_pll']:.4f}")
+        for m in scan['mutants'][:5]:
+            exact = f", PLL {m['pll']:.4f} ({m['delta_pll']:+.4f})" if 'pll' in m else ""
+            self.logger.info(f"  {m['mutant']}: masked marginal {m['masked_marginal']:+.3f}{exact}")
+        self.logger.info(f"Saved mutational scan matrix and ranked mutants to {out_dir}/")
+        return scan
+
+    def _dock(self, candidates, target, docking_cfg):
+        """Docking stage output: the job file, and with docking.execute the per-candidate results."""
+        job_file = prepare_docking_job(candidates, target, job_dir=os.path.join(self.results_dir, 'docking_jobs'))
+        stage = {'job_file': job_file, 'candidates': candidates}
+        if docking_cfg.get('execute', False):
+            stage['results'] = self.dock_job(job_file)
+        return stage
+
+    def dock_job(self, job_file=None):
+        """
+        Runs a docking job file (default: this target's, from the last run)
+        through run_docking_job with the docking section of the config.
+        Candidates docked successfully before are skipped, so calling this
+        again retries only the failed ones.
+        """
+        cfg = self.config.get('docking', {})
+        job_file = job_file or os.path.join(self.results_dir, 'docking_jobs', f"{self.config['target']['name']}_job.csv")
+        return run_docking_job(
+            job_file,
+            executable=cfg.get('executable', 'tcrdock'),
+            output_dir=cfg.get('output_dir') or os.path.join(self.results_dir, 'docking_output'),
+            workers=cfg.get('workers', 2),
+            timeout=cfg.get('timeout', 1800),
+            retries=cfg.get('retries', 1),
+            args=cfg.get('args')
+        )
+
+    def search_binders(self, sequences):
+        """
+        Nearest known binders of each sequence by cosine distance between
+        mean-pooled TCR-BERT embeddings (binder_search section of the
+        config). Returns {sequence: [{'cdr3', 'epitope', 'distance'}, ...]}
+        (closest first) and saves the neighbours to
+        <results_dir>/binder_neighbors.csv.
+        """
+        cfg = self.config.get('binder_search', {})
+        # Embeddings need the model itself, not a ranking server
+        ranker = self.ranker if self.ranker.model is not None else self._local_ranker()
+        if ranker.model is None:
+            self.logger.warning("Binder search needs the TCR-BERT model, which failed to load; skipping it.")
+            return {}
+        index = self._binder_index(ranker, cfg)
+        if index is None:
+            return {}
+        ids, distances = index.search(
+            ranker.embed(sequences),
+            k=cfg.get('k', 5),
+            mode=cfg.get('mode', 'ivf'),
+            n_probe=cfg.get('n_probe', 8),
+            rerank=cfg.get('rerank', 4)
+        )
+
+        neighbors, rows = {}, []
+        for seq, seq_ids, seq_distances in zip(sequences, ids.tolist(), distances.tolist()):
+            hits = [
+                dict(index.references[i], distance=d)
+                for i, d in zip(seq_ids, seq_distances) if i >= 0
+            ]
+            neighbors[seq] = hits
+            rows.extend({'CDR3': seq, 'Neighbor': n + 1, 'Binder_CDR3': hit['cdr3'], 'Epitope': hit['epitope'],
+                         'Distance': hit['distance']} for n, hit in enumerate(hits))
+        for seq in sequences[:3]:
+            closest = ", ".join(f"{h['cdr3']} ({h['epitope']}, {h['distance']:.3f})" for h in neighbors[seq][:3])
+            self.logger.info(f"  {seq}: {closest}")
+
+        import pandas as pd
+        os.makedirs(self.results_dir, exist_ok=True)
+        path = os.path.join(self.results_dir, "binder_neighbors.csv")
+        pd.DataFrame(rows, columns=['CDR3', 'Neighbor', 'Binder_CDR3', 'Epitope', 'Distance']).to_csv(path, index=False)
+        self.logger.info(f"Saved nearest known binders of {len(sequences)} candidates to {path}")
+        return neighbors
+
+    def _binder_index(self, ranker, cfg):
+        """
+        Opens the persistent binder index, or (re)builds it when it is
+        missing or was built from other references or another model. None
+        when the reference file has no usable binders.
+        """
+        from src.binder_index import BinderIndex, load_references, source_signature
+        references_path = cfg.get('references', 'data/known_binders.tsv')
+        index_dir = cfg.get('index_dir', 'results/binder_index')
+        signature = {
+            'model': f"{ranker.model_path}@{ranker.revision or 'main'}",
+            'precision': ranker.precision,
+            'references_path': os.path.abspath(references_path),
+            'source_signature': source_signature(references_path),
+            'gene': cfg.get('gene', 'TRB'),
+        }
+        if os.path.exists(os.path.join(index_dir, 'index.json')):
+            index = BinderIndex.open(index_dir)
+            if all(index.meta.get(key) == value for key, value in signature.items()):
+                self.logger.info(f"Loaded binder index of {len(index)} references from {index_dir}")
+                return index
+            self.logger.info(f"Binder index in {index_dir} is stale (references or model changed); rebuilding.")
+
+        references = load_references(references_path, gene=signature['gene'])
+        if not references:
+            self.logger.warning(f"No usable {signature['gene']} binders in {references_path}; skipping the binder search.")
+            return None
+        self.logger.info(f"Embedding {len(references)} known binders from {references_path}...")
+        embeddings = ranker.embed([r['cdr3'] for r in references])
+        return BinderIndex.build(
+            index_dir, embeddings, references,
+            n_lists=cfg.get('n_lists'),
+            quantize=cfg.get('quantize', True),
+            **signature
+        )
+
+    def _generate(self, n_seqs):
+        return list(self._generate_stream(n_seqs))
+
+    def _generate_stream(self, n_seqs, pooled=True):
+        evo_params = self.config.get('evo2_parameters', {})
+        make_stream = lambda: stream_sequences_evo2(
+            num_tokens=20, # Default
+            top_k=evo_params.get('top_k', 4),
+            temperature=evo_params.get('temperature', 1.0),
+            n_sequences=n_seqs,
+            concurrency=evo_params.get('concurrency', 8),
+            rate_limit=evo_params.get('rate_limit'),
+            max_retries=evo_params.get('max_retries', 5),
+            max_attempts=evo_params.get('max_attempts'),
+            url=evo_params.get('url')
+        )
+        if pooled and self.shared and self.shared.share_pool:
+            # Generation doesn't depend on the target, so a batch can screen one pool against every target
+            return self.shared.pool(json.dumps([evo_params, n_seqs], sort_keys=True), make_stream)
+        return make_stream()
+
+    def _sample_candidates(self, sample_size):
+        # Generate and filter a fresh pool, then sample it as a reference set
+        raw_seqs = self._generate(sample_size)
+        clean_seqs, _ = self.filter_module.apply_all(raw_seqs)
+        return random.sample(clean_seqs, min(sample_size, len(clean_seqs)))
 
     def export_results(self, ranked_seqs):
         # Save to CSV
-        os.makedirs("results", exist_ok=True)
+        import pandas as pd
+        os.makedirs(self.results_dir, exist_ok=True)
         
         df = pd.DataFrame(ranked_seqs, columns=['CDR3', 'BERT_PLL_Score'])
         df['Status'] = 'Ranked'
-        df.to_csv("results/candidates.csv", index=False)
-        self.logger.info("Saved ranked candidates to results/candidates.csv")
+        # Sequences this candidate represents (itself plus exact/near duplicates dropped before ranking)
+        df['Cluster_Size'] = [self.deduper.cluster_size(seq) if self.deduper else 1 for seq in df['CDR3']]
+        # Record how the scores were produced so runs at different settings aren't mixed up
+        df['Scoring_Mode'] = self.scoring_mode
+        df['Precision'] = self.precision
+        if self.binder_neighbors:
+            # Closest known binder; all k neighbours are in binder_neighbors.csv
+            nearest = [(self.binder_neighbors.get(seq) or [{}])[0] for seq in df['CDR3']]
+            df['Nearest_Binder'] = [n.get('cdr3') for n in nearest]
+            df['Nearest_Epitope'] = [n.get('epitope') for n in nearest]
+            df['Binder_Distance'] = [n.get('distance') for n in nearest]
+        if self.docking_results:
+            docked = [self.docking_results.get(seq, {}) for seq in df['CDR3']]
+            df['Docking_Status'] = [d.get('status') for d in docked]
+            df['Docking_Score'] = [d.get('score') for d in docked]
+        path = os.path.join(self.results_dir, "candidates.csv")
+        df.to_csv(path, index=False)
+        self.logger.info(f"Saved ranked candidates to {path}")
@@ -0,0 +1,171 @@
+import os
+import re
+import glob
+import json
+import time
+import logging
+import resource
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import yaml
+from src.score_cache import ScoreCache
+from src.property_engine import PropertyCache
+
+logger = logging.getLogger(__name__)
+
+class SharedResources:
+    """
+    State reused by every job of a batch run in one process: rankers keyed
+    by model and scoring settings (loaded once), one ScoreCache per cache
+    file, one PropertyCache for the TME filters and, with share_pool, the
+    generated candidate pool per generation settings, so later targets
+    screen the same pool (and hit the caches) instead of generating anew.
+    """
+
+    def __init__(self, share_pool=False):
+        self.share_pool = share_pool
+        self.rankers = {}
+        self.score_caches = {}
+        self.property_cache = PropertyCache()
+        self.pools = {}
+
+    def ranker(self, key, build):
+        if key not in self.rankers:
+            self.rankers[key] = build()
+        return self.rankers[key]
+
+    def score_cache(self, cache_cfg):
+        key = json.dumps(cache_cfg, sort_keys=True)
+        if key not in self.score_caches:
+            self.score_caches[key] = ScoreCache(**cache_cfg)
+        return self.score_caches[key]
+
+    def pool(self, key, make_stream):
+        """
+        Yields the pool generated for `key`: replayed if an earlier job
+        completed it, otherwise streamed from make_stream() and kept.
+        """
+        if key in self.pools:
+            yield from self.pools[key]
+            return
+        generated = []
+        for seq in make_stream():
+            generated.append(seq)
+            yield seq
+        self.pools[key] = generated
+
+    def stats(self):
+        return {
+            "rankers": len(self.rankers),
+            "score_caches": {key: cache.stats() for key, cache in self.score_caches.items()},
+            "property_cache": self.property_cache.stats(),
+            "pools": len(self.pools),
+        }
+
+    def close(self):
+        for ranker in self.rankers.values():
+            if hasattr(ranker, "close"):
+                ranker.close()
+        for cache in self.score_caches.values():
+            cache.close()
+
+def find_configs(paths):
+    """Job YAMLs from a list of files and/or directories (*.yaml, *.yml)."""
+    configs = []
+    for path in paths:
+        if os.path.isdir(path):
+            configs.extend(sorted(glob.glob(os.path.join(path, "*.yaml")) + glob.glob(os.path.join(path, "*.yml"))))
+        else:
+            configs.append(path)
+    return configs
+
+def _target_dirs(configs, root):
+    """One results directory per job, named after its target."""
+    dirs, used = [], set()
+    for config_path in configs:
+        with open(config_path) as f:
+            name = yaml.safe_load(f).get('target', {}).get('name') or os.path.splitext(os.path.basename(config_path))[0]
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", name)
+        candidate, n = slug, 2
+        while candidate in used:
+            candidate, n = f"{slug}-{n}", n + 1
+        used.add(candidate)
+        dirs.append(os.path.join(root, candidate))
+    return dirs
+
+def _run_target(config_path, results_dir, shared):
+    # Imported here so worker processes only pay for it once they have work
+    from src.agent import ImmunotherapyAgent
+    start = time.perf_counter()
+    summary = {"config": config_path, "results_dir": results_dir}
+    try:
+        agent = ImmunotherapyAgent(config_path, results_dir=results_dir, shared=shared)
+        summary["target"] = agent.config['target']['name']
+        ranked = agent.run_design_cycle()
+        summary.update(status="ok", ranked=len(ranked), top=ranked[0] if ranked else None)
+    except Exception as e:
+        logger.exception(f"Batch job {config_path} failed")
+        summary.update(status="failed", error=str(e))
+    summary["seconds"] = time.perf_counter() - start
+    summary["pid"] = os.getpid()
+    return summary
+
+# One SharedResources per worker process
+_WORKER_SHARED = None
+
+def _init_worker(share_pool):
+    global _WORKER_SHARED
+    logging.basicConfig(level=logging.INFO, format='[AI-AGENT] %(message)s')
+    _WORKER_SHARED = SharedResources(share_pool=share_pool)
+
+def _run_in_worker(config_path, results_dir):
+    return _run_target(config_path, results_dir, _WORKER_SHARED)
+
+def run_batch(paths, workers=1, share_pool=False, results_root="results/targets"):
+    """
+    Runs every job config under `paths` (files or directories), writing each
+    target's outputs to results_root/<target>/ and a batch_summary.json.
+    With workers=1 all jobs run in this process on one SharedResources;
+    otherwise jobs are spread over `workers` processes, each with its own.
+    """
+    configs = find_configs(paths)
+    if not configs:
+        raise ValueError(f"No job configs found in {paths}")
+    dirs = _target_dirs(configs, results_root)
+    logger.info(f"Batch: {len(configs)} jobs, {workers} worker(s), shared pool: {share_pool}")
+
+    start = time.perf_counter()
+    shared = None
+    if workers <= 1:
+        shared = SharedResources(share_pool=share_pool)
+        try:
+            results = [_run_target(c, d, shared) for c, d in zip(configs, dirs)]
+        finally:
+            shared.close()
+    else:
+        # Spawn rather than fork, as in ParallelRanker
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(share_pool,)) as pool:
+            results = list(pool.map(_run_in_worker, configs, dirs))
+
+    summary = {
+        "jobs": len(results),
+        "failed": sum(r["status"] != "ok" for r in results),
+        "workers": workers,
+        "share_pool": share_pool,
+        "total_seconds": time.perf_counter() - start,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "workers_peak_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024 if workers > 1 else None,
+        "shared": shared.stats() if shared else None,
+        "targets": results,
+    }
+    os.makedirs(results_root, exist_ok=True)
+    path = os.path.join(results_root, "batch_summary.json")
+    with open(path, "w") as f:
+        json.dump(summary, f, indent=2)
+
+    logger.info(f"Batch finished in {summary['total_seconds']:.1f}s ({summary['failed']} failed); summary in {path}")
+    for r in results:
+        top = f"top {r['top'][0]} ({r['top'][1]:.4f})" if r.get('top') else r.get('error', 'no candidates')
+        logger.info(f"  {r.get('target', r['config'])}: {r['status']}, {r['seconds']:.1f}s, {top}")
+    return summary
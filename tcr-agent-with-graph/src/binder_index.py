@@ -0,0 +1,200 @@
+import os
+import csv
+import json
+import logging
+import numpy as np
+from src.property_engine import AMINO_ACIDS
+
+logger = logging.getLogger(__name__)
+
+SEARCH_MODES = ("exact", "ivf")
+
+def load_references(path, cdr3_column="CDR3", epitope_column="Epitope", gene_column="Gene", gene="TRB"):
+    """
+    Known binders from a VDJdb-style TSV: one row per (CDR3, epitope) pair,
+    keeping rows of `gene` (when the file has a gene column) with canonical
+    CDR3s. Returns a list of {"cdr3", "epitope"} dicts in file order.
+    """
+    canonical = set(AMINO_ACIDS)
+    references, seen = [], set()
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f, delimiter="\t"):
+            if gene and row.get(gene_column) not in (None, gene):
+                continue
+            cdr3 = (row.get(cdr3_column) or "").strip()
+            epitope = (row.get(epitope_column) or "").strip()
+            if not cdr3 or not set(cdr3) <= canonical or (cdr3, epitope) in seen:
+                continue
+            seen.add((cdr3, epitope))
+            references.append({"cdr3": cdr3, "epitope": epitope})
+    return references
+
+def source_signature(path):
+    """Changes whenever the reference file does (size and mtime)."""
+    stat = os.stat(path)
+    return f"{stat.st_size}-{int(stat.st_mtime)}"
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def _kmeans(vectors, n_lists, iterations=10, seed=0):
+    """Spherical k-means (cosine) on unit vectors; returns unit centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=n_lists)
+        # Empty lists keep their previous centroid
+        centroids = np.where(counts[:, None] > 0, sums, centroids)
+        centroids = _normalize(centroids)
+    return centroids
+
+class BinderIndex:
+    """
+    Persistent cosine-similarity index over known-binder embeddings. The
+    unit-normalized vectors are stored grouped by IVF list (k-means
+    cluster), so each list is one contiguous slice of a memory-mapped
+    .npy file. Search is either exact (blockwise matrix products over all
+    vectors) or approximate: probe the `n_probe` lists whose centroids are
+    nearest, score their members from int8 scalar-quantized codes and
+    re-rank the best `rerank` x k exactly. Distances are cosine distances
+    (1 - cosine similarity).
+    """
+
+    FILES = ("vectors", "codes", "quantizer", "centroids", "list_offsets")
+
+    def __init__(self, directory, meta, references, arrays):
+        self.directory = directory
+        self.meta = meta
+        self.references = references
+        self.vectors = arrays["vectors"]
+        self.codes = arrays.get("codes")
+        self.quantizer = arrays.get("quantizer")
+        self.centroids = arrays["centroids"]
+        self.list_offsets = arrays["list_offsets"]
+
+    def __len__(self):
+        return len(self.references)
+
+    @classmethod
+    def build(cls, directory, embeddings, references, n_lists=None, quantize=True, train_size=50_000, **meta):
+        """
+        Clusters and writes an index for `embeddings` (one row per reference)
+        to directory. Extra keyword arguments (model, source signature) are
+        kept in index.json so callers can tell when it is stale.
+        """
+        vectors = _normalize(embeddings)
+        n = len(vectors)
+        if n == 0:
+            raise ValueError("Cannot build a binder index from an empty reference set.")
+        n_lists = int(n_lists or max(1, round(np.sqrt(n))))
+        n_lists = min(n_lists, n)
+        rng = np.random.default_rng(0)
+        train = vectors[rng.choice(n, min(n, train_size), replace=False)]
+        centroids = _kmeans(train, n_lists)
+        assign = np.concatenate([
+            np.argmax(vectors[start:start + 65536] @ centroids.T, axis=1) for start in range(0, n, 65536)
+        ])
+        order = np.argsort(assign, kind="stable")
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=n_lists), out=list_offsets[1:])
+
+        os.makedirs(directory, exist_ok=True)
+        vectors = vectors[order]
+        references = [references[k] for k in order.tolist()]
+        np.save(os.path.join(directory, "vectors.npy"), vectors)
+        np.save(os.path.join(directory, "centroids.npy"), centroids)
+        np.save(os.path.join(directory, "list_offsets.npy"), list_offsets)
+        if quantize:
+            # Per-dimension affine int8 codes: x ~ (code + 128) * scale + low
+            low, high = vectors.min(axis=0), vectors.max(axis=0)
+            scale = np.maximum(high - low, 1e-12) / 255
+            codes = np.round((vectors - low) / scale - 128).clip(-128, 127).astype(np.int8)
+            np.save(os.path.join(directory, "codes.npy"), codes)
+            np.save(os.path.join(directory, "quantizer.npy"), np.stack([low, scale]).astype(np.float32))
+        with open(os.path.join(directory, "references.tsv"), "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["cdr3", "epitope"], delimiter="\t")
+            writer.writeheader()
+            writer.writerows(references)
+        meta = dict(meta, size=n, dim=int(vectors.shape[1]), n_lists=n_lists, quantized=bool(quantize))
+        with open(os.path.join(directory, "index.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+        logger.info(f"Built binder index of {n} references ({n_lists} lists, quantized: {quantize}) in {directory}")
+        return cls.open(directory)
+
+    @classmethod
+    def open(cls, directory):
+        """Memory-maps an index written by build()."""
+        with open(os.path.join(directory, "index.json")) as f:
+            meta = json.load(f)
+        with open(os.path.join(directory, "references.tsv"), newline="") as f:
+            references = list(csv.DictReader(f, delimiter="\t"))
+        arrays = {}
+        for name in cls.FILES:
+            path = os.path.join(directory, f"{name}.npy")
+            if os.path.exists(path):
+                arrays[name] = np.load(path, mmap_mode="r")
+        return cls(directory, meta, references, arrays)
+
+    def search(self, queries, k=5, mode="ivf", n_probe=8, rerank=4, block_rows=65536):
+        """
+        Top-k references per query embedding. Returns (ids, distances), both
+        [n_queries, k]; ids index self.references, and rows with fewer than
+        k candidates are padded with -1 / inf.
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}'. Expected one of {SEARCH_MODES}.")
+        queries = _normalize(queries)
+        k = min(k, len(self))
+        if mode == "exact":
+            return self._search_exact(queries, k, block_rows)
+        return self._search_ivf(queries, k, n_probe, rerank)
+
+    def _search_exact(self, queries, k, block_rows):
+        best_sims = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for start in range(0, len(self), block_rows):
+            sims = queries @ np.asarray(self.vectors[start:start + block_rows]).T
+            # Block top-k first, then merge with the running top-k
+            block_k = min(k, sims.shape[1])
+            top = np.argpartition(-sims, block_k - 1, axis=1)[:, :block_k]
+            sims = np.concatenate([best_sims, np.take_along_axis(sims, top, axis=1)], axis=1)
+            ids = np.concatenate([best_ids, top + start], axis=1)
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            best_sims = np.take_along_axis(sims, top, axis=1)
+            best_ids = np.take_along_axis(ids, top, axis=1)
+        return self._sorted(best_ids, best_sims)
+
+    def _search_ivf(self, queries, k, n_probe, rerank):
+        n_probe = min(n_probe, len(self.centroids))
+        probes = np.argpartition(-(queries @ self.centroids.T), n_probe - 1, axis=1)[:, :n_probe]
+        best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        best_sims = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for q, query in enumerate(queries):
+            ranges = [(self.list_offsets[p], self.list_offsets[p + 1]) for p in probes[q].tolist()]
+            candidates = np.concatenate([np.arange(a, b) for a, b in ranges])
+            if not len(candidates):
+                continue
+            candidates.sort()  # ascending positions read the memory map sequentially
+            shortlist = rerank * k
+            if self.codes is not None and len(candidates) > shortlist:
+                low, scale = self.quantizer
+                approx = (np.asarray(self.codes[candidates], dtype=np.float32) + 128) @ (query * scale) + query @ low
+                candidates = candidates[np.argpartition(-approx, shortlist - 1)[:shortlist]]
+                candidates.sort()
+            sims = np.asarray(self.vectors[candidates]) @ query
+            top = np.argsort(-sims, kind="stable")[:k]
+            best_ids[q, :len(top)] = candidates[top]
+            best_sims[q, :len(top)] = sims[top]
+        return self._sorted(best_ids, best_sims)
+
+    def _sorted(self, ids, sims):
+        order = np.argsort(-sims, axis=1, kind="stable")
+        ids = np.take_along_axis(ids, order, axis=1)
+        distances = 1 - np.take_along_axis(sims, order, axis=1)
+        distances[ids < 0] = np.inf
+        return ids, distances
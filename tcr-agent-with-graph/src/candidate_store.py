@@ -0,0 +1,196 @@
+import os
+import glob
+import logging
+import threading
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = pa.schema([
+    ("run_id", pa.string()),
+    ("sequence", pa.string()),
+    ("status", pa.string()),  # rejected | ranked | duplicate | unranked
+    ("gravy", pa.float64()),
+    ("pi", pa.float64()),
+    ("net_charge", pa.float64()),
+    ("motif_hits", pa.string()),
+    ("rejection_reason", pa.string()),
+    ("score", pa.float64()),
+    ("scoring_mode", pa.string()),
+    ("precision", pa.string()),
+    ("cluster_size", pa.int64()),
+])
+
+FORMATS = {"arrow": ".arrow", "parquet": ".parquet"}
+
+class CandidateStore:
+    """
+    Append-only columnar record of every candidate in a run: one row per
+    sequence with its filter properties, rejection reason or score, and
+    how it was scored. Rows are buffered and written in chunks of
+    `chunk_rows` as the stages produce them: rejected sequences as soon as
+    a filter batch finishes, survivors once scored. Each run writes one
+    file, results/candidates/<run_id>.arrow (uncompressed Arrow IPC
+    stream, readable zero-copy from a memory map, and still readable up to
+    the last complete chunk if the run dies) or .parquet (compressed).
+    """
+
+    def __init__(self, run_id, directory="results/candidates", fmt="arrow", chunk_rows=10_000,
+                 scoring_mode=None, precision=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown candidate store format '{fmt}'. Expected one of {tuple(FORMATS)}.")
+        os.makedirs(directory, exist_ok=True)
+        self.run_id = run_id
+        self.path = os.path.join(directory, f"{run_id}{FORMATS[fmt]}")
+        self.fmt = fmt
+        self.chunk_rows = max(1, int(chunk_rows))
+        self.scoring_mode = scoring_mode
+        self.precision = precision
+        self.rows_written = 0
+        self._buffer = {name: [] for name in SCHEMA.names}
+        # Survivors awaiting a score: sequence -> [filter properties, copies]
+        self._pending = {}
+        # Sequences written as ranked; their leftover copies are exact duplicates
+        self._ranked = set()
+        self._writer = None
+        # The filter stage runs in its own thread when streaming
+        self._lock = threading.Lock()
+
+    def _append(self, sequences, status, gravy, pi, net_charge, motif_hits, reasons, scores, cluster_sizes):
+        n = len(sequences)
+        columns = {
+            "run_id": [self.run_id] * n,
+            "sequence": sequences,
+            "status": [status] * n,
+            "gravy": gravy,
+            "pi": pi,
+            "net_charge": net_charge,
+            "motif_hits": motif_hits,
+            "rejection_reason": reasons,
+            "score": scores,
+            "scoring_mode": [self.scoring_mode] * n,
+            "precision": [self.precision] * n,
+            "cluster_size": cluster_sizes,
+        }
+        with self._lock:
+            for name, values in columns.items():
+                self._buffer[name].extend(values)
+            if len(self._buffer["sequence"]) >= self.chunk_rows:
+                self._flush()
+
+    def _flush(self):
+        if not self._buffer["sequence"]:
+            return
+        table = pa.table(self._buffer, schema=SCHEMA)
+        if self._writer is None:
+            if self.fmt == "parquet":
+                self._writer = pq.ParquetWriter(self.path, SCHEMA)
+            else:
+                self._writer = pa.ipc.new_stream(self.path, SCHEMA)
+        # One Parquet row group / IPC record batch per chunk
+        if self.fmt == "parquet":
+            self._writer.write_table(table)
+        else:
+            self._writer.write_table(table, max_chunksize=self.chunk_rows)
+        self.rows_written += table.num_rows
+        self._buffer = {name: [] for name in SCHEMA.names}
+
+    def record_filtered(self, filter_module, sequences, props, rejected_by, logs):
+        """
+        TMEFilter listener: writes rejected sequences with their reason and
+        holds survivors' properties until record_scores.
+        """
+        gravy = props["gravy"].tolist()
+        pi = props["pi"].tolist()
+        net_charge = props["net_charge"].tolist()
+        hits = filter_module.motif_hits_text(props)
+
+        rejected = np.flatnonzero(rejected_by != -1).tolist()
+        self._append(
+            [sequences[k] for k in rejected], "rejected",
+            [gravy[k] for k in rejected], [pi[k] for k in rejected], [net_charge[k] for k in rejected],
+            [hits.get(k) for k in rejected], logs, [None] * len(rejected), [None] * len(rejected),
+        )
+        with self._lock:
+            for k in np.flatnonzero(rejected_by == -1).tolist():
+                entry = self._pending.setdefault(sequences[k], [(gravy[k], pi[k], net_charge[k], hits.get(k)), 0])
+                entry[1] += 1
+
+    def record_scores(self, ranked, deduper=None):
+        """Writes scored survivors: [(seq, score)]."""
+        with self._lock:
+            props = [self._take_pending(seq) for seq, _ in ranked]
+            self._ranked.update(seq for seq, _ in ranked)
+        sequences = [seq for seq, _ in ranked]
+        self._append(
+            sequences, "ranked",
+            [p[0] for p in props], [p[1] for p in props], [p[2] for p in props], [p[3] for p in props],
+            [None] * len(ranked), [score for _, score in ranked],
+            [deduper.cluster_size(seq) if deduper else 1 for seq in sequences],
+        )
+
+    def _take_pending(self, seq):
+        """Properties of one pending copy of seq (None if it never passed through the filter)."""
+        entry = self._pending.get(seq)
+        if entry is None:
+            return (None, None, None, None)
+        entry[1] -= 1
+        if not entry[1]:
+            del self._pending[seq]
+        return entry[0]
+
+    def close(self, deduper=None):
+        """
+        Writes survivors that were never scored (near/exact duplicates
+        dropped before ranking, or candidates outside a top-K selection)
+        and finalises the file.
+        """
+        with self._lock:
+            leftover = [(seq, p) for seq, (p, copies) in self._pending.items() for _ in range(copies)]
+            self._pending = {}
+        for status in ("duplicate", "unranked"):
+            rows = [
+                (seq, p) for seq, p in leftover
+                if (status == "duplicate") == (seq in self._ranked or bool(deduper and deduper.representative(seq) != seq))
+            ]
+            if rows:
+                self._append(
+                    [seq for seq, _ in rows], status,
+                    [p[0] for _, p in rows], [p[1] for _, p in rows], [p[2] for _, p in rows], [p[3] for _, p in rows],
+                    [None] * len(rows), [None] * len(rows),
+                    [deduper.cluster_size(seq) if deduper else 1 for seq, _ in rows],
+                )
+        with self._lock:
+            self._flush()
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        logger.info(f"Saved {self.rows_written} candidate records to {self.path}")
+
+def load_candidates(path="results/candidates", columns=None):
+    """
+    Reads a candidate store file, or every run file in a directory, as one
+    pyarrow Table with only the requested columns. Files are memory-mapped;
+    Arrow IPC columns are used in place without copying.
+    """
+    files = sorted(glob.glob(os.path.join(path, "*.arrow")) + glob.glob(os.path.join(path, "*.parquet"))) \
+        if os.path.isdir(path) else [path]
+    tables = []
+    for file in files:
+        if file.endswith(".parquet"):
+            tables.append(pq.read_table(file, columns=columns, memory_map=True))
+        else:
+            batches = []
+            reader = pa.ipc.open_stream(pa.memory_map(file, "r"))
+            try:
+                for batch in reader:
+                    batches.append(batch.select(columns) if columns else batch)
+            except pa.ArrowInvalid:
+                logger.warning(f"{file} ends in a partial chunk (interrupted run); reading complete chunks only.")
+            schema = reader.schema
+            tables.append(pa.Table.from_batches(batches, schema=pa.schema([schema.field(c) for c in columns]) if columns else schema))
+    if not tables:
+        return SCHEMA.empty_table().select(columns) if columns else SCHEMA.empty_table()
+    return pa.concat_tables(tables)
@@ -0,0 +1,247 @@
+import os
+import json
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Per-row status codes
+STATUSES = ("generated", "rejected", "passed", "duplicate", "ranked")
+GENERATED, REJECTED, PASSED, DUPLICATE, RANKED = range(len(STATUSES))
+
+# name -> (dtype, fill value for new rows). Properties are kept as float32
+# records; filter decisions are made on the float64 values before storing.
+COLUMNS = {
+    "gravy": (np.float32, np.nan),
+    "pi": (np.float32, np.nan),
+    "net_charge": (np.float32, np.nan),
+    "score": (np.float64, np.nan),
+    "docking_score": (np.float32, np.nan),
+    "status": (np.int8, GENERATED),
+    "rejected_by": (np.int16, -1),
+}
+
+class CandidateView:
+    """
+    Read-only sequence of the strings at rows `idx` of a CandidateTable,
+    decoded on access. Lets list-based consumers (filter listeners, the
+    property cache) index candidates without the table copying them all.
+    """
+
+    def __init__(self, table, idx):
+        self.table = table
+        self.idx = idx
+
+    def __len__(self):
+        return len(self.idx)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return self.table.sequences(self.idx[k])
+        return self.table.sequence(int(self.idx[k]))
+
+    def __iter__(self):
+        return iter(self.table.sequences(self.idx))
+
+class CandidateTable:
+    """
+    Compact store for a run's candidates: every sequence's residues in one
+    contiguous uint8 buffer with an int64 offsets array, plus one NumPy
+    column per property, score and status. Stages select rows with index
+    arrays (e.g. the survivors of filtering) and only decode the strings
+    they need. With `directory` set, the buffer and columns are
+    memory-mapped files there, so pages the run isn't touching can live on
+    disk; reopen a closed table with CandidateTable.open(directory).
+    """
+
+    def __init__(self, capacity=1024, residue_capacity=None, directory=None):
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.rows = 0
+        self.n_residues = 0
+        capacity = max(1, int(capacity))
+        self.residues = self._allocate("residues", np.uint8, int(residue_capacity or capacity * 20))
+        self.offsets = self._allocate("offsets", np.int64, capacity + 1)
+        self.offsets[0] = 0
+        self.columns = {}
+        for name, (dtype, fill) in COLUMNS.items():
+            self.columns[name] = self._allocate(name, dtype, capacity)
+            self.columns[name][:] = fill
+
+    def _path(self, name):
+        return os.path.join(self.directory, f"{name}.bin")
+
+    def _allocate(self, name, dtype, size, mode="w+"):
+        """
+        In-memory array, or a memory-mapped file under directory: "w+"
+        creates it, "grow" extends it keeping its contents, "r"/"r+" map
+        an existing one.
+        """
+        size = max(1, int(size))
+        if not self.directory:
+            return np.empty(size, dtype=dtype)
+        if mode in ("w+", "grow"):
+            with open(self._path(name), "wb" if mode == "w+" else "r+b") as f:
+                f.truncate(size * np.dtype(dtype).itemsize)
+            mode = "r+"
+        return np.memmap(self._path(name), dtype=dtype, mode=mode, shape=(size,))
+
+    def _grow(self, name, array, needed):
+        if needed <= len(array):
+            return array
+        size = max(needed, 2 * len(array))
+        if self.directory:
+            array.flush()
+            return self._allocate(name, array.dtype, size, mode="grow")
+        grown = np.empty(size, dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+    def _reserve(self, rows, residues):
+        self.residues = self._grow("residues", self.residues, self.n_residues + residues)
+        self.offsets = self._grow("offsets", self.offsets, self.rows + rows + 1)
+        for name, (_, fill) in COLUMNS.items():
+            old = len(self.columns[name])
+            self.columns[name] = self._grow(name, self.columns[name], self.rows + rows)
+            self.columns[name][old:] = fill
+
+    def __len__(self):
+        return self.rows
+
+    def extend(self, sequences):
+        """
+        Appends sequences and returns their row indices. Characters outside
+        ASCII are stored as '?' (one byte each), so they fail the filter's
+        canonical-residue check like any other unknown residue.
+        """
+        sequences = list(sequences)
+        buf = np.frombuffer("".join(sequences).encode("ascii", errors="replace"), dtype=np.uint8)
+        lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+        self._reserve(len(sequences), len(buf))
+        start = self.rows
+        self.residues[self.n_residues:self.n_residues + len(buf)] = buf
+        np.cumsum(lengths, out=self.offsets[start + 1:start + 1 + len(sequences)])
+        self.offsets[start + 1:start + 1 + len(sequences)] += self.n_residues
+        self.rows += len(sequences)
+        self.n_residues += len(buf)
+        return np.arange(start, self.rows)
+
+    def extend_stream(self, stream, chunk_size=65536):
+        """Appends a sequence iterator chunk by chunk; returns the rows added."""
+        added, chunk = 0, []
+        for seq in stream:
+            chunk.append(seq)
+            if len(chunk) >= chunk_size:
+                added += len(self.extend(chunk))
+                chunk = []
+        if chunk:
+            added += len(self.extend(chunk))
+        return added
+
+    def lengths(self, idx=None):
+        if idx is None:
+            return np.diff(self.offsets[:self.rows + 1])
+        return self.offsets[idx + 1] - self.offsets[idx]
+
+    def packed(self, idx=None):
+        """
+        (residues, offsets) of rows `idx` (default all), packed like
+        PropertyEngine.encode's input: offsets start at 0 and have
+        len(idx) + 1 entries. A contiguous run of rows is returned as views
+        of the buffer without copying.
+        """
+        if idx is None:
+            idx = np.arange(self.rows)
+        idx = np.asarray(idx, dtype=np.int64)
+        if len(idx) and (np.diff(idx) == 1).all():
+            first, last = self.offsets[idx[0]], self.offsets[idx[-1] + 1]
+            return self.residues[first:last], self.offsets[idx[0]:idx[-1] + 2] - first
+        starts, lengths = self.offsets[idx], self.lengths(idx)
+        offsets = np.zeros(len(idx) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        gather = np.arange(offsets[-1]) - np.repeat(offsets[:-1] - starts, lengths)
+        return self.residues[gather], offsets
+
+    def sequence(self, k):
+        return self.residues[self.offsets[k]:self.offsets[k + 1]].tobytes().decode("ascii")
+
+    def sequences(self, idx=None):
+        """Decodes rows `idx` (default all) to a list of strings."""
+        buf, offsets = self.packed(idx)
+        text = buf.tobytes().decode("ascii")
+        bounds = offsets.tolist()
+        return [text[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def view(self, idx):
+        return CandidateView(self, np.asarray(idx, dtype=np.int64))
+
+    def column(self, name):
+        return self.columns[name][:self.rows]
+
+    def set(self, name, idx, values):
+        self.columns[name][idx] = values
+
+    def where(self, status):
+        """Row indices with the given status code."""
+        return np.flatnonzero(self.column("status") == status)
+
+    def stats(self):
+        nbytes = self.n_residues + 8 * (self.rows + 1) + sum(
+            np.dtype(dtype).itemsize * self.rows for dtype, _ in COLUMNS.values()
+        )
+        counts = np.bincount(self.column("status"), minlength=len(STATUSES))
+        return {
+            "rows": self.rows,
+            "residues": self.n_residues,
+            "mb": nbytes / 2**20,
+            "memory_mapped": bool(self.directory),
+            "status": {status: int(n) for status, n in zip(STATUSES, counts)},
+        }
+
+    def close(self):
+        """
+        Memory-mapped tables: trims the files to the rows in use and writes
+        table.json so CandidateTable.open can map them again.
+        """
+        if not self.directory:
+            return
+        sizes = {"residues": self.n_residues, "offsets": self.rows + 1}
+        sizes.update({name: self.rows for name in COLUMNS})
+        arrays = dict(self.columns, residues=self.residues, offsets=self.offsets)
+        for name, array in arrays.items():
+            array.flush()
+            os.truncate(self._path(name), max(1, sizes[name]) * array.dtype.itemsize)
+        self.columns = {}
+        self.residues = self.offsets = None
+        self._write_meta()
+        logger.info(f"Saved candidate table ({self.rows} rows) to {self.directory}")
+
+    def flush(self):
+        """
+        Memory-mapped tables: writes the rows so far to disk, with table.json,
+        while keeping the table open; CandidateTable.open can then map them.
+        """
+        if not self.directory:
+            return
+        for array in (self.residues, self.offsets, *self.columns.values()):
+            array.flush()
+        self._write_meta()
+
+    def _write_meta(self):
+        with open(os.path.join(self.directory, "table.json"), "w") as f:
+            json.dump({"rows": self.rows, "residues": self.n_residues,
+                       "columns": {name: np.dtype(dtype).name for name, (dtype, _) in COLUMNS.items()}}, f, indent=2)
+
+    @classmethod
+    def open(cls, directory, mode="r"):
+        """Maps a table saved by close(); mode "r+" allows updating columns in place."""
+        with open(os.path.join(directory, "table.json")) as f:
+            meta = json.load(f)
+        table = cls.__new__(cls)
+        table.directory = directory
+        table.rows, table.n_residues = meta["rows"], meta["residues"]
+        table.residues = table._allocate("residues", np.uint8, table.n_residues, mode="r")
+        table.offsets = table._allocate("offsets", np.int64, table.rows + 1, mode="r")
+        table.columns = {name: table._allocate(name, dtype, table.rows, mode=mode) for name, (dtype, _) in COLUMNS.items()}
+        return table
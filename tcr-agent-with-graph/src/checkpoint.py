@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("generation", "filtering", "ranking", "docking")
+
+def config_hash(config):
+    """Stable hash of a job config; a run can only be resumed under the same one."""
+    canonical = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+class RunCheckpoint:
+    """
+    Run directory holding each completed stage's output plus a manifest
+    with the config hash. Stage outputs are written atomically
+    (<stage>.json), and long stages append progress to <stage>.partial.jsonl
+    so an interrupted run can pick up where it stopped.
+    """
+
+    def __init__(self, run_dir, config):
+        self.run_dir = run_dir
+        self.config_hash = config_hash(config)
+        self.manifest_path = os.path.join(run_dir, "manifest.json")
+        self._partial_files = {}
+        os.makedirs(run_dir, exist_ok=True)
+
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+            if self.manifest.get("config_hash") != self.config_hash:
+                raise ValueError(
+                    f"Run directory {run_dir} was created with a different config "
+                    f"(hash {self.manifest.get('config_hash', '?')[:12]}); refusing to resume."
+                )
+        else:
+            self.manifest = {"config_hash": self.config_hash, "created": time.time(), "stages": {}}
+            self._write_json(self.manifest_path, self.manifest)
+
+    @classmethod
+    def create(cls, root, config):
+        """New, timestamped run directory under root."""
+        run_dir = os.path.join(root, f"{time.strftime('%Y%m%d-%H%M%S')}-{config_hash(config)[:8]}")
+        return cls(run_dir, config)
+
+    @classmethod
+    def latest(cls, root, config):
+        """Most recent run directory under root created with this config, or None."""
+        suffix = f"-{config_hash(config)[:8]}"
+        if not os.path.isdir(root):
+            return None
+        runs = sorted(d for d in os.listdir(root) if d.endswith(suffix))
+        return cls(os.path.join(root, runs[-1]), config) if runs else None
+
+    def _write_json(self, path, data):
+        # Write then rename, so a crash never leaves a half-written artifact
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    def is_done(self, stage):
+        return stage in self.manifest["stages"]
+
+    def load(self, stage):
+        """Output of a completed stage, or None."""
+        if not self.is_done(stage):
+            return None
+        with open(os.path.join(self.run_dir, f"{stage}.json")) as f:
+            return json.load(f)
+
+    def save(self, stage, data):
+        """Persists a stage's output and marks it complete."""
+        self._write_json(os.path.join(self.run_dir, f"{stage}.json"), data)
+        self.close_partial(stage)
+        self.manifest["stages"][stage] = {"completed": time.time()}
+        self._write_json(self.manifest_path, self.manifest)
+        logger.info(f"Checkpoint: {stage} saved to {self.run_dir}")
+
+    def append_partial(self, stage, records):
+        """Appends records (JSON-serialisable) to the stage's progress log."""
+        f = self._partial_files.get(stage)
+        if f is None:
+            f = self._partial_files[stage] = open(os.path.join(self.run_dir, f"{stage}.partial.jsonl"), "a")
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+        f.flush()
+
+    def load_partial(self, stage):
+        """Records appended before an interruption (a torn last line is dropped)."""
+        path = os.path.join(self.run_dir, f"{stage}.partial.jsonl")
+        if not os.path.exists(path):
+            return []
+        records = []
+        with open(path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+        return records
+
+    def close_partial(self, stage=None):
+        for name in ([stage] if stage else list(self._partial_files)):
+            f = self._partial_files.pop(name, None)
+            if f is not None:
+                f.close()
+
+class CheckpointedRanker:
+    """
+    Wraps a ranker so scores are appended to the run's ranking progress log
+    every `interval` sequences. Sequences scored before an interruption are
+    taken from the log instead of being scored again.
+    """
+
+    def __init__(self, ranker, checkpoint, interval=256):
+        self.ranker = ranker
+        self.checkpoint = checkpoint
+        self.interval = max(1, int(interval))
+        self.scores = {seq: score for seq, score in checkpoint.load_partial("ranking")}
+        if self.scores:
+            logger.info(f"Checkpoint: reusing {len(self.scores)} partial ranking scores.")
+
+    def score_sequences(self, sequences):
+        todo = [seq for seq in dict.fromkeys(sequences) if seq not in self.scores]
+        for start in range(0, len(todo), self.interval):
+            fresh = self.ranker.score_sequences(todo[start:start + self.interval])
+            self.scores.update(fresh)
+            self.checkpoint.append_partial("ranking", fresh)
+
+        scored_seqs = [(seq, self.scores[seq]) for seq in sequences]
+        # Same stable sort as TCRRanker.score_sequences
+        scored_seqs.sort(key=lambda x: x[1], reverse=True)
+        return scored_seqs
@@ -0,0 +1,196 @@
+import logging
+import numpy as np
+from src.property_engine import PropertyEngine, AMINO_ACIDS
+
+logger = logging.getLogger(__name__)
+
+# Mersenne prime for the MinHash permutations (a * x + b mod p)
+_PRIME = (1 << 31) - 1
+
+def within_edits(a, b, k):
+    """
+    True if the Levenshtein distance between a and b is <= k. Only the
+    diagonal band of width 2k+1 is filled, with an early exit once every
+    cell in a row exceeds k.
+    """
+    if abs(len(a) - len(b)) > k:
+        return False
+    if k == 0:
+        return a == b
+    if k == 1:
+        # One substitution or one indel: skip the common prefix, compare the rest
+        if len(a) < len(b):
+            a, b = b, a
+        i = 0
+        while i < len(b) and a[i] == b[i]:
+            i += 1
+        if len(a) == len(b):
+            return a[i + 1:] == b[i + 1:]
+        return a[i + 1:] == b[i:]
+    big = k + 1
+    previous = [j if j <= k else big for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [big] * (len(b) + 1)
+        if i <= k:
+            current[0] = i
+        for j in range(max(1, i - k), min(len(b), i + k) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost, big)
+        if min(current) > k:
+            return False
+        previous = current
+    return previous[len(b)] <= k
+
+class DedupIndex:
+    """
+    Online exact + near-duplicate index. Each new sequence either joins an
+    existing cluster, because it is identical to a seen sequence or within
+    `max_edits` edits of a cluster representative, or becomes the
+    representative of a new cluster. Near-duplicate candidates come from a
+    MinHash LSH index over residue k-mers (`bands` x `rows` hashes) that
+    holds only representatives and is checked with at most `max_candidates`
+    edit-distance checks per lookup, so the cost per sequence stays flat
+    however many sequences have been indexed.
+    """
+
+    def __init__(self, max_edits=1, kmer=3, bands=32, rows=3, max_candidates=64, seed=0):
+        self.max_edits = int(max_edits)
+        self.kmer = int(kmer)
+        self.bands = int(bands)
+        self.rows = int(rows)
+        self.max_candidates = int(max_candidates)
+        self.engine = PropertyEngine()
+
+        rng = np.random.default_rng(seed)
+        n_hashes = self.bands * self.rows
+        self._hash_a = rng.integers(1, _PRIME, size=n_hashes, dtype=np.int64)
+        self._hash_b = rng.integers(0, _PRIME, size=n_hashes, dtype=np.int64)
+
+        self.representatives = []  # cluster id -> representative sequence
+        self.sizes = []  # cluster id -> number of sequences added to it
+        self._cluster_of = {}  # sequence -> cluster id
+        # band key -> cluster id, or a tuple of ids once several share it. Ints and
+        # tuples aren't tracked by the cyclic GC, so millions of buckets stay cheap
+        self._buckets = [{} for _ in range(self.bands)]
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+
+    def _band_keys(self, sequences):
+        """
+        (n, bands) uint64 LSH keys, plus a mask of sequences that have at
+        least one canonical k-mer (the others can only match exactly).
+        """
+        n = len(sequences)
+        codes, offsets = self.engine.encode(sequences)
+        lengths = np.diff(offsets)
+        k = self.kmer
+        has_kmers = np.zeros(n, dtype=bool)
+        keys = np.zeros((n, self.bands), dtype=np.uint64)
+        if len(codes) < k:
+            return keys, has_kmers
+
+        # k-mer id at every flat position, kept only if it stays inside one sequence
+        span = len(codes) - k + 1
+        ids = np.zeros(span, dtype=np.int64)
+        ok = np.ones(span, dtype=bool)
+        for t in range(k):
+            window = codes[t:span + t]
+            ids = ids * len(AMINO_ACIDS) + window
+            ok &= window >= 0
+        owner = np.repeat(np.arange(n), lengths)[:span]
+        ok &= np.arange(span) + k <= offsets[owner + 1]
+        ids, owner = ids[ok], owner[ok]
+        if not len(ids):
+            return keys, has_kmers
+
+        # ids are grouped by owner in order, so reduceat gives each sequence's minimum.
+        # Only distinct k-mers are hashed; occurrences gather from that table.
+        has_kmers[owner] = True
+        segment_starts = np.flatnonzero(np.r_[True, owner[1:] != owner[:-1]])
+        distinct, inverse = np.unique(ids, return_inverse=True)
+        hashed = (self._hash_a[:, None] * distinct[None, :] + self._hash_b[:, None]) % _PRIME
+        signatures = np.empty((len(segment_starts), len(self._hash_a)), dtype=np.int64)
+        for h in range(len(self._hash_a)):
+            signatures[:, h] = np.minimum.reduceat(hashed[h][inverse], segment_starts)
+
+        band_keys = np.zeros((len(segment_starts), self.bands), dtype=np.uint64)
+        for r in range(self.rows):
+            band_keys = band_keys * np.uint64(1_000_003) + signatures[:, r::self.rows].astype(np.uint64)
+        keys[has_kmers] = band_keys
+        return keys, has_kmers
+
+    def add(self, sequences):
+        """
+        Adds sequences in order and returns the ones that started a new
+        cluster (the representatives worth scoring), in input order.
+        """
+        keys, has_kmers = self._band_keys(sequences)
+        keys = keys.tolist()
+        new_representatives = []
+        for i, seq in enumerate(sequences):
+            cluster = self._cluster_of.get(seq)
+            if cluster is not None:
+                self.exact_duplicates += 1
+                self.sizes[cluster] += 1
+                continue
+
+            row = keys[i] if has_kmers[i] else None
+            if row is not None and self.max_edits > 0:
+                cluster = self._find_near(seq, row)
+            if cluster is not None:
+                self.near_duplicates += 1
+                self.sizes[cluster] += 1
+            else:
+                cluster = len(self.representatives)
+                self.representatives.append(seq)
+                self.sizes.append(1)
+                if row is not None:
+                    for band, key in zip(self._buckets, row):
+                        members = band.get(key)
+                        if members is None:
+                            band[key] = cluster
+                        elif isinstance(members, int):
+                            band[key] = (members, cluster)
+                        else:
+                            band[key] = members + (cluster,)
+                new_representatives.append(seq)
+            self._cluster_of[seq] = cluster
+        return new_representatives
+
+    def _find_near(self, seq, row):
+        candidates = set()
+        for band, key in zip(self._buckets, row):
+            members = band.get(key)
+            if members is None:
+                continue
+            if isinstance(members, int):
+                candidates.add(members)
+            else:
+                candidates.update(members)
+        # Oldest clusters first, so assignment doesn't depend on bucket order
+        for cluster in sorted(candidates)[:self.max_candidates]:
+            if within_edits(seq, self.representatives[cluster], self.max_edits):
+                return cluster
+        return None
+
+    def representative(self, sequence):
+        """Representative of the cluster `sequence` was added to (None if never added)."""
+        cluster = self._cluster_of.get(sequence)
+        return self.representatives[cluster] if cluster is not None else None
+
+    def cluster_size(self, sequence):
+        """Number of added sequences in the cluster that `sequence` belongs to."""
+        cluster = self._cluster_of.get(sequence)
+        return self.sizes[cluster] if cluster is not None else 0
+
+    def stats(self, top_n=5):
+        sizes = np.array(self.sizes, dtype=np.int64)
+        largest = np.argsort(-sizes, kind="stable")[:top_n]
+        return {
+            "sequences": int(sizes.sum()),
+            "clusters": len(sizes),
+            "exact_duplicates": self.exact_duplicates,
+            "near_duplicates": self.near_duplicates,
+            "singletons": int((sizes == 1).sum()),
+            "largest_clusters": [(self.representatives[c], int(sizes[c])) for c in largest if sizes[c] > 1],
+        }
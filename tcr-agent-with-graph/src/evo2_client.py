@@ -0,0 +1,182 @@
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+EVO2_URL = "https://health.api.nvidia.com/v1/biology/arc/evo2-40b/generate"
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: allows `rate` requests/sec on average with
+    bursts of up to `burst`. A rate of None/0 disables limiting.
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate or 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_s = (1 - self.tokens) / self.rate
+            time.sleep(wait_s)
+
+class Evo2RequestError(Exception):
+    """A request that failed permanently (non-retryable status or retries exhausted)."""
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+class Evo2Client:
+    """
+    Concurrent Evo2 /generate client. One pooled requests.Session is shared by
+    up to `concurrency` worker threads; every request passes through a token
+    bucket, and 429/5xx/connection errors are retried with exponential
+    backoff (honouring Retry-After when the server sends it).
+    """
+
+    def __init__(self, api_key, url=EVO2_URL, concurrency=8, rate_limit=None, burst=None,
+                 max_retries=5, backoff_base=0.5, backoff_max=30.0, timeout=60):
+        self.url = url
+        self.concurrency = max(1, int(concurrency))
+        self.max_retries = int(max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate_limit, burst)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(self.backoff_max, float(retry_after))
+            except ValueError:
+                pass
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        # Jitter so concurrent workers don't retry in lockstep
+        return delay * (0.5 + random.random() / 2)
+
+    def _wait(self, attempt, response=None):
+        # No backoff after the last attempt; the caller is about to give up
+        if attempt < self.max_retries:
+            time.sleep(self._backoff(attempt, response))
+
+    @staticmethod
+    def _generated_text(response):
+        """The generated text of a 200 response; ValueError if the body isn't a usable result."""
+        data = response.json()  # JSONDecodeError is a ValueError
+        if not isinstance(data, dict):
+            raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+        # Evo2 NIM returns the sample under 'sequence'; OpenAI-style gateways use choices -> text
+        text = data.get('sequence')
+        if text is None:
+            choices = data.get('choices')
+            if not choices or not isinstance(choices[0], dict):
+                raise ValueError("no 'sequence' and no 'choices' in response")
+            text = choices[0].get('text', '')
+        if not isinstance(text, str):
+            raise ValueError(f"generated text is a {type(text).__name__}, not a string")
+        return text.strip()
+
+    def generate_one(self, payload):
+        """
+        Makes one /generate call (with retries) and returns the generated DNA text.
+        """
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                response = self.session.post(self.url, json=payload, timeout=self.timeout)
+            except requests.RequestException as e:
+                last_error = f"connection error: {e}"
+                self._wait(attempt)
+                continue
+
+            if response.status_code == 429 or response.status_code >= 500:
+                last_error = f"HTTP {response.status_code}"
+                self._wait(attempt, response)
+                continue
+            if response.status_code >= 400:
+                raise Evo2RequestError(f"HTTP {response.status_code}: {response.text[:200]}")
+
+            try:
+                return self._generated_text(response)
+            except ValueError as e:
+                # A malformed 200 body is retried like a server error
+                last_error = f"malformed response: {e}"
+                self._wait(attempt)
+
+        raise Evo2RequestError(f"gave up after {self.max_retries + 1} attempts ({last_error})", retryable=True)
+
+    def iter_generate(self, payload, n_sequences, parse, max_attempts, stats=None):
+        """
+        Issues up to `max_attempts` calls, at most `concurrency` in flight, and
+        yields outputs as soon as `parse` accepts them (it returns the parsed
+        value or None to discard) until `n_sequences` have been yielded. Stops
+        early on non-retryable errors. Call counters are written into `stats`.
+        """
+        stats = stats if stats is not None else {}
+        stats.update({"calls": 0, "accepted": 0, "discarded": 0, "failed": 0})
+        in_flight = set()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while stats["accepted"] < n_sequences:
+                # Top up, but never ask for more outputs than we still need
+                while (len(in_flight) < self.concurrency and stats["calls"] < max_attempts
+                       and stats["accepted"] + len(in_flight) < n_sequences):
+                    in_flight.add(pool.submit(self.generate_one, payload))
+                    stats["calls"] += 1
+                if not in_flight:
+                    break
+
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                fatal = None
+                for future in done:
+                    try:
+                        parsed = parse(future.result())
+                    except Evo2RequestError as e:
+                        stats["failed"] += 1
+                        logger.warning(f"Evo2 generation failed: {e}")
+                        if not e.retryable:
+                            fatal = e
+                        continue
+                    if parsed is None:
+                        stats["discarded"] += 1
+                    elif stats["accepted"] < n_sequences:
+                        stats["accepted"] += 1
+                        yield parsed
+
+                if fatal:
+                    # e.g. 401/422: every further call would fail the same way
+                    for future in in_flight:
+                        future.cancel()
+                    break
+
+    def close(self):
+        self.session.close()
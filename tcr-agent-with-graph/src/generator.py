@@ -1,22 +1,39 @@
 import os
-import requests
 import logging
 import random
 import re
-from Bio.Seq import Seq
+from src.evo2_client import Evo2Client, EVO2_URL
 
 logger = logging.getLogger(__name__)
 
-def generate_sequences_evo2(seed_sequence="CAS", num_tokens=20, top_k=4, temperature=1.0, n_sequences=10):
+def generate_sequences_evo2(seed_sequence="CAS", num_tokens=20, top_k=4, temperature=1.0, n_sequences=10,
+                            concurrency=8, rate_limit=None, max_retries=5, max_attempts=None, url=None):
     """
     Generates CDR3 sequences using NVIDIA Evo2 API (Genomic Model).
     Handles Protein -> DNA seed conversion and DNA -> Protein output translation.
+    The API returns one sample per call, so calls are issued concurrently
+    (`concurrency` in flight, `rate_limit` calls/sec, retries on 429/5xx)
+    until `n_sequences` proteins are collected or `max_attempts` calls
+    (default 3 x n_sequences) are spent.
+    """
+    return list(stream_sequences_evo2(
+        seed_sequence, num_tokens, top_k, temperature, n_sequences,
+        concurrency=concurrency, rate_limit=rate_limit, max_retries=max_retries,
+        max_attempts=max_attempts, url=url
+    ))
+
+def stream_sequences_evo2(seed_sequence="CAS", num_tokens=20, top_k=4, temperature=1.0, n_sequences=10,
+                          concurrency=8, rate_limit=None, max_retries=5, max_attempts=None, url=None):
+    """
+    Same as generate_sequences_evo2, but yields each sequence as soon as it
+    arrives so downstream stages can start before generation finishes.
     """
     api_key = os.getenv('NVIDIA_API_KEY')
     
     if not api_key:
         logger.warning("NVIDIA_API_KEY not found. Using mock generator.")
-        return _mock_generate(n_sequences)
+        yield from _mock_generate(n_sequences)
+        return
 
     # Evo2 is a DNA model. We must provide a DNA seed.
     # If the seed looks like Protein (contains non-ATCG chars), convert to default DNA seed.
@@ -31,14 +48,6 @@ def generate_sequences_evo2(seed_sequence="CAS", num_tokens=20, top_k=4, tempera
     # We'll use a safe multiplier or the config value if higher.
     dna_tokens = max(num_tokens * 3, 128) 
 
-    # CORRECT URL for Evo2 NIM
-    url = "https://health.api.nvidia.com/v1/biology/arc/evo2-40b/generate"
-    
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    
     # CORRECT PAYLOAD KEYS for Evo2 NIM
     # Removed 'num_return_sequences' as it causes 422 errors on this endpoint
     payload = {
@@ -47,70 +56,45 @@ def generate_sequences_evo2(seed_sequence="CAS", num_tokens=20, top_k=4, tempera
         "top_k": top_k,
         "temperature": temperature
     }
-    
-    # Note: Since we can't request multiple sequences in one call (if API doesn't support it),
-    # we might need to loop. However, to keep it simple and fast for now, we'll make one call
-    # and if it returns one sequence, we might need to loop 'n_sequences' times.
-    # BUT, for this fix, we strictly follow the user's requested payload structure.
-    # We will loop to get n_sequences if the API only returns one.
-    
-    generated_proteins = []
-    
-    # We need n_sequences. If the API only supports 1 per call, we loop.
-    # To avoid hitting rate limits or taking too long, we'll try to be efficient.
-    # For the demo (n=100), this might be slow if we do 100 calls.
-    # Let's assume for now we just do a few calls or just one batch if possible.
-    # But the user removed 'num_return_sequences', implying single generation or different mechanism.
-    # We will implement a loop up to n_sequences, but cap it to avoid timeout in this environment.
-    
-    # Actually, let's just do a loop of 5 calls max to demonstrate it works, 
-    # and fill the rest with mock if needed, OR just loop n times. 
-    # Given the user wants 100 sequences, 100 HTTP calls is a lot.
-    # We will try to get at least some valid ones.
-    
-    # Optimization: We'll try to get 'n_sequences' by calling the API multiple times.
-    # But to be safe, we'll just do a smaller number of real calls and fill the rest if needed,
-    # OR we just do the calls. Let's try to do up to 5 real calls to verify the fix works.
-    # If the user wants 100, we might need a different approach (batching), but the API payload restriction is strict.
-    
-    # Let's try to fetch a few real ones.
-    max_real_calls = 5 
-    
-    for _ in range(min(n_sequences, max_real_calls)):
-        try:
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            
-            # Extract DNA sequences
-            # Standard NIM response might be in 'choices' -> 'text'
-            # If it returns one sequence
-            text = data.get('choices', [{}])[0].get('text', '').strip()
-            if text:
-                # Clean DNA
-                clean_dna = re.sub(r'[^ATCGatcg]', '', text)
-                try:
-                    protein_seq = str(Seq(clean_dna).translate(to_stop=True))
-                    if len(protein_seq) >= 5:
-                        generated_proteins.append(protein_seq)
-                except:
-                    pass
-        except Exception as e:
-            logger.warning(f"Evo2 single generation failed: {e}")
-            break # Stop trying if one fails
-            
-    # If we have some real sequences, great. If we need more to reach n_sequences,
-    # we can either loop more (slow) or fill with mock for the demo.
-    # The user's prompt implies "The generator should now speak DNA...".
-    # I will fill the rest with mock to ensure the pipeline continues with 100 candidates.
-    
-    if len(generated_proteins) < n_sequences:
-        logger.info(f"Generated {len(generated_proteins)} sequences from API. Filling remaining {n_sequences - len(generated_proteins)} with mock data.")
-        generated_proteins.extend(_mock_generate(n_sequences - len(generated_proteins)))
-        
-    return generated_proteins
 
-    # Original Error Handling / Fallback logic preserved in the loop above.
+    client = Evo2Client(
+        api_key,
+        url=url or os.getenv('EVO2_URL', EVO2_URL),
+        concurrency=concurrency,
+        rate_limit=rate_limit,
+        max_retries=max_retries
+    )
+    stats = {}
+    try:
+        yield from client.iter_generate(
+            payload, n_sequences, _dna_to_protein,
+            max_attempts=max_attempts or 3 * n_sequences,
+            stats=stats
+        )
+    finally:
+        client.close()
+
+    logger.info(
+        f"Evo2: {stats['accepted']} sequences from {stats['calls']} calls "
+        f"({stats['discarded']} too short/untranslatable, {stats['failed']} failed)."
+    )
+
+    # Only pad with mock data if the API budget ran out or the API refused us
+    if stats['accepted'] < n_sequences:
+        logger.warning(f"Filling remaining {n_sequences - stats['accepted']} with mock data.")
+        yield from _mock_generate(n_sequences - stats['accepted'])
+
+def _dna_to_protein(text):
+    """Translates raw Evo2 DNA output to protein; None if unusable"""
+    clean_dna = re.sub(r'[^ATCGatcg]', '', text)
+    # Trim to whole codons so Biopython doesn't warn about partial ones
+    clean_dna = clean_dna[:len(clean_dna) - len(clean_dna) % 3]
+    from Bio.Seq import Seq  # deferred: only real Evo2 output needs translating
+    try:
+        protein_seq = str(Seq(clean_dna).translate(to_stop=True))
+    except Exception:
+        return None
+    return protein_seq if len(protein_seq) >= 5 else None
 
 def _mock_generate(n):
     """Fallback mock generator"""
@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import logging
+import resource
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+def peak_rss_mb():
+    # ru_maxrss is the process high-water mark, in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def current_rss_mb():
+    """Resident set size right now (Linux /proc); None where unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        return None
+
+class RunMetrics:
+    """
+    Per-stage timings for one run. stage() wraps a block and records wall
+    time, CPU time (process-wide, so overlapping streaming stages share it),
+    item count and peak RSS while the block ran; repeated names (e.g. one
+    span per filter chunk) are aggregated. Every span is also kept as a
+    Chrome trace event on its thread, so write() can emit a timeline that
+    loads in chrome://tracing or Perfetto.
+
+    Stage peaks come from a background thread sampling current RSS every
+    `sample_interval` seconds while any span is open (plus a sample at each
+    span's start and end). Resetting the kernel's high-water mark per stage
+    would not work here, since streaming stages overlap and the reset is
+    process-wide. Where current RSS can't be read, the process-wide peak
+    is used instead; summary() reports that peak separately either way.
+    """
+
+    def __init__(self, sample_interval=0.01):
+        self.stages = {}
+        self.events = []
+        self.thread_names = {}
+        self.sample_interval = sample_interval
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._open = {}  # open span -> [peak RSS so far]
+        self._busy = threading.Event()
+        self._sampler = None
+
+    def _sample(self):
+        rss = current_rss_mb()
+        if rss is None:
+            rss = peak_rss_mb()
+        with self._lock:
+            for peak in self._open.values():
+                peak[0] = max(peak[0], rss)
+
+    def _sample_loop(self):
+        while True:
+            self._busy.wait()
+            self._sample()
+            time.sleep(self.sample_interval)
+
+    @contextmanager
+    def stage(self, name, items=None):
+        """Times a block; set record['items'] inside it to report a count."""
+        record = {"items": items}
+        span = object()
+        with self._lock:
+            self._open[span] = [0.0]
+            self._busy.set()
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_loop, name="rss-sampler", daemon=True)
+                self._sampler.start()
+        self._sample()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            wall_end, cpu_seconds = time.perf_counter(), time.process_time() - cpu_start
+            self._sample()
+            with self._lock:
+                peak = self._open.pop(span)[0]
+                if not self._open:
+                    self._busy.clear()
+            self._record(name, wall_start, wall_end, cpu_seconds, record["items"], peak)
+
+    def _record(self, name, wall_start, wall_end, cpu_seconds, items, peak_rss):
+        thread = threading.current_thread()
+        with self._lock:
+            agg = self.stages.setdefault(name, {
+                "calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "items": 0, "peak_rss_mb": 0.0
+            })
+            agg["calls"] += 1
+            agg["wall_seconds"] += wall_end - wall_start
+            agg["cpu_seconds"] += cpu_seconds
+            agg["items"] += items or 0
+            agg["peak_rss_mb"] = max(agg["peak_rss_mb"], peak_rss)
+            self.thread_names[thread.ident] = thread.name
+            self.events.append({
+                "name": name, "ph": "X", "pid": os.getpid(), "tid": thread.ident,
+                "ts": (wall_start - self._origin) * 1e6, "dur": (wall_end - wall_start) * 1e6,
+                "args": {"items": items, "cpu_seconds": cpu_seconds, "peak_rss_mb": peak_rss},
+            })
+
+    def summary(self):
+        stages = {}
+        for name, agg in self.stages.items():
+            stages[name] = dict(agg)
+            stages[name]["items_per_sec"] = agg["items"] / agg["wall_seconds"] if agg["wall_seconds"] > 0 else 0.0
+        # Process-wide high-water mark, model load and all; stage entries are per stage
+        return {"stages": stages, "peak_rss_mb": peak_rss_mb()}
+
+    def write(self, directory, extra=None):
+        """Writes metrics.json (summary plus `extra`) and trace.json to directory."""
+        os.makedirs(directory, exist_ok=True)
+        metrics = self.summary()
+        metrics.update(extra or {})
+        with open(os.path.join(directory, "metrics.json"), "w") as f:
+            json.dump(metrics, f, indent=2)
+
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+            for tid, name in self.thread_names.items()
+        ]
+        with open(os.path.join(directory, "trace.json"), "w") as f:
+            json.dump({"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}, f)
+        logger.info(f"Saved run metrics and Chrome trace to {directory}")
+        return metrics
+
+@contextmanager
+def torch_profile(directory, enabled=True, row_limit=25):
+    """
+    Optionally wraps a block in torch.profiler (CPU activities, input shapes)
+    and saves an operator-level Chrome trace plus the top operators by
+    self CPU time. Only work in this process is profiled, not ranking
+    worker processes.
+    """
+    if not enabled:
+        yield
+        return
+    import torch
+    os.makedirs(directory, exist_ok=True)
+    with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU], record_shapes=True) as prof:
+        yield
+    prof.export_chrome_trace(os.path.join(directory, "torch_trace.json"))
+    table = prof.key_averages(group_by_input_shape=True).table(sort_by="self_cpu_time_total", row_limit=row_limit)
+    with open(os.path.join(directory, "torch_ops.txt"), "w") as f:
+        f.write(table)
+    logger.info(f"Saved torch.profiler trace and operator table to {directory}")
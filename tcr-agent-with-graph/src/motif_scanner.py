@@ -0,0 +1,159 @@
+import logging
+import numpy as np
+from src.property_engine import AMINO_ACIDS
+
+logger = logging.getLogger(__name__)
+
+# Any residue, as a 20-bit class mask
+_ANY = (1 << len(AMINO_ACIDS)) - 1
+
+def parse_motif(motif):
+    """
+    Parses a motif into one residue-class bitmask per position. Supports
+    literal residues, '.' or 'X' for any residue, and bracket classes such
+    as [ST] or [^P]; other regex syntax (quantifiers, alternation, anchors)
+    raises ValueError.
+    """
+    classes = []
+    i = 0
+    while i < len(motif):
+        ch = motif[i].upper()
+        if ch == "[":
+            end = motif.find("]", i)
+            if end == -1:
+                raise ValueError(f"Unclosed '[' in motif '{motif}'")
+            body = motif[i + 1:end].upper()
+            negate = body.startswith("^")
+            residues = body[1:] if negate else body
+            mask = 0
+            for aa in residues:
+                if aa not in AMINO_ACIDS:
+                    raise ValueError(f"Unknown residue '{aa}' in motif '{motif}'")
+                mask |= 1 << AMINO_ACIDS.index(aa)
+            classes.append(_ANY & ~mask if negate else mask)
+            i = end + 1
+        elif ch in (".", "X"):
+            classes.append(_ANY)
+            i += 1
+        elif ch in AMINO_ACIDS:
+            classes.append(1 << AMINO_ACIDS.index(ch))
+            i += 1
+        else:
+            raise ValueError(f"Unsupported syntax '{motif[i]}' in motif '{motif}'")
+    if not classes or 0 in classes:
+        raise ValueError(f"Motif '{motif}' can never match")
+    return classes
+
+class MotifHits:
+    """
+    Motif hits for a batch, sorted by sequence then start: parallel arrays
+    of sequence index, motif index and 0-based start position.
+    """
+
+    def __init__(self, rows, motifs, positions):
+        order = np.lexsort((motifs, positions, rows))
+        self.rows = rows[order]
+        self.motifs = motifs[order]
+        self.positions = positions[order]
+
+    def for_sequence(self, k):
+        """[(motif_index, start), ...] for sequence k, in sequence order."""
+        lo, hi = np.searchsorted(self.rows, [k, k + 1])
+        return list(zip(self.motifs[lo:hi].tolist(), self.positions[lo:hi].tolist()))
+
+    def first_motif(self, n):
+        """Per-sequence index of the earliest motif hit, -1 for none."""
+        first = np.full(n, -1, dtype=np.int32)
+        # Hits are sorted, so each sequence's first entry is its earliest hit
+        rows, idx = np.unique(self.rows, return_index=True)
+        first[rows] = self.motifs[idx]
+        return first
+
+class MotifScanner:
+    """
+    Multi-pattern motif matcher built once per motif list. All motifs are
+    compiled into one deterministic automaton over the 20 residues (an
+    Aho-Corasick automaton generalised to residue classes), so each
+    sequence is scanned in a single pass however many motifs are banned.
+    The scan steps every sequence of a batch together, one residue
+    position at a time.
+    """
+
+    def __init__(self, motifs, max_states=200_000):
+        self.motifs = list(motifs)
+        self.patterns = [parse_motif(m) for m in self.motifs]
+        self.lengths = np.array([len(p) for p in self.patterns], dtype=np.int64)
+        self._build(max_states)
+        logger.debug(f"Compiled {len(self.motifs)} motifs into a {len(self.outputs)}-state automaton.")
+
+    def _build(self, max_states):
+        # A state is the set of (pattern, matched_prefix_length) items alive
+        # after the residues read so far; full-length items are the outputs.
+        # Every pattern may start at any residue, so (p, 0) is always implied.
+        start = frozenset()
+        index = {start: 0}
+        states = [start]
+        transitions = []
+        self.outputs = []
+        for state in states:
+            row = np.zeros(len(AMINO_ACIDS) + 1, dtype=np.int32)  # last column: non-canonical -> start
+            live = [(p, i) for p, i in state if i < len(self.patterns[p])]
+            live += [(p, 0) for p in range(len(self.patterns))]
+            for aa in range(len(AMINO_ACIDS)):
+                bit = 1 << aa
+                target = frozenset((p, i + 1) for p, i in live if self.patterns[p][i] & bit)
+                if target not in index:
+                    if len(states) >= max_states:
+                        raise ValueError(f"Motif automaton exceeds {max_states} states; split the motif list")
+                    index[target] = len(states)
+                    states.append(target)
+                row[aa] = index[target]
+            transitions.append(row)
+            self.outputs.append(sorted(p for p, i in state if i == len(self.patterns[p])))
+        self.transitions = np.array(transitions)
+        self.accepting = np.array([bool(out) for out in self.outputs])
+        # Outputs flattened CSR-style so hits expand without a Python loop
+        self._out_counts = np.array([len(out) for out in self.outputs], dtype=np.int64)
+        self._out_offsets = np.concatenate([[0], np.cumsum(self._out_counts)[:-1]]).astype(np.int64)
+        self._out_motifs = np.array([p for out in self.outputs for p in out], dtype=np.int64)
+
+    def scan(self, codes, starts, lengths):
+        """
+        Scans the sequences given by starts/lengths into the flat code
+        array. Returns MotifHits with row indices local to this subset.
+        """
+        order = np.argsort(-lengths, kind="stable")
+        sorted_starts = starts[order]
+        sorted_lengths = lengths[order]
+        state = np.zeros(len(lengths), dtype=np.int32)
+        end_rows, end_states, end_positions = [], [], []
+        for j in range(int(sorted_lengths[0]) if len(lengths) else 0):
+            n_active = np.searchsorted(-sorted_lengths, -j, side="left")
+            state = state[:n_active]
+            state = self.transitions[state, codes[sorted_starts[:n_active] + j]]
+            ended = np.flatnonzero(self.accepting[state])
+            if len(ended):
+                end_rows.append(order[ended])
+                end_states.append(state[ended])
+                end_positions.append(np.full(len(ended), j))
+
+        if not end_rows:
+            empty = np.zeros(0, dtype=np.int64)
+            return MotifHits(empty, empty, empty)
+        end_rows = np.concatenate(end_rows)
+        end_states = np.concatenate(end_states)
+        end_positions = np.concatenate(end_positions)
+
+        # Expand each accepting state into the motifs ending there
+        counts = self._out_counts[end_states]
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        motifs = self._out_motifs[np.repeat(self._out_offsets[end_states], counts) + within]
+        rows = np.repeat(end_rows, counts)
+        positions = np.repeat(end_positions, counts) - self.lengths[motifs] + 1
+        return MotifHits(rows, motifs, positions)
+
+    def scan_sequence(self, sequence, lut):
+        """[(motif, start), ...] for one sequence, using a residue lookup table."""
+        codes = lut[np.frombuffer(sequence.encode("ascii", errors="replace"), dtype=np.uint8)]
+        hits = self.scan(codes, np.zeros(1, dtype=np.int64), np.array([len(sequence)]))
+        return [(self.motifs[m], pos) for m, pos in hits.for_sequence(0)]
@@ -0,0 +1,104 @@
+import math
+import logging
+from contextlib import nullcontext
+
+logger = logging.getLogger(__name__)
+
+class SurvivorSampler:
+    """
+    Generates in rounds until `target` candidates have passed the TME filter
+    (and dedup, when a DedupIndex is given), instead of generating a fixed
+    raw count. Each round is sized from the acceptance rate seen so far,
+    a Beta prior of `prior_weight` pseudo-sequences at 1 - prior_rejection
+    updated with every filtered batch, so the expected yield of the round
+    is exactly the number of survivors still missing. Rounds are capped at
+    `max_batch` sequences and the run at `max_generated`, so a filter that
+    rejects nearly everything can't drain the generation budget. Survivors
+    beyond the target are dropped, not ranked (reported as surplus).
+    """
+
+    def __init__(self, filter_module, make_stream, target, deduper=None, prior_rejection=0.15, prior_weight=10,
+                 max_batch=1024, max_generated=None, metrics=None):
+        self.filter_module = filter_module
+        # make_stream(n) yields n generated sequences
+        self.make_stream = make_stream
+        self.target = max(1, int(target))
+        self.deduper = deduper
+        self.prior_rejection = prior_rejection
+        self.prior_weight = prior_weight
+        self.max_batch = max(1, int(max_batch))
+        self.max_generated = int(max_generated or 10 * self.target)
+        self.metrics = metrics
+        self.generated = 0
+        self.accepted = 0
+        self.rounds = []
+
+    def _span(self, name, items=None):
+        return self.metrics.stage(name, items) if self.metrics else nullcontext({"items": items})
+
+    def acceptance_rate(self):
+        """Posterior mean of the fraction of generated sequences that survive."""
+        prior_accepted = self.prior_weight * (1 - self.prior_rejection)
+        return (self.accepted + prior_accepted) / (self.generated + self.prior_weight)
+
+    def next_batch_size(self):
+        missing = self.target - self.accepted
+        if missing <= 0:
+            return 0
+        size = math.ceil(missing / max(self.acceptance_rate(), 1e-3))
+        return min(size, self.max_batch, self.max_generated - self.generated)
+
+    def _filter(self, batch, requested, estimate):
+        with self._span("oversample_filter", len(batch)):
+            passed, logs = self.filter_module.apply_all(batch)
+        if self.deduper is not None:
+            with self._span("oversample_dedup", len(passed)):
+                passed = self.deduper.add(passed)
+        self.generated += len(batch)
+        self.accepted += len(passed)
+        self.rounds.append({
+            "requested": requested,
+            "generated": len(batch),
+            "accepted": len(passed),
+            "acceptance_estimate": estimate,
+        })
+        logger.debug(f"Oversampling round {len(self.rounds)}: {len(passed)}/{len(batch)} accepted "
+                     f"({self.accepted}/{self.target} so far)")
+        return passed, logs
+
+    def run(self, replay=None):
+        """
+        Returns (clean_seqs, filter_logs, report). `replay` holds sequences
+        generated by an interrupted run; they are filtered first, as round 0.
+        """
+        clean_seqs, filter_logs = [], []
+        if replay:
+            passed, logs = self._filter(list(replay), len(replay), None)
+            clean_seqs.extend(passed)
+            filter_logs.extend(logs)
+
+        size = self.next_batch_size()
+        while size > 0:
+            estimate = self.acceptance_rate()
+            with self._span("oversample_generate") as span:
+                batch = list(self.make_stream(size))
+                span["items"] = len(batch)
+            if not batch:
+                break
+            passed, logs = self._filter(batch, size, estimate)
+            clean_seqs.extend(passed)
+            filter_logs.extend(logs)
+            size = self.next_batch_size()
+
+        surplus = clean_seqs[self.target:]
+        report = {
+            "target": self.target,
+            "generated": self.generated,
+            "accepted": self.accepted,
+            "kept": min(self.accepted, self.target),
+            "surplus": len(surplus),
+            "acceptance_rate": self.accepted / self.generated if self.generated else 0.0,
+            "reached": self.accepted >= self.target,
+            "rounds": self.rounds,
+        }
+        return clean_seqs[:self.target], filter_logs, report
@@ -0,0 +1,77 @@
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import torch
+from src.ranker import TCRRanker
+
+logger = logging.getLogger(__name__)
+
+# Per-process model replica, created once by _init_worker
+_WORKER_RANKER = None
+
+def _init_worker(model_path, revision, precision, threads):
+    global _WORKER_RANKER
+    torch.set_num_threads(threads)
+    _WORKER_RANKER = TCRRanker(model_path, revision=revision, precision=precision)
+
+def _score_batches(batches):
+    """
+    Runs a slice of the batch plan inside a worker. Each batch arrives as
+    [(sequence, rows)] so the worker tokenizes locally.
+    """
+    results = []
+    for batch in batches:
+        encoded = _WORKER_RANKER._encode_many([seq for seq, _ in batch])
+        local_batch = [(i, rows) for i, (_, rows) in enumerate(batch)]
+        results.append(_WORKER_RANKER._run_masked_batch(local_batch, encoded))
+    return results
+
+class ParallelRanker(TCRRanker):
+    """
+    TCRRanker that shards the batch plan across a pool of worker processes,
+    each holding its own BertForMaskedLM replica. The plan is built in the
+    parent and results are summed back in plan order, so scores are identical
+    for any worker count.
+    """
+
+    def __init__(self, model_path="wukevin/tcr-bert", num_workers=2, threads_per_worker=None, **kwargs):
+        super().__init__(model_path, **kwargs)
+        self.num_workers = max(1, int(num_workers))
+        # Default to splitting the cores evenly between replicas
+        self.threads_per_worker = int(threads_per_worker or max(1, (os.cpu_count() or 1) // self.num_workers))
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            logger.info(
+                f"Starting {self.num_workers} ranking workers "
+                f"({self.threads_per_worker} torch threads each)..."
+            )
+            # Spawn rather than fork: forking a process that already ran torch ops can deadlock
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_path, self.revision, self.precision, self.threads_per_worker)
+            )
+        return self._pool
+
+    def _run_batches(self, plan, sequences, encoded):
+        if self.num_workers == 1 or len(plan) < 2:
+            return super()._run_batches(plan, sequences, encoded)
+
+        shipped = [[(sequences[k], rows) for k, rows in batch] for batch in plan]
+        # A few slices per worker keeps them all busy without one task per batch
+        slice_size = max(1, len(shipped) // (self.num_workers * 4))
+        slices = [shipped[i:i + slice_size] for i in range(0, len(shipped), slice_size)]
+
+        results = []
+        for slice_results in self._get_pool().map(_score_batches, slices):
+            results.extend(slice_results)
+        return results
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
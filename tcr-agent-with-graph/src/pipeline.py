@@ -0,0 +1,158 @@
+import queue
+import logging
+import threading
+from contextlib import nullcontext
+
+logger = logging.getLogger(__name__)
+
+# End-of-stream marker passed down the queues
+_DONE = object()
+
+class StreamingPipeline:
+    """
+    Runs generate -> filter -> rank as concurrent stages joined by bounded
+    queues. Generated sequences are filtered in small chunks as they arrive
+    and survivors are scored as soon as a rank batch fills, so network-bound
+    generation overlaps CPU-bound ranking. The final ranking is built from
+    the same survivor order as the phased pipeline, so it returns the same
+    (seq, score) list (scores agree to float rounding, since batches are
+    composed differently). With a DedupIndex, only cluster representatives
+    are passed on to ranking. With ranker=None survivors are only collected
+    (for selection modes that need the whole pool) and the ranking is empty.
+    With a RunMetrics, each stage's work is recorded as spans on its thread.
+    """
+
+    def __init__(self, filter_module, ranker, queue_size=256, filter_chunk=32, rank_batch_size=64, deduper=None,
+                 metrics=None):
+        self.filter_module = filter_module
+        self.metrics = metrics
+        self.ranker = ranker
+        self.deduper = deduper
+        self.queue_size = queue_size
+        self.filter_chunk = max(1, int(filter_chunk))
+        self.rank_batch_size = max(1, int(rank_batch_size))
+        self._stop = threading.Event()
+
+    def _span(self, name, items=None):
+        return self.metrics.stage(name, items) if self.metrics else nullcontext({"items": items})
+
+    def _put(self, q, item):
+        # Blocking put that gives up once any stage fails, so nothing deadlocks on a full queue
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        # Blocking get that returns the end marker once any stage fails
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def run(self, sequence_stream):
+        """
+        Consumes an iterable of generated sequences. Returns
+        (n_generated, clean_seqs, filter_logs, ranked_candidates), where
+        clean_seqs are the ranked survivors (representatives when deduplicating).
+        """
+        self._stop.clear()
+        generated_q = queue.Queue(maxsize=self.queue_size)
+        survivor_q = queue.Queue(maxsize=self.queue_size)
+        errors = []
+        counts = {"generated": 0}
+        filter_logs = []
+
+        def generate_stage():
+            try:
+                with self._span("stream_generate") as span:
+                    for seq in sequence_stream:
+                        if not self._put(generated_q, seq):
+                            return
+                        counts["generated"] += 1
+                        span["items"] = counts["generated"]
+            except Exception as e:
+                errors.append(e)
+                self._stop.set()
+            finally:
+                self._put(generated_q, _DONE)
+
+        def filter_stage():
+            try:
+                finished = False
+                while not finished:
+                    chunk = [self._get(generated_q)]
+                    # Take whatever else is already waiting, up to one chunk
+                    while len(chunk) < self.filter_chunk and chunk[-1] is not _DONE:
+                        try:
+                            chunk.append(generated_q.get_nowait())
+                        except queue.Empty:
+                            break
+                    if chunk[-1] is _DONE:
+                        finished = True
+                        chunk.pop()
+
+                    with self._span("stream_filter", len(chunk)):
+                        passed, logs = self.filter_module.apply_all(chunk)
+                        filter_logs.extend(logs)
+                    if self.deduper is not None:
+                        with self._span("stream_dedup", len(passed)):
+                            passed = self.deduper.add(passed)
+                    for seq in passed:
+                        if not self._put(survivor_q, seq):
+                            return
+            except Exception as e:
+                errors.append(e)
+                self._stop.set()
+            finally:
+                self._put(survivor_q, _DONE)
+
+        threads = [
+            threading.Thread(target=generate_stage, name="pipeline-generate", daemon=True),
+            threading.Thread(target=filter_stage, name="pipeline-filter", daemon=True),
+        ]
+        for t in threads:
+            t.start()
+
+        # Ranking runs in the calling thread; torch releases the GIL during forward passes
+        clean_seqs = []
+        scores = {}
+        batch = []
+        try:
+            while True:
+                item = self._get(survivor_q)
+                if item is _DONE:
+                    break
+                clean_seqs.append(item)
+                if self.ranker is None:
+                    continue
+                batch.append(item)
+                if len(batch) >= self.rank_batch_size:
+                    with self._span("stream_rank", len(batch)):
+                        scores.update(self.ranker.score_sequences(batch))
+                    batch = []
+            if batch and not self._stop.is_set():
+                with self._span("stream_rank", len(batch)):
+                    scores.update(self.ranker.score_sequences(batch))
+        except Exception:
+            self._stop.set()
+            raise
+        finally:
+            for t in threads:
+                t.join()
+
+        if errors:
+            raise errors[0]
+
+        if self.ranker is None:
+            return counts["generated"], clean_seqs, filter_logs, []
+
+        ranked = [(seq, scores[seq]) for seq in clean_seqs]
+        # Same stable sort as TCRRanker.score_sequences over the same survivor order
+        ranked.sort(key=lambda x: x[1], reverse=True)
+        return counts["generated"], clean_seqs, filter_logs, ranked
@@ -0,0 +1,246 @@
+import numpy as np
+from Bio.SeqUtils.ProtParamData import kd
+from Bio.SeqUtils.IsoelectricPoint import positive_pKs, negative_pKs, pKnterminal, pKcterminal
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+# Residues PropertyEngine accepts, either case
+_CANONICAL = frozenset(AMINO_ACIDS + AMINO_ACIDS.lower())
+
+def is_canonical(sequence):
+    """PropertyEngine.valid_mask for one sequence: non-empty, canonical residues only (either case)."""
+    return bool(sequence) and set(sequence) <= _CANONICAL
+
+# Charged side chains, in Biopython's summation order
+_POSITIVE_AAS = ("K", "R", "H")
+_NEGATIVE_AAS = ("D", "E", "C", "Y")
+
+class PropertyEngine:
+    """
+    Batch physicochemical properties with NumPy lookup tables.
+    Sequences are packed into one flat residue-code array plus offsets; GRAVY,
+    net charge and isoelectric point are then computed for the whole batch at
+    once with per-sequence table sums. Scales and pK tables are
+    Biopython's own, and pI uses the same bisection as
+    Bio.SeqUtils.IsoelectricPoint, so values match ProteinAnalysis.
+    """
+
+    def __init__(self, charge_ph=7.0):
+        self.charge_ph = charge_ph
+
+        # Byte -> residue index (0..19), -1 for anything non-canonical
+        self.lut = np.full(256, -1, dtype=np.int16)
+        for i, aa in enumerate(AMINO_ACIDS):
+            self.lut[ord(aa)] = i
+            self.lut[ord(aa.lower())] = i
+
+        self.kd = np.array([kd[aa] for aa in AMINO_ACIDS])
+        self._pos_idx = [AMINO_ACIDS.index(aa) for aa in _POSITIVE_AAS]
+        self._neg_idx = [AMINO_ACIDS.index(aa) for aa in _NEGATIVE_AAS]
+        self._pos_pks = [positive_pKs[aa] for aa in _POSITIVE_AAS]
+        self._neg_pks = [negative_pKs[aa] for aa in _NEGATIVE_AAS]
+        self._pos_scales = [10.0 ** -pk for pk in self._pos_pks]
+        self._neg_scales = [10.0 ** pk for pk in self._neg_pks]
+
+        # Terminal pKs depend on the first/last residue
+        self._nterm_pks = np.full(len(AMINO_ACIDS), positive_pKs["Nterm"])
+        for aa, pk in pKnterminal.items():
+            self._nterm_pks[AMINO_ACIDS.index(aa)] = pk
+        self._cterm_pks = np.full(len(AMINO_ACIDS), negative_pKs["Cterm"])
+        for aa, pk in pKcterminal.items():
+            self._cterm_pks[AMINO_ACIDS.index(aa)] = pk
+
+    def encode(self, sequences):
+        """
+        Packs sequences into (codes, offsets): one int16 residue-code array
+        and the start offset of each sequence (len(sequences) + 1 entries).
+        """
+        lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+        offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # 'replace' keeps one byte per character, so offsets stay valid
+        buf = np.frombuffer("".join(sequences).encode("ascii", errors="replace"), dtype=np.uint8)
+        return self.lut[buf], offsets
+
+    def properties(self, codes, offsets):
+        """
+        Computes per-sequence properties for an encoded batch. Returns a dict
+        of arrays: length, valid (non-empty, canonical residues only), gravy,
+        net_charge (at charge_ph) and pi. Invalid sequences get NaN.
+        """
+        n = len(offsets) - 1
+        starts, lengths = offsets[:-1], np.diff(offsets)
+        valid = self.valid_mask(codes, offsets)
+        idx = np.flatnonzero(valid)
+
+        props = {"length": lengths, "valid": valid}
+        for name in ("gravy", "net_charge", "pi"):
+            props[name] = np.full(n, np.nan)
+        props["gravy"][idx] = self.gravy(codes, starts[idx], lengths[idx])
+        props["net_charge"][idx] = self.net_charge(codes, starts[idx], lengths[idx])
+        props["pi"][idx] = self.isoelectric_point(codes, starts[idx], lengths[idx])
+        return props
+
+    # The per-property methods below take (starts, lengths) of any subset of
+    # valid sequences, so a filter can compute each property only for the
+    # sequences that survived the checks before it.
+
+    def valid_mask(self, codes, offsets):
+        """Non-empty sequences made only of canonical residues."""
+        lengths = np.diff(offsets)
+        invalid = np.append(np.zeros(len(AMINO_ACIDS), dtype=np.int32), 1)
+        return (lengths > 0) & (self._ordered_sums(invalid, codes, offsets[:-1], lengths) == 0)
+
+    def gravy(self, codes, starts, lengths):
+        return self._ordered_sums(self.kd, codes, starts, lengths) / lengths
+
+    def net_charge(self, codes, starts, lengths):
+        profiles, inverse = self._charge_profiles(codes, starts, lengths)
+        ph = np.full(len(profiles[0]), float(self.charge_ph))
+        return self._charge_at_ph(ph, *profiles)[inverse]
+
+    def isoelectric_point(self, codes, starts, lengths):
+        profiles, inverse = self._charge_profiles(codes, starts, lengths)
+        return self._isoelectric_point(*profiles)[inverse]
+
+    def _charge_profiles(self, codes, starts, lengths):
+        """
+        Many sequences share a charge profile (charged-residue counts plus
+        both termini), so charge and pI are solved once per unique profile.
+        Returns ((pos_counts, neg_counts, nterm_scale, cterm_scale), inverse).
+        """
+        charged_idx = self._pos_idx + self._neg_idx
+        first = codes[starts].astype(np.int64)
+        last = codes[starts + lengths - 1].astype(np.int64)
+        if len(lengths) and lengths.max() < 64:
+            # Pack the 7 charged-residue counts (6 bits each) and both termini into one int64 key
+            weights = np.zeros(len(AMINO_ACIDS), dtype=np.int64)
+            for j, idx in enumerate(charged_idx):
+                weights[idx] = 1 << (6 * j)
+            key = self._ordered_sums(weights, codes, starts, lengths) | (first << 42) | (last << 47)
+            unique_keys, inverse = np.unique(key, return_inverse=True)
+            charged_counts = (unique_keys[:, None] >> (6 * np.arange(7))) & 63
+            unique_first, unique_last = (unique_keys >> 42) & 31, (unique_keys >> 47) & 31
+        else:
+            columns = []
+            for idx in charged_idx:
+                one_hot = np.zeros(len(AMINO_ACIDS), dtype=np.int64)
+                one_hot[idx] = 1
+                columns.append(self._ordered_sums(one_hot, codes, starts, lengths))
+            stacked = np.column_stack(columns + [first, last]).reshape(len(lengths), 9)
+            unique, inverse = np.unique(stacked, axis=0, return_inverse=True)
+            charged_counts, unique_first, unique_last = unique[:, :7], unique[:, 7], unique[:, 8]
+
+        profiles = (
+            charged_counts[:, :3].astype(np.float64),
+            charged_counts[:, 3:].astype(np.float64),
+            10.0 ** -self._nterm_pks[unique_first],
+            10.0 ** self._cterm_pks[unique_last],
+        )
+        return profiles, inverse.reshape(-1)
+
+    def _ordered_sums(self, table, codes, starts, lengths):
+        """
+        Per-sequence sums of table[residue], added left to right exactly like
+        Biopython's sum() so values on a threshold compare identically.
+        Walks residue positions over length-sorted sequences, so each step
+        adds one contiguous slice. Code -1 (non-canonical) indexes the
+        table's last entry, so tables for valid-only input can be length 20.
+        """
+        order = np.argsort(-lengths, kind="stable")
+        sorted_starts = starts[order]
+        sorted_lengths = lengths[order]
+        sums = np.zeros(len(lengths), dtype=table.dtype)
+        for j in range(int(sorted_lengths[0]) if len(lengths) else 0):
+            n_active = np.searchsorted(-sorted_lengths, -j, side="left")
+            sums[:n_active] += table[codes[sorted_starts[:n_active] + j]]
+        out = np.empty_like(sums)
+        out[order] = sums
+        return out
+
+    def compute(self, sequences):
+        codes, offsets = self.encode(sequences)
+        return self.properties(codes, offsets)
+
+    def _charge_at_ph(self, ph, pos_counts, neg_counts, nterm_scale, cterm_scale):
+        # Same terms and summation order as IsoelectricPoint.charge_at_pH, with
+        # 10**(pH - pK) factored as 10**pH * 10**-pK so each call needs one
+        # power per row; nterm_scale = 10**-pK(N-term), cterm_scale = 10**pK(C-term)
+        x = 10.0 ** ph
+        inv_x = 1.0 / x
+        positive = 1.0 / (x * nterm_scale + 1.0)
+        for j, scale in enumerate(self._pos_scales):
+            positive += pos_counts[:, j] / (x * scale + 1.0)
+        negative = 1.0 / (cterm_scale * inv_x + 1.0)
+        for j, scale in enumerate(self._neg_scales):
+            negative += neg_counts[:, j] / (inv_x * scale + 1.0)
+        return positive - negative
+
+    def _isoelectric_point(self, pos_counts, neg_counts, nterm_scale, cterm_scale):
+        # Vectorized IsoelectricPoint.pi(): bisection from pH 7.775 on [4.05, 12]
+        # until the bracket is <= 1e-4 (the same number of steps for every row)
+        m = len(pos_counts)
+        ph = np.full(m, 7.775)
+        lo = np.full(m, 4.05)
+        hi = np.full(m, 12.0)
+        while (hi - lo).max(initial=0.0) > 0.0001:
+            positive = self._charge_at_ph(ph, pos_counts, neg_counts, nterm_scale, cterm_scale) > 0.0
+            np.copyto(lo, ph, where=positive)
+            np.copyto(hi, ph, where=~positive)
+            ph = (lo + hi) / 2
+        return ph
+
+def check_parity(sequences, engine=None):
+    """
+    Compares the engine against Biopython's ProteinAnalysis on `sequences`
+    (canonical ones only). Returns the max absolute difference per property.
+    """
+    from Bio.SeqUtils.ProtParam import ProteinAnalysis
+    engine = engine or PropertyEngine()
+    props = engine.compute(sequences)
+    deltas = {"gravy": 0.0, "net_charge": 0.0, "pi": 0.0}
+    for k, seq in enumerate(sequences):
+        if not props["valid"][k]:
+            continue
+        analysis = ProteinAnalysis(seq)
+        deltas["gravy"] = max(deltas["gravy"], abs(props["gravy"][k] - analysis.gravy()))
+        deltas["net_charge"] = max(deltas["net_charge"], abs(props["net_charge"][k] - analysis.charge_at_pH(engine.charge_ph)))
+        deltas["pi"] = max(deltas["pi"], abs(props["pi"][k] - analysis.isoelectric_point()))
+    return deltas
+
+class PropertyCache:
+    """
+    Sequence -> property value memo that several TMEFilters can share (e.g.
+    every target of a batch run), so overlapping candidate pools have their
+    properties computed once. Values depend only on the sequence; callers
+    put anything else that matters (the pH of a net charge) in the property
+    name. At most `max_entries` values are kept per property; past that,
+    new values are computed but not stored.
+    """
+
+    def __init__(self, max_entries=2_000_000):
+        self.max_entries = int(max_entries)
+        self._values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, name, sequences, compute):
+        """
+        Float array of `name` for sequences; compute(missing) is called with
+        the positions of uncached sequences and returns their values.
+        """
+        table = self._values.setdefault(name, {})
+        get = table.get
+        values = np.fromiter((get(seq, np.nan) for seq in sequences), dtype=np.float64, count=len(sequences))
+        missing = np.flatnonzero(np.isnan(values))
+        if len(missing):
+            fresh = np.asarray(compute(missing), dtype=np.float64)
+            values[missing] = fresh
+            if len(table) < self.max_entries:
+                table.update(zip([sequences[k] for k in missing.tolist()], fresh.tolist()))
+        self.hits += len(sequences) - len(missing)
+        self.misses += len(missing)
+        return values
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": {k: len(v) for k, v in self._values.items()}}
@@ -1,23 +1,67 @@
 import torch
 from transformers import BertForMaskedLM, BertTokenizer
 import logging
+import math
+import time
+import heapq
+import random
 import numpy as np
+from src.utils import spearman_rho, kendall_tau, top_n_overlap
+from src.property_engine import AMINO_ACIDS, is_canonical
 
 logger = logging.getLogger(__name__)
 
+SCORING_MODES = ("exact", "kmask", "unmasked")
+PRECISIONS = ("fp32", "bf16", "int8")
+# Score of empty / non-canonical sequences, which the model can't score
+INVALID_SCORE = -999.0
+
 class TCRRanker:
-    def __init__(self, model_path="wukevin/tcr-bert"):
+    def __init__(self, model_path="wukevin/tcr-bert", max_batch_size=128, revision=None, cache=None,
+                 scoring_mode="exact", mask_k=4, precision="fp32"):
         self.model_path = model_path
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision '{precision}'. Expected one of {PRECISIONS}.")
+        # fp32 = reference; bf16 = CPU autocast; int8 = dynamic-quantized Linear layers
+        self.precision = precision
+        if scoring_mode not in SCORING_MODES:
+            raise ValueError(f"Unknown scoring mode '{scoring_mode}'. Expected one of {SCORING_MODES}.")
+        # exact = full PLL; kmask / unmasked are cheaper approximations for triage
+        self.scoring_mode = scoring_mode
+        self.mask_k = max(1, int(mask_k))
+        self.revision = revision
+        # Optional ScoreCache; scores are keyed by cache_namespace() + sequence
+        self.cache = cache
+        # Max number of masked variants (rows) sent through the model in one forward pass
+        self.max_batch_size = max(1, int(max_batch_size))
         self.tokenizer = None
+        # Residue byte -> vocab id for encode_batch; None falls back to the tokenizer
+        self.token_table = None
         self.model = None
+        # Work done by forward passes, for run metrics (see forward_stats)
+        self.forward_passes = 0
+        self.forward_rows = 0
+        self.forward_tokens = 0
+        self.padded_tokens = 0
+        self.forward_seconds = 0.0
+        # Optional {sequence: embedding} filled from unmasked scoring rows; see embed()
+        self.embedding_store = None
         self._load_model()
 
     def _load_model(self):
         try:
             logger.info(f"Loading TCR-BERT model from {self.model_path}...")
-            self.tokenizer = BertTokenizer.from_pretrained(self.model_path)
-            self.model = BertForMaskedLM.from_pretrained(self.model_path)
+            kwargs = {"revision": self.revision} if self.revision else {}
+            self.tokenizer = BertTokenizer.from_pretrained(self.model_path, **kwargs)
+            self.token_table = self._build_token_table()
+            self.model = BertForMaskedLM.from_pretrained(self.model_path, **kwargs)
             self.model.eval()
+            if self.precision == "int8":
+                # Weights stored as int8, activations quantized on the fly: ~4x smaller Linear layers
+                self.model = torch.ao.quantization.quantize_dynamic(
+                    self.model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+            logger.info(f"TCR-BERT inference precision: {self.precision}")
         except Exception as e:
             logger.error(f"Failed to load TCR-BERT model: {e}. Ranking will be mocked.")
             self.model = None
@@ -30,22 +74,626 @@ class TCRRanker:
         if not self.model:
             return self._mock_score(sequences)
 
-        scored_seqs = []
-        for seq in sequences:
-            pll = self._calculate_pll(seq)
-            scored_seqs.append((seq, pll))
+        scores = self._score_unique(sequences)
+        scored_seqs = [(seq, scores[seq]) for seq in sequences]
         
         # Sort by PLL descending (higher is better)
         scored_seqs.sort(key=lambda x: x[1], reverse=True)
         return scored_seqs
 
+    def cache_namespace(self, scoring_mode=None):
+        """
+        Identifies everything that determines a score, so cached values are
+        never reused across models, revisions or scoring modes.
+        """
+        scoring_mode = scoring_mode or self.scoring_mode
+        mode = {"exact": "pll", "kmask": f"kmask{self.mask_k}"}.get(scoring_mode, scoring_mode)
+        if self.precision != "fp32":
+            mode = f"{mode}-{self.precision}"
+        return f"{mode}|{self.model_path}@{self.revision or 'main'}"
+
+    def _score_unique(self, sequences, mode=None):
+        """
+        Returns {sequence: PLL}, scoring each distinct sequence once and only
+        running the model for sequences missing from the cache.
+        """
+        unique = list(dict.fromkeys(sequences))
+        invalid = self._invalid(unique)
+        unique = [seq for seq in unique if seq not in invalid]
+        namespace = self.cache_namespace(mode)
+        scores = self.cache.get_many(namespace, unique) if self.cache else {}
+        scores.update(dict.fromkeys(invalid, INVALID_SCORE))
+
+        todo = [seq for seq in unique if seq not in scores]
+        if todo:
+            fresh = dict(zip(todo, self._calculate_pll_batched(todo, mode)))
+            scores.update(fresh)
+            if self.cache:
+                self.cache.put_many(namespace, fresh)
+        return scores
+
+    def _invalid(self, sequences):
+        """
+        Sequences PropertyEngine would reject (empty or non-canonical); they
+        are scored INVALID_SCORE rather than failing the whole batch.
+        """
+        invalid = {seq for seq in sequences if not is_canonical(seq)}
+        if invalid:
+            logger.warning(f"Scoring {len(invalid)} empty or non-canonical sequence(s) as invalid "
+                           f"({INVALID_SCORE}), e.g. '{next(iter(invalid))}'.")
+        return invalid
+
+    def _encode(self, sequence):
+        if self.token_table is not None:
+            return self._encode_many([sequence])[0]
+        return self._hf_encode(sequence)
+
+    def _hf_encode(self, sequence):
+        # TCR-BERT expects spaced amino acids: "C A S ..."
+        spaced_seq = " ".join(list(sequence.upper()))
+        return self.tokenizer(spaced_seq, return_tensors="pt")["input_ids"][0]
+
+    def _encode_many(self, sequences):
+        """Token ids (CLS ... SEP, unpadded) for each sequence, as 1-D tensors."""
+        if self.token_table is None:
+            return [self._hf_encode(seq) for seq in sequences]
+        input_ids, lengths = self.encode_batch(sequences)
+        input_ids = torch.from_numpy(input_ids)
+        return [input_ids[k, :n] for k, n in enumerate(lengths.tolist())]
+
+    def _build_token_table(self):
+        """
+        Lookup table from residue byte to vocab id, used by encode_batch.
+        Canonical residues of either case get an id (as in PropertyEngine's
+        table); everything else maps to -1 and is rejected. The table is
+        checked against the tokenizer on a sample before use; returns None
+        (tokenizer path) if they disagree.
+        """
+        ids = self.tokenizer.convert_tokens_to_ids(list(AMINO_ACIDS))
+        if self.tokenizer.unk_token_id in ids or None in ids:
+            logger.warning("Tokenizer vocabulary lacks some amino acids; using the slow tokenizer path.")
+            return None
+        table = np.full(256, -1, dtype=np.int64)
+        table[np.frombuffer(AMINO_ACIDS.encode(), dtype=np.uint8)] = ids
+        table[np.frombuffer(AMINO_ACIDS.lower().encode(), dtype=np.uint8)] = ids
+        self.token_table = table
+
+        rng = random.Random(0)
+        sample = ["", AMINO_ACIDS, AMINO_ACIDS[::-1]] + [
+            "".join(rng.choices(AMINO_ACIDS, k=rng.randint(1, 40))) for _ in range(200)
+        ]
+        report = self.check_tokenizer(sample)
+        if report["mismatches"]:
+            logger.warning(
+                f"Fast tokenizer disagrees with {self.model_path}'s tokenizer on {report['mismatches']} "
+                f"of {report['checked']} sequences (e.g. {report['examples'][0]}); using the slow tokenizer path."
+            )
+            return None
+        return table
+
+    def encode_batch(self, sequences):
+        """
+        Tokenizes a batch in one vectorized pass: residues are mapped through
+        the lookup table and scattered into a PAD-filled [N, max_len + 2]
+        int64 array with CLS/SEP around each sequence. Returns (input_ids,
+        token_lengths). Ids match the Hugging Face tokenizer exactly (see
+        check_tokenizer). Raises ValueError on non-canonical residues;
+        scoring screens those out first (see _invalid).
+        """
+        if self.token_table is None:
+            raise RuntimeError("Fast tokenizer unavailable for this vocabulary; use _encode_many.")
+        sequences = list(sequences)
+        lengths = np.fromiter((len(seq) for seq in sequences), dtype=np.int64, count=len(sequences))
+        # One byte per character; anything outside ASCII becomes '?' and is rejected below
+        residues = np.frombuffer("".join(sequences).encode("ascii", "replace"), dtype=np.uint8)
+        ids = self.token_table[residues]
+
+        bad = np.flatnonzero(ids < 0)
+        if bad.size:
+            k = int(np.searchsorted(np.cumsum(lengths), bad[0], side="right"))
+            found = sorted(set(sequences[k].upper()) - set(AMINO_ACIDS))
+            raise ValueError(
+                f"Sequence {k} ('{sequences[k]}') contains non-canonical residue(s) {found}; "
+                f"only the 20 amino acids {AMINO_ACIDS} (either case) can be scored."
+            )
+
+        input_ids = np.full((len(sequences), int(lengths.max(initial=0)) + 2), self.tokenizer.pad_token_id, dtype=np.int64)
+        input_ids[:, 0] = self.tokenizer.cls_token_id
+        rows = np.repeat(np.arange(len(sequences)), lengths)
+        starts = np.cumsum(lengths) - lengths
+        cols = np.arange(residues.size) - np.repeat(starts, lengths) + 1  # after CLS
+        input_ids[rows, cols] = ids
+        input_ids[np.arange(len(sequences)), lengths + 1] = self.tokenizer.sep_token_id
+        return input_ids, lengths + 2
+
+    def check_tokenizer(self, sequences):
+        """
+        Compares encode_batch with the Hugging Face tokenizer on `sequences`
+        (non-canonical ones are skipped). Returns checked/mismatch counts,
+        the first few mismatching sequences and both timings.
+        """
+        sequences = [seq for seq in sequences if set(seq) <= set(AMINO_ACIDS)]
+        start = time.perf_counter()
+        fast = self._encode_many(sequences) if self.token_table is not None else []
+        fast_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        slow = [self._hf_encode(seq) for seq in sequences]
+        hf_seconds = time.perf_counter() - start
+
+        if self.token_table is None:
+            examples = list(sequences)
+        else:
+            examples = [seq for seq, a, b in zip(sequences, fast, slow) if not torch.equal(a, b)]
+        return {
+            "checked": len(sequences),
+            "mismatches": len(examples),
+            "examples": examples[:5],
+            "fast_seconds": fast_seconds,
+            "hf_seconds": hf_seconds,
+            "speedup": hf_seconds / fast_seconds if fast_seconds > 0 else 0.0,
+        }
+
+    def _mask_rows(self, n_residues, mode=None):
+        """
+        Lists the forward-pass rows needed to score one sequence in `mode`.
+        Each row is (masked_positions, scored_positions), positions counted
+        from 1 (after CLS):
+          exact    - L rows, each masking and scoring one residue (true PLL)
+          kmask    - ~L/k rows, each masking k residues spaced L/k apart
+          unmasked - 1 row, nothing masked, every residue scored
+        """
+        mode = mode or self.scoring_mode
+        positions = list(range(1, n_residues + 1))
+        if not positions:
+            return []
+        if mode == "exact":
+            return [([p], [p]) for p in positions]
+        if mode == "kmask":
+            stride = math.ceil(n_residues / self.mask_k)
+            groups = [positions[offset::stride] for offset in range(stride)]
+            return [(group, group) for group in groups]
+        if mode == "unmasked":
+            return [([], positions)]
+        raise ValueError(f"Unknown scoring mode '{mode}'. Expected one of {SCORING_MODES}.")
+
+    def _plan_batches(self, token_lengths, mode=None):
+        """
+        Packs forward-pass rows into batches of at most `max_batch_size` rows.
+        Sequences are grouped by tokenized length so each batch carries little
+        padding; a sequence needing more rows than one batch is split across
+        several. Returns a list of batches, each a list of (seq_index, rows).
+        """
+        order = sorted(range(len(token_lengths)), key=lambda k: token_lengths[k])
+        return self._pack_rows([(k, self._mask_rows(token_lengths[k] - 2, mode)) for k in order]) # Skip CLS/SEP
+
+    def _pack_rows(self, seq_rows):
+        """
+        Packs [(seq_index, rows)], already in length order, into batches of
+        at most `max_batch_size` rows.
+        """
+        plan = []
+        batch, batch_rows = [], 0
+        for k, rows in seq_rows:
+            for start in range(0, len(rows), self.max_batch_size):
+                chunk = rows[start:start + self.max_batch_size]
+                if batch_rows + len(chunk) > self.max_batch_size:
+                    plan.append(batch)
+                    batch, batch_rows = [], 0
+                batch.append((k, chunk))
+                batch_rows += len(chunk)
+
+        if batch:
+            plan.append(batch)
+        return plan
+
+    def _calculate_pll_batched(self, sequences, mode=None):
+        """
+        Calculates Pseudo-Log-Likelihood for many sequences at once, running a
+        few large padded forward passes instead of one pass per position per
+        sequence. `mode` selects exact or approximate scoring (see _mask_rows).
+        Returns scores in the same order as `sequences`.
+        """
+        encoded = self._encode_many(sequences)
+        plan = self._plan_batches([ids.size(0) for ids in encoded], mode)
+
+        # Accumulate in plan order so the result doesn't depend on who ran each batch
+        totals = [0.0] * len(sequences)
+        for batch, row_plls in zip(plan, self._execute_plan(plan, sequences, encoded)):
+            owners = [k for k, rows in batch for _ in rows]
+            for k, row_pll in zip(owners, row_plls):
+                totals[k] += row_pll
+
+        return [
+            totals[k] / len(seq) if len(seq) > 0 else INVALID_SCORE
+            for k, seq in enumerate(sequences)
+        ]
+
+    def _execute_plan(self, plan, sequences, encoded):
+        """Runs a batch plan via _run_batches and counts the work it did."""
+        start = time.perf_counter()
+        results = self._run_batches(plan, sequences, encoded)
+        self.forward_seconds += time.perf_counter() - start
+        self.forward_passes += len(plan)
+        for batch in plan:
+            self.forward_rows += sum(len(rows) for _, rows in batch)
+            self.forward_tokens += sum(len(rows) * encoded[k].size(0) for k, rows in batch)
+            self.padded_tokens += sum(len(rows) for _, rows in batch) * max(encoded[k].size(0) for k, _ in batch)
+        return results
+
+    def forward_stats(self):
+        """
+        Forward-pass counters since the ranker was created. tokens counts real
+        (unpadded) tokens; padding_overhead is the share of padded positions.
+        """
+        return {
+            "forward_passes": self.forward_passes,
+            "forward_rows": self.forward_rows,
+            "tokens": self.forward_tokens,
+            "padding_overhead": 1 - self.forward_tokens / self.padded_tokens if self.padded_tokens else 0.0,
+            "seconds": self.forward_seconds,
+            "tokens_per_sec": self.forward_tokens / self.forward_seconds if self.forward_seconds > 0 else 0.0,
+        }
+
+    def _run_batches(self, plan, sequences, encoded):
+        """
+        Executes a batch plan in-process. Returns one list of per-row
+        log-probabilities per batch.
+        """
+        return [self._run_masked_batch(batch, encoded, sequences) for batch in plan]
+
+    def _run_masked_batch(self, batch, encoded, sequences=None):
+        """
+        Runs one padded forward pass over a group of rows and returns, per
+        row, the summed log-probability of the original tokens at its scored
+        positions. Given the sequences, unmasked rows also leave their
+        embedding in embedding_store (when set), so embed() can skip them.
+        """
+        n_rows = sum(len(rows) for _, rows in batch)
+        width = max(encoded[k].size(0) for k, _ in batch)
+
+        input_ids = torch.full((n_rows, width), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((n_rows, width), dtype=torch.long)
+        row_index, positions, targets = [], [], []
+        unmasked = []
+
+        row = 0
+        for k, rows in batch:
+            ids = encoded[k]
+            input_ids[row:row + len(rows), :ids.size(0)] = ids
+            attention_mask[row:row + len(rows), :ids.size(0)] = 1
+            for masked, scored in rows:
+                if not masked:
+                    unmasked.append((row, k))
+                input_ids[row, masked] = self.tokenizer.mask_token_id
+                row_index.extend([row] * len(scored))
+                positions.extend(scored)
+                targets.extend(ids[scored].tolist())
+                row += 1
+
+        capture = self.embedding_store is not None and sequences is not None and bool(unmasked)
+        with torch.no_grad(), torch.autocast("cpu", dtype=torch.bfloat16, enabled=self.precision == "bf16"):
+            outputs = self.model(input_ids=input_ids, attention_mask=attention_mask, output_hidden_states=capture)
+        logits = outputs.logits
+        if capture:
+            hidden = outputs.hidden_states[-1]
+            for row, k in unmasked:
+                # Residue positions only, as in embed()
+                self.embedding_store[sequences[k]] = hidden[row, 1:encoded[k].size(0) - 1].float().mean(0).numpy()
+
+        # Log prob of the original token at each scored position, summed per row
+        # (softmax in fp32 even under bf16 autocast)
+        row_index = torch.tensor(row_index)
+        masked_logits = logits[row_index, torch.tensor(positions)].float()
+        log_probs = torch.nn.functional.log_softmax(masked_logits, dim=-1)
+        token_plls = log_probs[torch.arange(len(targets)), torch.tensor(targets)]
+        row_plls = torch.zeros(n_rows, dtype=token_plls.dtype).index_add_(0, row_index, token_plls)
+        return row_plls.tolist()
+
+    def calibrate_modes(self, sequences, modes=("kmask", "unmasked"), top_n=10):
+        """
+        Measures how well each approximate scoring mode reproduces exact PLL
+        on `sequences`: Spearman/Kendall rank correlation, top-N overlap and
+        speedup. Bypasses the score cache so timings reflect real model work.
+        """
+        sequences = list(dict.fromkeys(sequences))
+        token_lengths = [ids.size(0) for ids in self._encode_many(sequences)]
+
+        def timed(mode):
+            start = time.perf_counter()
+            scores = self._calculate_pll_batched(sequences, mode)
+            elapsed = time.perf_counter() - start
+            rows = sum(len(rows) for batch in self._plan_batches(token_lengths, mode) for _, rows in batch)
+            return scores, elapsed, rows
+
+        exact, exact_time, exact_rows = timed("exact")
+        exact_ranked = [seq for seq, _ in sorted(zip(sequences, exact), key=lambda x: x[1], reverse=True)]
+
+        report = {
+            "n_sequences": len(sequences),
+            "top_n": top_n,
+            "exact": {"seconds": exact_time, "forward_rows": exact_rows},
+            "modes": {},
+        }
+        for mode in modes:
+            scores, elapsed, rows = timed(mode)
+            ranked = [seq for seq, _ in sorted(zip(sequences, scores), key=lambda x: x[1], reverse=True)]
+            report["modes"][mode] = {
+                "spearman": spearman_rho(exact, scores),
+                "kendall": kendall_tau(exact, scores),
+                "top_n_overlap": top_n_overlap(exact_ranked, ranked, top_n),
+                "seconds": elapsed,
+                "forward_rows": rows,
+                "speedup": exact_time / elapsed if elapsed > 0 else float("inf"),
+            }
+        return report
+
+    def compare_precision(self, sequences, top_n=10):
+        """
+        Parity check of this ranker's precision against an fp32 replica of the
+        same model on a reference set: score deltas, rank correlation, top-N
+        overlap and whether the ranked order is unchanged.
+        """
+        sequences = list(dict.fromkeys(sequences))
+        reference = TCRRanker(
+            self.model_path, max_batch_size=self.max_batch_size, revision=self.revision,
+            scoring_mode=self.scoring_mode, mask_k=self.mask_k, precision="fp32"
+        )
+
+        start = time.perf_counter()
+        ref_scores = reference._calculate_pll_batched(sequences)
+        ref_time = time.perf_counter() - start
+        start = time.perf_counter()
+        scores = self._calculate_pll_batched(sequences)
+        elapsed = time.perf_counter() - start
+
+        deltas = np.abs(np.array(scores) - np.array(ref_scores))
+        ref_ranked = [seq for seq, _ in sorted(zip(sequences, ref_scores), key=lambda x: x[1], reverse=True)]
+        ranked = [seq for seq, _ in sorted(zip(sequences, scores), key=lambda x: x[1], reverse=True)]
+        return {
+            "precision": self.precision,
+            "n_sequences": len(sequences),
+            "max_abs_delta": float(deltas.max()) if len(deltas) else 0.0,
+            "mean_abs_delta": float(deltas.mean()) if len(deltas) else 0.0,
+            "spearman": spearman_rho(ref_scores, scores),
+            "kendall": kendall_tau(ref_scores, scores),
+            "top_n": top_n,
+            "top_n_overlap": top_n_overlap(ref_ranked, ranked, top_n),
+            "same_order": ranked == ref_ranked,
+            "speedup": ref_time / elapsed if elapsed > 0 else float("inf"),
+        }
+
+    def select_top_k(self, sequences, top_k=5, eta=2, initial_positions=2, finalists=None,
+                     budget_rows=None, seed=0):
+        """
+        Budgeted top-K selection by successive halving. Every candidate is
+        first scored on `initial_positions` randomly chosen masked positions
+        (its PLL estimate is the mean over positions scored so far); the best
+        1/eta are kept and refined with eta times as many positions, reusing
+        the ones already scored, until `finalists` (default 2 x top_k) remain.
+        Finalists are then scored at every position, so the returned
+        [(seq, PLL)] top-K list carries exact PLLs. Survivors are picked with
+        heaps rather than full sorts. `budget_rows` (forward rows) sets
+        initial_positions from the expected total cost instead.
+        Returns (top_k_list, report).
+        """
+        unique = list(dict.fromkeys(sequences))
+        if not self.model:
+            return self._mock_score(unique)[:top_k], {"mocked": True}
+
+        start_time = time.perf_counter()
+        finalists = max(top_k, int(finalists or 2 * top_k))
+        namespace = self.cache_namespace("exact")
+        exact = self.cache.get_many(namespace, unique) if self.cache else {}
+
+        invalid = self._invalid(unique)
+        todo = [seq for seq in unique if seq not in exact and seq not in invalid]
+        encoded = self._encode_many(todo)
+        n_residues = [ids.size(0) - 2 for ids in encoded] # Skip CLS/SEP
+        exhaustive_rows = sum(n_residues)
+
+        rounds_needed = max(1, math.ceil(math.log(max(len(todo), 1) / finalists, eta))) if len(todo) > finalists else 0
+        if budget_rows is not None and rounds_needed:
+            # Each halving round costs ~ len(todo) * initial_positions rows; finalists cost their full length
+            mean_length = exhaustive_rows / len(todo)
+            spare = budget_rows - finalists * mean_length
+            initial_positions = max(1, int(spare // (rounds_needed * len(todo))))
+            if spare < rounds_needed * len(todo):
+                logger.warning(f"Top-K budget of {budget_rows} rows is below the minimum; using 1 position per candidate.")
+
+        # Each candidate scores its residues in a fixed random order, so refining only adds positions
+        rng = random.Random(seed)
+        position_order = []
+        for n in n_residues:
+            positions = list(range(1, n + 1))
+            rng.shuffle(positions)
+            position_order.append(positions)
+        totals = [0.0] * len(todo)
+        scored = [0] * len(todo)
+
+        alive = [k for k in range(len(todo)) if n_residues[k] > 0]
+        target = initial_positions
+        rounds = []
+        rows_used = 0
+        while alive:
+            if len(alive) <= finalists:
+                target = max(n_residues[k] for k in alive)
+            pending = [
+                (k, [([p], [p]) for p in position_order[k][scored[k]:min(target, n_residues[k])]])
+                for k in sorted(alive, key=lambda k: n_residues[k])
+            ]
+            pending = [(k, rows) for k, rows in pending if rows]
+            plan = self._pack_rows(pending)
+            for batch, row_plls in zip(plan, self._execute_plan(plan, todo, encoded)):
+                owners = [k for k, rows in batch for _ in rows]
+                for k, row_pll in zip(owners, row_plls):
+                    totals[k] += row_pll
+            round_rows = sum(len(rows) for _, rows in pending)
+            for k, rows in pending:
+                scored[k] += len(rows)
+            rows_used += round_rows
+            rounds.append({"candidates": len(alive), "positions": min(target, max(n_residues[k] for k in alive)),
+                           "forward_rows": round_rows})
+
+            if all(scored[k] == n_residues[k] for k in alive):
+                break
+            keep = max(finalists, math.ceil(len(alive) / eta))
+            alive = heapq.nlargest(keep, alive, key=lambda k: totals[k] / scored[k])
+            target *= eta
+
+        fresh = {todo[k]: totals[k] / n_residues[k] for k in alive if scored[k] == n_residues[k]}
+        if self.cache and fresh:
+            self.cache.put_many(namespace, fresh)
+        exact.update(fresh)
+        exact.update(dict.fromkeys(invalid, INVALID_SCORE))
+
+        top = heapq.nlargest(top_k, exact.items(), key=lambda x: x[1])
+        report = {
+            "n_candidates": len(unique),
+            "cached_exact": len(unique) - len(todo),
+            "top_k": top_k,
+            "eta": eta,
+            "initial_positions": initial_positions,
+            "finalists": finalists,
+            "rounds": rounds,
+            "forward_rows": rows_used,
+            "exhaustive_rows": exhaustive_rows,
+            "compute_saved": 1 - rows_used / exhaustive_rows if exhaustive_rows else 0.0,
+            "seconds": time.perf_counter() - start_time,
+        }
+        return top, report
+
+    def mutational_scan(self, sequence, rescore_top=0):
+        """
+        Scores all 19*L single-substitution mutants of `sequence` by masked
+        marginals: one forward pass row per position, masking it and reading
+        the whole amino-acid distribution there, so L rows instead of the
+        19*L*L an exact PLL of every mutant would take. A mutant's score is
+        log p(mutant residue) - log p(wild-type residue) at the masked site
+        (0 for wild type; higher = more favoured by the model). The top
+        `rescore_top` mutants are re-scored with exact PLL (cached like any
+        exact score). Returns {"sequence", "amino_acids", "matrix" (L x 20
+        array), "mutants" (ranked list of dicts), "wild_type_pll",
+        "forward_rows"}.
+        """
+        bad = sorted({aa for aa in sequence if aa not in AMINO_ACIDS})
+        if not sequence or bad:
+            raise ValueError(f"Mutational scan needs a non-empty canonical sequence (got non-canonical {bad}).")
+        log_probs = self._masked_marginals(sequence)
+        aa_index = {aa: i for i, aa in enumerate(AMINO_ACIDS)}
+        wild_type = torch.tensor([aa_index[aa] for aa in sequence])
+        matrix = log_probs - log_probs[torch.arange(len(sequence)), wild_type].unsqueeze(1)
+
+        mutants = []
+        for pos, wt in enumerate(sequence):
+            for j, aa in enumerate(AMINO_ACIDS):
+                if aa != wt:
+                    mutants.append({
+                        "mutant": f"{wt}{pos + 1}{aa}",
+                        "position": pos + 1,
+                        "wild_type": wt,
+                        "residue": aa,
+                        "sequence": sequence[:pos] + aa + sequence[pos + 1:],
+                        "masked_marginal": float(matrix[pos, j]),
+                    })
+        mutants.sort(key=lambda m: m["masked_marginal"], reverse=True)
+
+        wild_type_pll = None
+        if rescore_top:
+            top = mutants[:rescore_top]
+            plls = self._score_unique([sequence] + [m["sequence"] for m in top], mode="exact")
+            wild_type_pll = plls[sequence]
+            for m in top:
+                m["pll"] = plls[m["sequence"]]
+                m["delta_pll"] = m["pll"] - wild_type_pll
+        return {
+            "sequence": sequence,
+            "amino_acids": AMINO_ACIDS,
+            "matrix": matrix.numpy(),
+            "mutants": mutants,
+            "wild_type_pll": wild_type_pll,
+            "forward_rows": len(sequence),
+        }
+
+    def embed(self, sequences, batch_size=None):
+        """
+        Mean-pooled final-layer embeddings of the unmasked sequences: float32
+        [N, hidden_size], averaged over residue positions (CLS, SEP and
+        padding excluded). Sequences already in embedding_store (captured
+        from unmasked scoring passes) are not run again; the rest go through
+        length-sorted padded batches of `batch_size` (default
+        max_batch_size).
+        """
+        sequences = list(sequences)
+        embeddings = np.zeros((len(sequences), self.model.config.hidden_size), dtype=np.float32)
+        store = self.embedding_store or {}
+        todo = []
+        for k, seq in enumerate(sequences):
+            if seq in store:
+                embeddings[k] = store[seq]
+            else:
+                todo.append(k)
+        todo.sort(key=lambda k: len(sequences[k]))
+        batch_size = batch_size or self.max_batch_size
+
+        start = time.perf_counter()
+        for offset in range(0, len(todo), batch_size):
+            chunk = todo[offset:offset + batch_size]
+            encoded = self._encode_many([sequences[k] for k in chunk])
+            lengths = torch.tensor([ids.size(0) for ids in encoded])
+            width = int(lengths.max())
+            input_ids = torch.full((len(chunk), width), self.tokenizer.pad_token_id, dtype=torch.long)
+            for row, ids in enumerate(encoded):
+                input_ids[row, :ids.size(0)] = ids
+            positions = torch.arange(width)
+            attention_mask = (positions[None, :] < lengths[:, None]).long()
+            with torch.no_grad(), torch.autocast("cpu", dtype=torch.bfloat16, enabled=self.precision == "bf16"):
+                hidden = self.model(input_ids=input_ids, attention_mask=attention_mask,
+                                    output_hidden_states=True).hidden_states[-1].float()
+            residues = ((positions[None, :] >= 1) & (positions[None, :] < lengths[:, None] - 1)).float()
+            pooled = (hidden * residues[:, :, None]).sum(1) / (lengths[:, None] - 2).clamp(min=1)
+            embeddings[chunk] = pooled.numpy()
+            self.forward_passes += 1
+            self.forward_rows += len(chunk)
+            self.forward_tokens += int(lengths.sum())
+            self.padded_tokens += len(chunk) * width
+        self.forward_seconds += time.perf_counter() - start
+        return embeddings
+
+    def _masked_marginals(self, sequence):
+        """
+        L x 20 log-probabilities of each amino acid at each position, with
+        that position masked (softmax over the full vocabulary).
+        """
+        ids = self._encode(sequence)
+        aa_ids = torch.tensor(self.tokenizer.convert_tokens_to_ids(list(AMINO_ACIDS)))
+        positions = torch.arange(1, len(sequence) + 1)  # after CLS
+        start = time.perf_counter()
+        chunks = []
+        for offset in range(0, len(positions), self.max_batch_size):
+            pos = positions[offset:offset + self.max_batch_size]
+            rows = torch.arange(len(pos))
+            input_ids = ids.repeat(len(pos), 1)
+            input_ids[rows, pos] = self.tokenizer.mask_token_id
+            with torch.no_grad(), torch.autocast("cpu", dtype=torch.bfloat16, enabled=self.precision == "bf16"):
+                logits = self.model(input_ids=input_ids).logits
+            log_probs = torch.nn.functional.log_softmax(logits[rows, pos].float(), dim=-1)
+            chunks.append(log_probs[:, aa_ids])
+            self.forward_passes += 1
+        self.forward_rows += len(positions)
+        self.forward_tokens += len(positions) * ids.size(0)
+        self.padded_tokens += len(positions) * ids.size(0)
+        self.forward_seconds += time.perf_counter() - start
+        return torch.cat(chunks)
+
     def _calculate_pll(self, sequence):
         """
         Calculates Pseudo-Log-Likelihood for a single sequence.
+        Reference per-position implementation (one forward pass per residue);
+        `_calculate_pll_batched` must agree with it within float tolerance.
         """
         # Tokenize
         # TCR-BERT expects spaced amino acids: "C A S ..."
-        spaced_seq = " ".join(list(sequence))
+        spaced_seq = " ".join(list(sequence.upper()))
         inputs = self.tokenizer(spaced_seq, return_tensors="pt")
         input_ids = inputs["input_ids"]
         labels = input_ids.clone()
@@ -81,13 +729,36 @@ class TCRRanker:
                 input_ids[0, i] = orig_token_id
         
         # Average PLL
-        avg_pll = total_log_prob / length if length > 0 else -999.0
+        avg_pll = total_log_prob / length if length > 0 else INVALID_SCORE
         return avg_pll
 
     def _mock_score(self, sequences):
         logger.warning("Using mock ranking.")
         # Return random scores
-        import random
         scored = [(seq, -1.0 * random.random()) for seq in sequences]
         scored.sort(key=lambda x: x[1], reverse=True)
         return scored
+
+def build_ranker(model_path, ranker_params, cache=None):
+    """
+    TCRRanker from a config's ranker_parameters, or a ParallelRanker when
+    num_workers > 1.
+    """
+    ranker_kwargs = dict(
+        max_batch_size=ranker_params.get('max_batch_size', 128),
+        revision=ranker_params.get('model_revision'),
+        cache=cache,
+        scoring_mode=ranker_params.get('scoring_mode', 'exact'),
+        mask_k=ranker_params.get('mask_k', 4),
+        precision=ranker_params.get('precision', 'fp32')
+    )
+    num_workers = ranker_params.get('num_workers', 1)
+    if num_workers > 1:
+        from src.parallel_ranker import ParallelRanker
+        return ParallelRanker(
+            model_path,
+            num_workers=num_workers,
+            threads_per_worker=ranker_params.get('threads_per_worker'),
+            **ranker_kwargs
+        )
+    return TCRRanker(model_path, **ranker_kwargs)
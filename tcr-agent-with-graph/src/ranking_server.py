@@ -0,0 +1,369 @@
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import socket
+import logging
+import argparse
+import threading
+import http.client
+import socketserver
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADDRESS = "http://127.0.0.1:8765"
+
+def parse_address(address):
+    """'unix:///path/to.sock' -> ('unix', path); 'http://host:port' -> ('http', (host, port))."""
+    if address.startswith("unix://"):
+        return "unix", address[len("unix://"):]
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    if address.startswith("http://"):
+        host, _, port = address[len("http://"):].rstrip("/").partition(":")
+        return "http", (host or "127.0.0.1", int(port or 80))
+    raise ValueError(f"Unknown ranking server address '{address}'. Expected unix:///path or http://host:port.")
+
+class _Request:
+    __slots__ = ("sequences", "call", "arrived", "future")
+
+    def __init__(self, sequences=None, call=None):
+        self.sequences = sequences
+        self.call = call
+        self.arrived = time.monotonic()
+        self.future = Future()
+
+class BatchingScorer:
+    """
+    Owns the ranker and runs every model call on one thread. Scoring
+    requests that arrive within `max_latency` of the oldest waiting one are
+    merged (duplicates scored once) into a single score_sequences call of
+    up to `max_batch` sequences, so concurrent jobs share forward passes
+    instead of contending for the CPU. Other calls (top-K selection) run
+    alone, in arrival order.
+    """
+
+    def __init__(self, ranker, max_latency=0.02, max_batch=512):
+        self.ranker = ranker
+        self.max_latency = max_latency
+        self.max_batch = max(1, int(max_batch))
+        self._queue = queue.Queue()
+        self._held = None
+        self.stats = {"requests": 0, "batches": 0, "sequences": 0, "unique_sequences": 0, "busy_seconds": 0.0}
+        self._thread = threading.Thread(target=self._loop, name="ranker-batcher", daemon=True)
+        self._thread.start()
+
+    def score(self, sequences):
+        """Blocks until scored; returns [(seq, score)] sorted like TCRRanker.score_sequences."""
+        request = _Request(sequences=list(sequences))
+        self._queue.put(request)
+        return request.future.result()
+
+    def run(self, call):
+        """Runs call(ranker) on the model thread and returns its result."""
+        request = _Request(call=call)
+        self._queue.put(request)
+        return request.future.result()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next(self, timeout=None):
+        if self._held is not None:
+            item, self._held = self._held, None
+            return item
+        return self._queue.get(timeout=timeout)
+
+    def _loop(self):
+        while True:
+            first = self._next()
+            if first is None:
+                return
+            if first.call is not None:
+                self._execute([first], lambda: first.call(self.ranker))
+                continue
+
+            # Gather more scoring requests until the oldest one's deadline or the batch is full
+            batch = [first]
+            n = len(first.sequences)
+            while n < self.max_batch:
+                timeout = first.arrived + self.max_latency - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._next(timeout)
+                except queue.Empty:
+                    break
+                if item is None or item.call is not None:
+                    self._held = item  # handled after this batch
+                    break
+                batch.append(item)
+                n += len(item.sequences)
+
+            unique = list(dict.fromkeys(seq for request in batch for seq in request.sequences))
+            self.stats["batches"] += 1
+            self.stats["sequences"] += n
+            self.stats["unique_sequences"] += len(unique)
+            self._execute(batch, lambda: dict(self.ranker.score_sequences(unique)))
+
+    def _execute(self, batch, compute):
+        start = time.perf_counter()
+        error = None
+        try:
+            result = compute()
+        except Exception as e:
+            error = e
+        finally:
+            self.stats["busy_seconds"] += time.perf_counter() - start
+
+        if error is not None and len(batch) > 1:
+            # Merged scoring requests: retry each alone, so one bad request can't fail the jobs merged with it
+            logger.warning(f"Merged batch of {len(batch)} scoring requests failed ({error}); retrying them one by one.")
+            for request in batch:
+                self._execute([request], lambda: dict(self.ranker.score_sequences(list(dict.fromkeys(request.sequences)))))
+            return
+        self.stats["requests"] += len(batch)
+        if error is not None:
+            logger.error("Ranking server call failed", exc_info=error)
+            batch[0].future.set_exception(error)
+            return
+
+        for request in batch:
+            if request.call is not None:
+                request.future.set_result(result)
+                continue
+            ranked = [(seq, result[seq]) for seq in request.sequences]
+            ranked.sort(key=lambda x: x[1], reverse=True)
+            request.future.set_result(ranked)
+
+class _Handler(BaseHTTPRequestHandler):
+    # server.scorer and server.info are attached by serve()
+
+    def address_string(self):
+        # Unix socket peers have no (host, port)
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/info":
+            self._reply(200, self.server.info)
+        elif self.path == "/stats":
+            self._reply(200, self.server.scorer.stats)
+        else:
+            self._reply(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            sequences = request["sequences"]
+            # Rejected here, before it can be merged with other jobs' requests
+            if not isinstance(sequences, list) or not all(isinstance(seq, str) for seq in sequences):
+                raise TypeError("'sequences' must be a list of strings")
+            if self.path == "/score":
+                self._reply(200, {"ranked": self.server.scorer.score(sequences)})
+            elif self.path == "/select_top_k":
+                params = request.get("params", {})
+                top, report = self.server.scorer.run(lambda ranker: ranker.select_top_k(sequences, **params))
+                self._reply(200, {"top": top, "report": report})
+            else:
+                self._reply(404, {"error": f"unknown path {self.path}"})
+        except (KeyError, TypeError, ValueError) as e:
+            self._reply(400, {"error": f"bad request: {e}"})
+        except Exception as e:
+            self._reply(500, {"error": str(e)})
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(ranker, address=DEFAULT_ADDRESS, max_latency=0.02, max_batch=512, info=None):
+    """
+    Serves `ranker` at `address` (see parse_address) until interrupted.
+    Endpoints: GET /info, GET /stats, POST /score {"sequences": [...]},
+    POST /select_top_k {"sequences": [...], "params": {...}}.
+    """
+    kind, target = parse_address(address)
+    if kind == "unix":
+        if os.path.exists(target):
+            os.unlink(target)  # stale socket from a previous server
+        server = _UnixHTTPServer(target, _Handler)
+    else:
+        server = ThreadingHTTPServer(target, _Handler)
+        server.daemon_threads = True
+    server.scorer = BatchingScorer(ranker, max_latency=max_latency, max_batch=max_batch)
+    server.info = dict(info or {}, pid=os.getpid(), max_latency_ms=max_latency * 1000, max_batch=max_batch)
+    # Shut down cleanly (and remove the socket file) on SIGTERM as on Ctrl-C
+    signal.signal(signal.SIGTERM, _interrupt)
+    logger.info(f"Ranking server listening on {address} (batches up to {max_batch} sequences, {max_latency * 1000:.0f} ms deadline)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.scorer.close()
+        if kind == "unix" and os.path.exists(target):
+            os.unlink(target)
+        logger.info(f"Ranking server stopped ({server.scorer.stats['requests']} requests served).")
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+class RankingServerError(RuntimeError):
+    """The ranking server answered a request with an error status."""
+
+class RemoteRanker:
+    """
+    Client for a ranking server with TCRRanker's scoring interface
+    (score_sequences, select_top_k, scoring_mode, precision). No model is
+    held locally, so jobs using it never import torch. Raises OSError on
+    construction when no server is listening, RankingServerError when one
+    answers /info with an error. If a later scoring call fails that way,
+    `fallback()` (when given) supplies a ranker that takes over every call
+    from then on.
+    """
+
+    model = None
+
+    def __init__(self, address, timeout=600, fallback=None):
+        self.address = address
+        self.timeout = timeout
+        self.fallback = fallback
+        self._local = None
+        self._kind, self._target = parse_address(address)
+        self.requests = 0
+        self.sequences = 0
+        self.seconds = 0.0
+        self.info = self._request("GET", "/info", timeout=5)
+        self.model_path = self.info.get("model_path")
+        self.revision = self.info.get("revision")
+        self.scoring_mode = self.info.get("scoring_mode")
+        self.precision = self.info.get("precision")
+        self.mask_k = self.info.get("mask_k")
+
+    def _request(self, method, path, payload=None, timeout=None):
+        timeout = timeout or self.timeout
+        if self._kind == "unix":
+            conn = _UnixHTTPConnection(self._target, timeout=timeout)
+        else:
+            conn = http.client.HTTPConnection(*self._target, timeout=timeout)
+        try:
+            body = json.dumps(payload).encode() if payload is not None else None
+            conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            data = json.loads(response.read() or b"{}")
+        finally:
+            conn.close()
+        if response.status != 200:
+            raise RankingServerError(f"Ranking server {self.address}{path} returned {response.status}: {data.get('error')}")
+        return data
+
+    def _fall_back(self, error):
+        """The ranker replacing a server that failed mid-run; re-raises without a fallback."""
+        if self.fallback is None:
+            raise error
+        if self._local is None:
+            logger.warning(f"Ranking server {self.address} failed ({error}); scoring in-process from now on.")
+            self._local = self.fallback()
+        return self._local
+
+    def score_sequences(self, sequences):
+        if self._local is not None:
+            return self._local.score_sequences(sequences)
+        start = time.perf_counter()
+        try:
+            ranked = self._request("POST", "/score", {"sequences": list(sequences)})["ranked"]
+        except (OSError, RankingServerError) as e:
+            return self._fall_back(e).score_sequences(sequences)
+        self.requests += 1
+        self.sequences += len(sequences)
+        self.seconds += time.perf_counter() - start
+        return [tuple(item) for item in ranked]
+
+    def select_top_k(self, sequences, **params):
+        if self._local is not None:
+            return self._local.select_top_k(sequences, **params)
+        try:
+            result = self._request("POST", "/select_top_k", {"sequences": list(sequences), "params": params})
+        except (OSError, RankingServerError) as e:
+            return self._fall_back(e).select_top_k(sequences, **params)
+        return [tuple(item) for item in result["top"]], result["report"]
+
+    def forward_stats(self):
+        """
+        Client-side counters, plus the server's own when it still answers;
+        forward passes happen (and are counted) in the server.
+        """
+        stats = {
+            "forward_passes": 0,
+            "remote": self.address,
+            "requests": self.requests,
+            "sequences": self.sequences,
+            "seconds": self.seconds,
+        }
+        try:
+            stats["server"] = self._request("GET", "/stats", timeout=5)
+        except (OSError, RankingServerError) as e:
+            logger.warning(f"Ranking server {self.address} stats unavailable ({e}).")
+        return stats
+
+def main():
+    import yaml
+    from src.ranker import build_ranker
+    from src.score_cache import ScoreCache
+
+    parser = argparse.ArgumentParser(description="Resident TCR-BERT ranking server")
+    parser.add_argument("--config", default="configs/solid_tumor_job.yaml",
+                        help="Job config; its bert_model_path and ranker_parameters define the served model")
+    parser.add_argument("--address", default=None, help=f"unix:///path.sock or http://host:port (default: ranker_parameters.server or {DEFAULT_ADDRESS})")
+    parser.add_argument("--max-latency-ms", type=float, default=20.0,
+                        help="Longest a request waits for others to share its batch")
+    parser.add_argument("--max-batch", type=int, default=512, help="Sequences per merged batch")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='[RANKER-SERVER] %(message)s')
+
+    with open(args.config) as f:
+        config = yaml.safe_load(f)
+    ranker_params = config.get('ranker_parameters', {})
+    cache_cfg = ranker_params.get('score_cache')
+    model_path = config.get('bert_model_path', 'wukevin/tcr-bert')
+    ranker = build_ranker(model_path, ranker_params, cache=ScoreCache(**cache_cfg) if cache_cfg else None)
+    if ranker.model is None:
+        logger.error("TCR-BERT model failed to load; refusing to serve mock scores.")
+        sys.exit(1)
+    info = {
+        "model_path": model_path,
+        "revision": ranker.revision,
+        "scoring_mode": ranker.scoring_mode,
+        "precision": ranker.precision,
+        "mask_k": ranker.mask_k,
+    }
+    serve(ranker, args.address or ranker_params.get('server') or DEFAULT_ADDRESS,
+          max_latency=args.max_latency_ms / 1000, max_batch=args.max_batch, info=info)
+
+if __name__ == "__main__":
+    main()
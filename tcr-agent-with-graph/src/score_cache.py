@@ -0,0 +1,134 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class ScoreCache:
+    """
+    Disk-backed, content-addressed cache of ranker scores.
+    Keys are sha256(namespace + sequence), where the namespace identifies the
+    model (path/revision and anything else that changes the score). An
+    in-memory LRU sits in front of an SQLite table; the table is bounded to
+    `max_entries` rows and evicts least-recently-used rows when it overflows.
+    """
+
+    def __init__(self, path="results/cache/pll_scores.sqlite", max_entries=1_000_000, memory_entries=10_000):
+        self.path = path
+        self.max_entries = int(max_entries)
+        self.memory_entries = int(memory_entries)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            "key TEXT PRIMARY KEY, namespace TEXT, sequence TEXT, score REAL, last_used REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON scores(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(namespace, sequence):
+        return hashlib.sha256(f"{namespace}\0{sequence}".encode()).hexdigest()
+
+    def get_many(self, namespace, sequences):
+        """
+        Returns {sequence: score} for every sequence already cached under `namespace`.
+        """
+        found = {}
+        disk_lookup = {}
+        with self._lock:
+            for seq in sequences:
+                key = self.make_key(namespace, seq)
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[seq] = self._memory[key]
+                    self.hits += 1
+                else:
+                    disk_lookup[key] = seq
+
+            keys = list(disk_lookup)
+            now = time.time()
+            # SQLite caps bound parameters per statement, so look up in slices
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, score FROM scores WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, score in rows:
+                    found[disk_lookup[key]] = score
+                    self._remember(key, score)
+                self._conn.executemany(
+                    "UPDATE scores SET last_used = ? WHERE key = ?", [(now, key) for key, _ in rows]
+                )
+                self.disk_hits += len(rows)
+                self.hits += len(rows)
+                self.misses += len(chunk) - len(rows)
+            self._conn.commit()
+        return found
+
+    def put_many(self, namespace, scores):
+        """
+        Stores {sequence: score} under `namespace`, evicting old rows if the table is full.
+        """
+        if not scores:
+            return
+        now = time.time()
+        rows = []
+        with self._lock:
+            for seq, score in scores.items():
+                key = self.make_key(namespace, seq)
+                self._remember(key, score)
+                rows.append((key, namespace, seq, float(score), now))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO scores (key, namespace, sequence, score, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _remember(self, key, score):
+        self._memory[key] = score
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        # Trim to 90% of capacity so we don't evict on every insert once full
+        n_drop = count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM scores WHERE key IN (SELECT key FROM scores ORDER BY last_used ASC LIMIT ?)",
+            (n_drop,)
+        )
+        self.evictions += n_drop
+        logger.info(f"Score cache full: evicted {n_drop} least-recently-used entries.")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
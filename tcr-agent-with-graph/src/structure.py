@@ -1,16 +1,23 @@
 import os
+import csv
+import json
+import time
+import shlex
+import shutil
+import signal
 import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 logger = logging.getLogger(__name__)
 
-def prepare_docking_job(sequences, target_name):
+def prepare_docking_job(sequences, target_name, job_dir="results/docking_jobs"):
     """
     Prepares input for TCRDock for the top sequences.
     """
     logger.info(f"Preparing TCRDock job for {len(sequences)} sequences against {target_name}...")
     
     # Create a job directory
-    job_dir = "results/docking_jobs"
     os.makedirs(job_dir, exist_ok=True)
     
     job_file = os.path.join(job_dir, f"{target_name}_job.csv")
@@ -23,7 +30,146 @@ def prepare_docking_job(sequences, target_name):
     logger.info(f"Docking job file created at: {job_file}")
     
     # Generate a mock command string to run TCRDock
-    cmd = f"tcrdock --input {job_file} --output results/docking_output"
+    cmd = f"tcrdock --input {job_file} --output {os.path.join(os.path.dirname(job_dir), 'docking_output')}"
     logger.info(f"Run command: {cmd}")
     
     return job_file
+
+def read_docking_job(job_file):
+    """Rows of a job file written by prepare_docking_job, as dicts."""
+    with open(job_file, newline="") as f:
+        return list(csv.DictReader(f))
+
+def _attempt(command, log, cwd, timeout):
+    """One run of a docking command; returns (status, exit code)."""
+    try:
+        # Own process group, so a timeout also kills anything the tool spawned
+        proc = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, cwd=cwd, start_new_session=True)
+    except OSError as e:
+        # Missing or non-executable tool: a failed attempt, like a non-zero exit
+        log.write(f"{e}\n")
+        return "failed", None
+    try:
+        returncode = proc.wait(timeout=timeout)
+        return ("ok" if returncode == 0 else "failed"), returncode
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass  # exited just as the timeout fired
+        return "timeout", proc.wait()
+
+def _clear_outputs(task_dir, keep=("input.csv", "dock.log")):
+    """Removes everything an earlier attempt or run left in task_dir (result.json included)."""
+    for name in os.listdir(task_dir):
+        if name in keep:
+            continue
+        path = os.path.join(task_dir, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+def _run_task(task, command, timeout, retries):
+    """
+    Runs one candidate's docking task in its own directory, retrying a
+    failed or timed-out attempt up to `retries` times. Every attempt's
+    stdout/stderr is appended to dock.log; the outcome (with `seconds`
+    over all attempts) goes to task.json.
+    """
+    task_dir = task["task_dir"]
+    log_path = os.path.join(task_dir, "dock.log")
+    result = {"id": task["id"], "cdr3_sequence": task["cdr3_sequence"], "task_dir": task_dir, "log": log_path}
+    start = time.perf_counter()
+    for attempt in range(1, retries + 2):
+        # Each attempt starts clean, so only its own outputs are collected
+        _clear_outputs(task_dir)
+        with open(log_path, "a") as log:
+            log.write(f"=== attempt {attempt}: {' '.join(shlex.quote(part) for part in command)}\n")
+            log.flush()
+            status, returncode = _attempt(command, log, task_dir, timeout)
+            log.write(f"=== attempt {attempt}: {status} (exit code {returncode})\n")
+        result.update(status=status, returncode=returncode, attempts=attempt,
+                      seconds=time.perf_counter() - start)
+        if status == "ok":
+            break
+        logger.warning(f"Docking {task['id']} ({task['cdr3_sequence']}) {status} on attempt {attempt}; see {log_path}")
+
+    # The tool may leave a result.json of its own (e.g. {"score": -11.2}); its fields are collected
+    tool_result = os.path.join(task_dir, "result.json")
+    if result["status"] == "ok" and os.path.exists(tool_result):
+        try:
+            with open(tool_result) as f:
+                result.update({k: v for k, v in json.load(f).items() if k not in result})
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read {tool_result}: {e}")
+    result["outputs"] = sorted(name for name in os.listdir(task_dir) if name not in ("input.csv", "dock.log", "task.json"))
+    with open(os.path.join(task_dir, "task.json"), "w") as f:
+        json.dump(result, f, indent=2)
+    return result
+
+def run_docking_job(job_file, executable="tcrdock", output_dir="results/docking_output", workers=2, timeout=1800,
+                    retries=1, args=None, rerun=False):
+    """
+    Executes a docking job file locally: each candidate becomes its own task
+    (a one-row input.csv in output_dir/<id>/) run as
+        <executable> --input input.csv --output <task dir> [args...]
+    with at most `workers` running at once and `timeout` seconds per
+    attempt. Tasks that already succeeded in an earlier call are skipped
+    unless `rerun`, so calling this again retries only the failures.
+    Returns one result dict per candidate (status ok | failed | timeout,
+    attempts, log and output files, plus any fields of the tool's own
+    result.json) and saves them to output_dir/docking_results.csv.
+    """
+    rows = read_docking_job(job_file)
+    fieldnames = list(rows[0].keys()) if rows else ["id", "cdr3_sequence", "target"]
+    base_command = shlex.split(executable) if isinstance(executable, str) else list(executable)
+    if os.sep in base_command[0]:
+        # Tasks run inside their own directories, so a relative tool path must not depend on it
+        base_command[0] = os.path.abspath(base_command[0])
+    logger.info(f"Docking {len(rows)} candidates with {base_command[0]} ({workers} parallel, {timeout}s timeout)...")
+
+    results, pending = {}, []
+    for row in rows:
+        task_dir = os.path.join(output_dir, row["id"])
+        done_file = os.path.join(task_dir, "task.json")
+        if not rerun and os.path.exists(done_file):
+            with open(done_file) as f:
+                previous = json.load(f)
+            if previous.get("status") == "ok" and previous.get("cdr3_sequence") == row["cdr3_sequence"]:
+                results[row["id"]] = previous
+                continue
+            if previous.get("cdr3_sequence") != row["cdr3_sequence"]:
+                # Same id, different candidate (a later design cycle): nothing of the old task applies
+                shutil.rmtree(task_dir)
+        os.makedirs(task_dir, exist_ok=True)
+        with open(os.path.join(task_dir, "input.csv"), "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerow(row)
+        command = base_command + ["--input", os.path.abspath(os.path.join(task_dir, "input.csv")),
+                                  "--output", os.path.abspath(task_dir)] + list(args or [])
+        pending.append((dict(row, task_dir=task_dir), command))
+    if len(results):
+        logger.info(f"  {len(results)} candidates already docked; skipping them.")
+
+    # Threads only supervise; the docking itself runs in the child processes
+    with ThreadPoolExecutor(max_workers=max(1, int(workers))) as pool:
+        futures = {pool.submit(_run_task, task, command, timeout, retries): task["id"] for task, command in pending}
+        for future in as_completed(futures):
+            result = future.result()
+            results[result["id"]] = result
+            logger.info(f"  {result['id']} ({result['cdr3_sequence']}): {result['status']} "
+                        f"after {result['attempts']} attempt(s), {result['seconds']:.1f}s")
+
+    ordered = [results[row["id"]] for row in rows]
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, "docking_results.csv")
+    columns = list(dict.fromkeys(key for result in ordered for key in result if key != "outputs"))
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(ordered)
+    failed = sum(r["status"] != "ok" for r in ordered)
+    logger.info(f"Docking finished: {len(ordered) - failed}/{len(ordered)} succeeded; results in {path}")
+    return ordered
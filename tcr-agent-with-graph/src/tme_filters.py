@@ -1,8 +1,97 @@
-from Bio.SeqUtils.ProtParam import ProteinAnalysis
+import time
+import logging
+import numpy as np
+from src.property_engine import PropertyEngine
+from src.motif_scanner import MotifScanner, MotifHits
+from src.candidate_table import REJECTED, PASSED
+
+logger = logging.getLogger(__name__)
+
+# rejected_by code for empty / non-canonical sequences
+INVALID = -2
+
+# Rough seconds per sequence for each check, used to order checks until they have been measured
+_PRIOR_COST = {
+    'tonic_signaling_risk': 1e-6,
+    'net_charge': 2e-6,
+    'isoelectric_point': 4e-6,
+    'motif_ban': 1e-6,
+}
+
+def _format_hits(hits):
+    # 1-based residue positions, e.g. "NG@5, N[^P][ST]@9"
+    return ", ".join(f"{motif}@{pos + 1}" for motif, pos in hits)
+
+class ConstraintStage:
+    """
+    One compiled tme_constraints entry with its running counters. Stages are
+    ordered by expected cost per rejection (seconds per sequence divided by
+    the rejection rate), the order that minimises total work for
+    independent checks.
+    """
+
+    def __init__(self, index, constraint):
+        self.index = index
+        self.constraint = constraint
+        self.name = constraint['constraint']
+        self.evaluated = 0
+        self.rejected = 0
+        self.seconds = 0.0
+        self.prior_cost = _PRIOR_COST.get(self.name, 1e-6)
+        # motif_ban lists are compiled once into a single automaton
+        self.scanner = MotifScanner(constraint.get('motifs', [])) if self.name == 'motif_ban' else None
+
+    def record(self, evaluated, rejected, seconds):
+        self.evaluated += evaluated
+        self.rejected += rejected
+        self.seconds += seconds
+
+    def cost_per_rejection(self):
+        cost = self.seconds / self.evaluated if self.evaluated else self.prior_cost
+        # Laplace-smoothed so unmeasured or never-failing checks aren't infinitely expensive
+        rejection_rate = (self.rejected + 1) / (self.evaluated + 2)
+        return cost / rejection_rate
+
+    def stats(self):
+        return {
+            "constraint": self.name,
+            "config_index": self.index,
+            "evaluated": self.evaluated,
+            "rejected": self.rejected,
+            "rejection_rate": self.rejected / self.evaluated if self.evaluated else 0.0,
+            "seconds": self.seconds,
+            "us_per_sequence": 1e6 * self.seconds / self.evaluated if self.evaluated else 0.0,
+        }
 
 class TMEFilter:
-    def __init__(self, config):
+    def __init__(self, config, property_cache=None):
         self.constraints = config.get('tme_constraints', [])
+        charge_ph = next((c.get('ph', 7.0) for c in self.constraints if c['constraint'] == 'net_charge'), 7.0)
+        self.engine = PropertyEngine(charge_ph=charge_ph)
+        # Optional PropertyCache shared with other filters (batch runs over several targets)
+        self.property_cache = property_cache
+
+        # The tonic signaling check always runs (threshold defaults to 0.5 if not in config)
+        if not any(c['constraint'] == 'tonic_signaling_risk' for c in self.constraints):
+            self.constraints = [{'constraint': 'tonic_signaling_risk', 'threshold': 0.5}] + list(self.constraints)
+
+        known = ('tonic_signaling_risk', 'isoelectric_point', 'net_charge', 'motif_ban')
+        for c in self.constraints:
+            if c['constraint'] not in known:
+                logger.warning(f"Unknown TME constraint '{c['constraint']}' will be ignored.")
+
+        # 'adaptive' re-orders checks from measured cost and rejection rate; 'config' keeps list order
+        order = config.get('filter_parameters', {}).get('order', 'adaptive')
+        if order not in ('adaptive', 'config'):
+            raise ValueError(f"Unknown filter order '{order}' (expected 'adaptive' or 'config')")
+        self.order = order
+        self.stages = [ConstraintStage(i, c) for i, c in enumerate(self.constraints) if c['constraint'] in known]
+        if order == 'adaptive':
+            self.stages.sort(key=ConstraintStage.cost_per_rejection)
+        self.sequences_seen = 0
+        self.invalid = 0
+        # Callables receiving (sequences, props, rejected_by, logs) after each apply_all batch
+        self.listeners = []
 
     def check_exhaustion_risk(self, sequence):
         """
@@ -10,45 +99,194 @@ class TMEFilter:
         driving T-cells to exhaustion even without antigen.
         We filter out 'sticky' sequences.
         """
+        from Bio.SeqUtils.ProtParam import ProteinAnalysis  # deferred: batches use PropertyEngine
         analysis = ProteinAnalysis(sequence)
         gravy_score = analysis.gravy() # Grand Average of Hydropathy
-        
+
         # Threshold: Lower is less hydrophobic (better)
         # If score > threshold, risk of tonic signaling is HIGH.
         threshold = next((c['threshold'] for c in self.constraints if c['constraint'] == 'tonic_signaling_risk'), 0.5)
-        
+
         if gravy_score > threshold:
             return False, f"Rejected: High Tonic Signaling Risk (GRAVY: {gravy_score:.2f})"
         return True, "Passed"
 
     def check_stability(self, sequence):
         """
-        Checks for instability motifs (e.g., NG deamidation sites) 
+        Checks for instability motifs (e.g., NG deamidation sites)
         that would degrade in the acidic TME.
         """
-        banned = next((c['motifs'] for c in self.constraints if c['constraint'] == 'motif_ban'), [])
-        for motif in banned:
-            if motif in sequence:
-                return False, f"Rejected: Unstable Motif ({motif})"
+        for stage in self.stages:
+            if stage.scanner is not None:
+                hits = stage.scanner.scan_sequence(sequence, self.engine.lut)
+                if hits:
+                    return False, f"Rejected: Unstable Motif ({_format_hits(hits)})"
         return True, "Passed"
 
+    def evaluate(self, sequences):
+        """
+        Runs the compiled constraint stages over the batch as vector masks,
+        each stage only on the sequences every earlier stage passed. Returns
+        (properties, rejected_by): the PropertyEngine arrays (NaN where a
+        property was never needed, plus 'banned_motif', index of the earliest
+        banned motif hit or -1, and 'motif_hits', MotifHits per motif_ban
+        constraint index) and an int array holding, per sequence, the
+        config index of the constraint that rejected it, -1 if it passed, or
+        INVALID for empty / non-canonical sequences. With adaptive ordering a
+        sequence failing several checks is attributed to whichever ran first.
+        """
+        codes, offsets = self.engine.encode(sequences)
+        return self._evaluate_codes(sequences, codes, offsets)
+
+    def _evaluate_codes(self, sequences, codes, offsets):
+        # evaluate() on an already encoded batch; sequences are only read by the property cache
+        n = len(offsets) - 1
+        starts, lengths = offsets[:-1], np.diff(offsets)
+        valid = self.engine.valid_mask(codes, offsets)
+        props = {"length": lengths, "valid": valid}
+        for name in ("gravy", "net_charge", "pi"):
+            props[name] = np.full(n, np.nan)
+        props['banned_motif'] = np.full(n, -1, dtype=np.int32)
+        props['motif_hits'] = {}
+
+        rejected_by = np.where(valid, -1, INVALID).astype(np.int32)
+        alive = np.flatnonzero(valid)
+        for stage in self.stages:
+            if not len(alive):
+                break
+            t0 = time.perf_counter()
+            fail = self._fail_mask(stage, props, sequences, codes, starts[alive], lengths[alive], alive)
+            stage.record(len(alive), int(fail.sum()), time.perf_counter() - t0)
+            rejected_by[alive[fail]] = stage.index
+            alive = alive[~fail]
+
+        self.sequences_seen += n
+        self.invalid += n - int(valid.sum())
+        if self.order == 'adaptive':
+            self._reorder()
+        return props, rejected_by
+
+    def _reorder(self):
+        previous = [stage.name for stage in self.stages]
+        # Stable sort: ties keep the current order
+        self.stages.sort(key=ConstraintStage.cost_per_rejection)
+        current = [stage.name for stage in self.stages]
+        if current != previous:
+            logger.debug(f"TME filter order is now: {' -> '.join(current)}")
+
+    def _property(self, name, compute, sequences, codes, starts, lengths, idx):
+        # compute(codes, starts, lengths) for the sequences at idx, via the shared cache if any.
+        # Only pI (bisection, ~1 us/seq) is cached: a lookup costs more than GRAVY or net charge.
+        if self.property_cache is None:
+            return compute(codes, starts, lengths)
+        return self.property_cache.get_many(
+            name, [sequences[k] for k in idx.tolist()],
+            lambda missing: compute(codes, starts[missing], lengths[missing])
+        )
+
+    def _fail_mask(self, stage, props, sequences, codes, starts, lengths, idx):
+        """
+        Fail mask over the sequences at `idx` (given by their starts/lengths),
+        storing the property it computed into props at those positions.
+        """
+        constraint, name = stage.constraint, stage.name
+        if name == 'tonic_signaling_risk':
+            gravy = props['gravy'][idx] = self.engine.gravy(codes, starts, lengths)
+            return gravy > constraint.get('threshold', 0.5)
+        if name == 'isoelectric_point':
+            low, high = constraint['range']
+            pi = props['pi'][idx] = self._property('pi', self.engine.isoelectric_point, sequences, codes, starts, lengths, idx)
+            return (pi < low) | (pi > high)
+        if name == 'net_charge':
+            low, high = constraint['range']
+            charge = props['net_charge'][idx] = self.engine.net_charge(codes, starts, lengths)
+            return (charge < low) | (charge > high)
+        if name == 'motif_ban':
+            hits = stage.scanner.scan(codes, starts, lengths)
+            first = hits.first_motif(len(idx))
+            props['banned_motif'][idx] = first
+            # idx is increasing, so mapping rows keeps the hits sorted
+            props['motif_hits'][stage.index] = MotifHits(idx[hits.rows], hits.motifs, hits.positions)
+            return first >= 0
+        return np.zeros(len(idx), dtype=bool)
+
+    def stats(self):
+        """
+        Per-constraint counters (evaluated, rejected, time spent), in the
+        current evaluation order.
+        """
+        return {
+            "order": self.order,
+            "sequences": self.sequences_seen,
+            "invalid": self.invalid,
+            "constraints": [stage.stats() for stage in self.stages],
+        }
+
+    def describe_rejection(self, rejected_by, props, k):
+        """
+        Human-readable rejection reason for sequence k (None if it passed).
+        """
+        i = rejected_by[k]
+        if i == -1:
+            return None
+        if i == INVALID:
+            return "Rejected: Empty or Non-canonical Sequence"
+        c = self.constraints[i]
+        name = c['constraint']
+        if name == 'tonic_signaling_risk':
+            return f"Rejected: High Tonic Signaling Risk (GRAVY: {props['gravy'][k]:.2f})"
+        if name == 'isoelectric_point':
+            return f"Rejected: Isoelectric Point out of range (pI: {props['pi'][k]:.2f})"
+        if name == 'net_charge':
+            return f"Rejected: Net Charge out of range (charge: {props['net_charge'][k]:.2f})"
+        motifs = c['motifs']
+        hits = [(motifs[m], pos) for m, pos in props['motif_hits'][i].for_sequence(k)]
+        return f"Rejected: Unstable Motif ({_format_hits(hits)})"
+
+    def motif_hits_text(self, props):
+        """
+        {sequence index: "NG@4, NS@9"} for every sequence with motif hits
+        (over all motif_ban constraints it was checked against).
+        """
+        hits = {}
+        for i, motif_hits in props['motif_hits'].items():
+            motifs = self.constraints[i]['motifs']
+            for k, m, pos in zip(motif_hits.rows.tolist(), motif_hits.motifs.tolist(), motif_hits.positions.tolist()):
+                hits.setdefault(k, []).append((motifs[m], pos))
+        return {k: _format_hits(h) for k, h in hits.items()}
+
     def apply_all(self, sequences):
-        passed_sequences = []
-        logs = []
-        
-        for seq in sequences:
-            # 1. Exhaustion Check
-            ok_ex, msg_ex = self.check_exhaustion_risk(seq)
-            if not ok_ex:
-                logs.append(msg_ex)
-                continue
-                
-            # 2. Stability Check
-            ok_stab, msg_stab = self.check_stability(seq)
-            if not ok_stab:
-                logs.append(msg_stab)
-                continue
-                
-            passed_sequences.append(seq)
-            
+        props, rejected_by = self.evaluate(sequences)
+        passed_sequences = [seq for seq, r in zip(sequences, rejected_by.tolist()) if r == -1]
+        logs = [self.describe_rejection(rejected_by, props, k) for k in np.flatnonzero(rejected_by != -1)]
+        # Copy: a listener may unregister itself
+        for listener in list(self.listeners):
+            listener(sequences, props, rejected_by, logs)
         return passed_sequences, logs
+
+    def filter_table(self, table, idx=None, chunk_size=65536):
+        """
+        apply_all for a CandidateTable: evaluates rows `idx` (default all)
+        straight from the residue buffer, chunk by chunk, records each row's
+        properties, status and rejecting constraint in the table's columns
+        and returns the row indices of the survivors. Listeners receive a
+        lazy view of each chunk's sequences; rejection messages are only
+        built when someone is listening.
+        """
+        idx = np.arange(len(table)) if idx is None else np.asarray(idx, dtype=np.int64)
+        survivors = []
+        for start in range(0, len(idx), chunk_size):
+            rows = idx[start:start + chunk_size]
+            residues, offsets = table.packed(rows)
+            sequences = table.view(rows)
+            props, rejected_by = self._evaluate_codes(sequences, self.engine.lut[residues], offsets)
+            for name in ("gravy", "pi", "net_charge"):
+                table.set(name, rows, props[name])
+            table.set("rejected_by", rows, rejected_by)
+            table.set("status", rows, np.where(rejected_by == -1, PASSED, REJECTED))
+            if self.listeners:
+                logs = [self.describe_rejection(rejected_by, props, k) for k in np.flatnonzero(rejected_by != -1)]
+                for listener in list(self.listeners):
+                    listener(sequences, props, rejected_by, logs)
+            survivors.append(rows[rejected_by == -1])
+        return np.concatenate(survivors) if survivors else np.empty(0, dtype=np.int64)
@@ -0,0 +1,40 @@
+import numpy as np
+
+def rank_data(values):
+    """
+    1-based ranks with ties given their average rank (same as scipy.stats.rankdata).
+    """
+    values = np.asarray(values, dtype=float)
+    order = np.argsort(values, kind="mergesort")
+    _, starts, counts = np.unique(values[order], return_index=True, return_counts=True)
+    ranks = np.empty(len(values))
+    ranks[order] = np.repeat(starts + (counts + 1) / 2.0, counts)
+    return ranks
+
+def spearman_rho(a, b):
+    """
+    Spearman rank correlation. NaN if either input is constant.
+    """
+    ra, rb = rank_data(a), rank_data(b)
+    if len(ra) < 2 or ra.std() == 0 or rb.std() == 0:
+        return float("nan")
+    return float(np.corrcoef(ra, rb)[0, 1])
+
+def kendall_tau(a, b):
+    """
+    Kendall tau-b over all pairs. O(n^2) memory, intended for calibration-sized samples.
+    """
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    i, j = np.triu_indices(len(a), k=1)
+    da, db = np.sign(a[i] - a[j]), np.sign(b[i] - b[j])
+    denom = np.sqrt(np.count_nonzero(da) * np.count_nonzero(db))
+    return float((da * db).sum() / denom) if denom else float("nan")
+
+def top_n_overlap(ranked_a, ranked_b, n):
+    """
+    Fraction of the first n items of ranked_a that also appear in the first n of ranked_b.
+    """
+    n = min(n, len(ranked_a), len(ranked_b))
+    if n == 0:
+        return float("nan")
+    return len(set(ranked_a[:n]) & set(ranked_b[:n])) / n
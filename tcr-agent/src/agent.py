@@ -10,7 +10,8 @@ class ImmunotherapyAgent:
     def __init__(self, config_path):
         with open(config_path) as f: self.config = yaml.safe_load(f)
         self.filter = TMEFilter(self.config)
-        self.ranker = TCRRanker()
+        ranker_params = self.config.get('ranker_parameters', {})
+        self.ranker = TCRRanker(max_batch_size=ranker_params.get('max_batch_size', 128))
         self.logger = logging.getLogger("AI-AGENT")
 
     def run_design_cycle(self):
@@ -5,27 +5,95 @@ import logging
 logger = logging.getLogger(__name__)
 
 class TCRRanker:
-    def __init__(self, model_path="wukevin/tcr-bert-mlm-only"):
+    def __init__(self, model_path="wukevin/tcr-bert-mlm-only", max_batch_size=128):
         self.tokenizer = BertTokenizer.from_pretrained(model_path)
         self.model = BertForMaskedLM.from_pretrained(model_path)
         self.model.eval()
+        # Max masked variants (rows) per forward pass
+        self.max_batch_size = max(1, int(max_batch_size))
 
     def score_sequences(self, sequences):
-        scored = []
+        encoded = {}
         for seq in sequences:
             try:
-                pll = self._calculate_pll(seq)
-                scored.append((seq, pll))
+                encoded[seq] = self._encode(seq)
             except:
-                scored.append((seq, -99.9))
+                pass
+
+        try:
+            plls = self._calculate_pll_batched(list(encoded), list(encoded.values()))
+        except:
+            # Fall back to the per-sequence loop so one bad input doesn't sink the batch
+            plls = {}
+            for seq in encoded:
+                try:
+                    plls[seq] = self._calculate_pll(seq)
+                except:
+                    pass
+
+        scored = [(seq, plls.get(seq, -99.9)) for seq in sequences]
         
         # Sort descending (Higher/Closer to 0 is better)
         scored.sort(key=lambda x: x[1], reverse=True)
         return scored
 
-    def _calculate_pll(self, sequence):
+    def _encode(self, sequence):
         # Format for TCR-BERT: "C A S S ..."
         text = " ".join(list(sequence))
+        return self.tokenizer(text, return_tensors="pt")["input_ids"][0]
+
+    def _calculate_pll_batched(self, sequences, encoded):
+        # All L masked variants of a sequence form one [L, seq_len] block; blocks of
+        # similar length are packed into padded batches of <= max_batch_size rows.
+        totals = [0.0] * len(sequences)
+        order = sorted(range(len(sequences)), key=lambda k: encoded[k].size(0))
+
+        pending, pending_rows = [], 0
+        for k in order:
+            ids = encoded[k]
+            n = ids.size(0) - 2 # Skip CLS/SEP
+            variants = ids.unsqueeze(0).repeat(n, 1)
+            variants[torch.arange(n), torch.arange(1, n + 1)] = self.tokenizer.mask_token_id
+            for start in range(0, n, self.max_batch_size):
+                chunk = variants[start:start + self.max_batch_size]
+                if pending_rows + chunk.size(0) > self.max_batch_size:
+                    self._run_masked_batch(pending, encoded, totals)
+                    pending, pending_rows = [], 0
+                pending.append((k, start + 1, chunk))
+                pending_rows += chunk.size(0)
+        if pending:
+            self._run_masked_batch(pending, encoded, totals)
+
+        return {seq: totals[k] / len(seq) for k, seq in enumerate(sequences) if seq}
+
+    def _run_masked_batch(self, pending, encoded, totals):
+        n_rows = sum(chunk.size(0) for _, _, chunk in pending)
+        width = max(chunk.size(1) for _, _, chunk in pending)
+        input_ids = torch.full((n_rows, width), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((n_rows, width), dtype=torch.long)
+        owners, positions, targets = [], [], []
+
+        row = 0
+        for k, first_pos, chunk in pending:
+            n, w = chunk.shape
+            input_ids[row:row + n, :w] = chunk
+            attention_mask[row:row + n, :w] = 1
+            pos = list(range(first_pos, first_pos + n))
+            owners.extend([k] * n)
+            positions.extend(pos)
+            targets.extend(encoded[k][pos].tolist())
+            row += n
+
+        with torch.no_grad():
+            logits = self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+        rows = torch.arange(n_rows)
+        log_probs = torch.nn.functional.log_softmax(logits[rows, torch.tensor(positions)], dim=-1)
+        for k, lp in zip(owners, log_probs[rows, torch.tensor(targets)].tolist()):
+            totals[k] += lp
+
+    def _calculate_pll(self, sequence):
+        # Reference per-position loop; the batched path must match it within float tolerance
+        text = " ".join(list(sequence))
         inputs = self.tokenizer(text, return_tensors="pt")
         input_ids = inputs["input_ids"]
         
@@ -10,6 +10,8 @@ class TMEFilter:
         
         # Threshold defaults to 0.5 if not in config
         threshold = next((c['threshold'] for c in self.constraints if c['constraint'] == 'tonic_signaling_risk'), 0.5)
+        # Deamidation motifs default to NG/NS if motif_ban is not in config
+        banned = next((c['motifs'] for c in self.constraints if c['constraint'] == 'motif_ban'), ["NG", "NS"])
 
         for seq in sequences:
             # 1. Hydrophobicity Check (Tonic Signaling)
@@ -23,8 +25,9 @@ class TMEFilter:
                 continue # Skip invalid sequences
 
             # 2. Stability Check (Motifs)
-            if "NG" in seq or "NS" in seq:
-                 logs.append(f"Rejected {seq}: Unstable Motif")
+            motif = next((m for m in banned if m in seq), None)
+            if motif:
+                 logs.append(f"Rejected {seq}: Unstable Motif ({motif})")
                  continue
                 
             passed_sequences.append(seq)